@@ -2,66 +2,178 @@
 @author: yuan.shao
 """
 import re
-from copy import deepcopy
-from typing import Dict, List, Tuple, Union
-
-import requests
+from array import array
+from threading import Lock
+from typing import Dict, List, Optional, Tuple, Union
 
+from idset import IdSet
+from metrics import REGISTRY
 from utils import MP_WEBSITE, replace_special_chars
+from web import fetch
 
+# (area id, area name, location chain)
+AreaTask = Tuple[str, str, List[str]]
+# (id, name) of a route or area linked from an area page.
+Link = Tuple[int, str]
+# (display name, latitude, longitude, routes, areas) of an area page. An area
+# page lists either the routes or the areas under it.
+AreaPage = Tuple[str, str, str, List[Link], List[Link]]
 
-def read_an_area(
-    area_id: str,
-    area_name: str,
-    location_chain: List[str],
-) -> Tuple[
-    Dict[str, Union[str, List[str]]],
-    List[Tuple[str, str, List[str]]],
-    List[Dict[str, Union[str, List[str]]]],
-]:
+
+def read_an_area(area_id: Union[int, str], area_name: str) -> AreaPage:
+    """
+    Read the area page of the given area. Return its parsed information with
+    the routes or other areas under it.
     """
-    Read the area page of the given area. Return the parsed information of this
-    area, the list of other areas under this area, and the list of routes under
-    this area.
+    html = fetch(f'{MP_WEBSITE}/area/{area_id}/{area_name}', 'area')
+    with REGISTRY.histogram('parse_seconds', kind='area').time():
+        return parse_area_page(html)
+
+
+def parse_area_page(html: str) -> AreaPage:
+    """
+    Parse an area page as read_an_area returns it. The ids of the routes and
+    areas under it are parsed to integers.
     """
-    next_areas = []
-    routes = []
-    
-    response = requests.get(f'{MP_WEBSITE}/area/{area_id}/{area_name}')
-    html = str(response.content)
-    
     display_name = ''
     display_name_read = re.findall(r'<h1>\\n(.*?)\\n', html)
     if display_name_read:
         display_name = replace_special_chars(display_name_read[0].strip())
-    
+
     gps = re.findall(r'maps\?q=([\d\.]+),([\d\.-]+)', html)
     latitude = ''
     longitude = ''
     if gps:
         latitude = gps[0][0]
         longitude = gps[0][1]
-    
-    this_area = build_area_map(
-        area_id, area_name, display_name, latitude, longitude, location_chain,
-    )
 
     # Read routes or areas under this area.
     s = html[html.find('Show all routes'):html.find('Show All Routes')]
-    rts = set(re.findall(rf'<a href="{MP_WEBSITE}/route/(\d+)/([\w-]+)">', s))
-    rts_no_name = set(re.findall(rf'<a href="{MP_WEBSITE}/route/(\d+)">', s))
-    for r in rts_no_name:
-        rts.add((r, ''))
-    ars = set(re.findall(rf'<a href="{MP_WEBSITE}/area/(\d+)/([\w-]+)">', s))
-    if rts:
-        for r in rts:
-            routes.append(build_route_map(r[0], r[1], location_chain))
-    elif ars:
-        for a in ars:
-            new_chain = deepcopy(location_chain)
-            new_chain.append(a[0])
-            next_areas.append((a[0], a[1], new_chain))
-    return this_area, next_areas, routes
+    rts = {
+        (int(r), n) for r, n in
+        re.findall(rf'<a href="{MP_WEBSITE}/route/(\d+)/([\w-]+)">', s)
+    }
+    for r in re.findall(rf'<a href="{MP_WEBSITE}/route/(\d+)">', s):
+        rts.add((int(r), ''))
+    ars = set()
+    if not rts:
+        ars = {
+            (int(a), n) for a, n in
+            re.findall(rf'<a href="{MP_WEBSITE}/area/(\d+)/([\w-]+)">', s)
+        }
+    return display_name, latitude, longitude, list(rts), list(ars)
+
+
+class AreaTree:
+    """
+    Compact record of the areas and routes found by a crawl, its frontier.
+    Ids are parsed to integers once. Every area is a node with its id, name
+    and parent node in arrays, so its location chain is a walk up the
+    parents instead of a list kept with every area task and route, and an
+    area task is just its node. Routes are kept as arrays of their ids and
+    area nodes, with their names. The str maps of areas and routes are only
+    built once the crawl is done, to be stored.
+    """
+    ROOT = -1
+
+    def __init__(self) -> None:
+        self.area_ids = array('Q')
+        self.parents = array('l')
+        self.area_names = []
+        # Parsed from the area page once read, None until then.
+        self.pages = []
+        self.read = IdSet()  # ids of the areas read
+        self.route_ids = array('Q')
+        self.route_nodes = array('l')
+        self.route_names = []
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.area_ids)
+
+    def add_area(self, area_id: int, area_name: str, parent: int) -> int:
+        """
+        Add an area found under the parent node. Return its node.
+        """
+        with self.lock:
+            node = len(self.area_ids)
+            self.area_ids.append(area_id)
+            self.parents.append(parent)
+            self.area_names.append(area_name)
+            self.pages.append(None)
+        return node
+
+    def add_task(self, task: AreaTask) -> int:
+        """
+        Add an area task, with the areas of its location chain as ancestors
+        not to be read. Return its node.
+        """
+        area_id, area_name, location_chain = task
+        node = self.ROOT
+        for a in location_chain[:-1]:
+            node = self.add_area(int(a), '', node)
+        return self.add_area(int(area_id), area_name, node)
+
+    def set_page(self, node: int, page: AreaPage) -> Optional[List[int]]:
+        """
+        Record the area page read for a node, adding the routes and areas
+        under it. Return the nodes of the areas under it, or None if its area
+        was read before under another node.
+        """
+        display_name, latitude, longitude, rts, ars = page
+        with self.lock:
+            if self.area_ids[node] in self.read:
+                return None
+            self.read.add(self.area_ids[node])
+            self.pages[node] = (display_name, latitude, longitude)
+            for route_id, route_name in rts:
+                self.route_ids.append(route_id)
+                self.route_nodes.append(node)
+                self.route_names.append(route_name)
+        return [self.add_area(a, n, node) for a, n in ars]
+
+    def chain(self, node: int) -> List[str]:
+        res = []
+        while node != self.ROOT:
+            res.append(str(self.area_ids[node]))
+            node = self.parents[node]
+        res.reverse()
+        return res
+
+    def task(self, node: int) -> AreaTask:
+        return (
+            str(self.area_ids[node]), self.area_names[node], self.chain(node),
+        )
+
+    def areas(self) -> Dict[str, Dict[str, Union[str, List[str]]]]:
+        """
+        Return the maps of the areas read by area id.
+        """
+        res = dict()
+        for node, page in enumerate(self.pages):
+            if page is not None:
+                area_id, area_name, location_chain = self.task(node)
+                res[area_id] = build_area_map(
+                    area_id, area_name, *page, location_chain,
+                )
+        return res
+
+    def routes(self) -> List[Dict[str, Union[str, List[str]]]]:
+        """
+        Return the maps of the routes found, the routes of an area sharing
+        one location chain.
+        """
+        chains = dict()
+        res = []
+        for route_id, node, route_name in zip(
+            self.route_ids, self.route_nodes, self.route_names,
+        ):
+            if node not in chains:
+                chains[node] = self.chain(node)
+            res.append(
+                build_route_map(str(route_id), route_name, chains[node]),
+            )
+        return res
 
 
 def build_area_map(
@@ -0,0 +1,716 @@
+"""
+@author: yuan.shao
+"""
+import getopt
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from inspect import signature
+from time import localtime, perf_counter, strftime, time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from area import AreaTree, build_area_map, build_route_map, parse_area_page
+from crawler import area_seeds, crawl_areas, crawl_route_details
+from fixtures import Corpus
+from geo import GeoIndex, haversine_km
+from hierarchy import AreaHierarchy
+from idset import IdSet
+from loader import (
+    df_from_routes, load_areas, load_route_details, load_routes,
+)
+from metrics import bucket_quantile, Histogram, REGISTRY
+from output import build_outputs, OUTPUT_DIR
+from query import index_areas
+from route import Route
+from stub_server import StubServer
+from synthetic import make_areas_and_routes, make_route_details, make_routes
+from text_analyzer import SMALL, TextAnalyzer
+from utils import STATES
+
+NUM_ROUTES = 250000
+NUM_COMMENTS = 10
+# Fixture routes of the parse and crawl benchmarks, and the latency added
+# by the stub server to every page of the crawl benchmark, in seconds.
+PARSE_ROUTES = 500
+CRAWL_ROUTES = 2000
+CRAWL_THREADS = 100
+LATENCY = 0.05
+JITTER = 0.05
+# Routes of the synthetic tree the id structures are measured on.
+IDS_ROUTES = 300000
+# Results of every run are appended here, to compare runs over time.
+RESULTS_FILE = f'{OUTPUT_DIR}/benchmarks.jsonl'
+
+
+def benchmark_load(
+    num_routes: int = NUM_ROUTES, baseline: bool = True,
+) -> Dict[str, float]:
+    """
+    Write synthetic areas, routes and route details pickles with num_routes
+    routes, then time loading them back with the columnar loader and, if
+    baseline is set, with the iterrows() loop update.py used before.
+    """
+    areas, routes = make_areas_and_routes(num_routes)
+    route_details = make_route_details(routes, areas)
+    print(
+        f'Synthetic dataset: {len(areas)} areas, {len(routes)} routes, '
+        f'{len(route_details)} route details'
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        areas_file = os.path.join(tmp, 'areas.pkl')
+        routes_file = os.path.join(tmp, 'routes.pkl')
+        route_details_file = os.path.join(tmp, 'route_details.pkl')
+        pd.DataFrame(list(areas.values())).to_pickle(areas_file)
+        pd.DataFrame(routes).to_pickle(routes_file)
+        pd.DataFrame(route_details).to_pickle(route_details_file)
+        del areas, routes, route_details
+
+        start_time = time()
+        loaded_areas = load_areas(areas_file)
+        loaded_routes = load_routes(routes_file)
+        loaded_details = load_route_details(route_details_file)
+        columnar = time() - start_time
+        res = {'columnar_s': columnar}
+        print(
+            f'Columnar loader: {columnar:.2f}s for {len(loaded_areas)} areas, '
+            f'{len(loaded_routes)} routes, {len(loaded_details)} route details'
+        )
+        del loaded_areas, loaded_routes, loaded_details
+
+        if baseline:
+            start_time = time()
+            df = pd.read_pickle(areas_file)
+            loaded_areas = {
+                row['area_id']: row.to_dict() for _, row in df.iterrows()
+            }
+            df = pd.read_pickle(routes_file)
+            loaded_routes = [row.to_dict() for _, row in df.iterrows()]
+            df = pd.read_pickle(route_details_file)
+            loaded_details = [row.to_dict() for _, row in df.iterrows()]
+            iterrows = time() - start_time
+            res['iterrows_s'] = iterrows
+            print(
+                f'iterrows() loader: {iterrows:.2f}s for {len(loaded_areas)} '
+                f'areas, {len(loaded_routes)} routes, {len(loaded_details)} '
+                f'route details ({iterrows / max(columnar, 1e-9):.1f}x slower)'
+            )
+    return res
+
+
+def peak_rss_mb(target: Callable, *args) -> float:
+    """
+    Run target(*args) in a fresh child process and return the peak resident
+    set size of that process in MB.
+    """
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+
+    def run() -> None:
+        target(*args)
+        queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    process = ctx.Process(target=run)
+    process.start()
+    max_rss = queue.get()
+    process.join()
+    return rss_mb(max_rss)
+
+
+def rss_mb(max_rss: int) -> float:
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def route_details_phase(num_routes: int, compact: bool) -> None:
+    """
+    Mimic the route details phase of update.py on synthetic routes: keep every
+    route read, then write the route details DataFrame. The old path keeps a
+    to_map() dict per route; the compact path keeps the Route records with
+    their raw text released.
+    """
+    areas, routes = make_areas_and_routes(num_routes)
+    route_details = []
+    for r in make_routes(routes, areas, num_comments=NUM_COMMENTS):
+        if compact:
+            r.release_text()
+            route_details.append(r)
+        else:
+            route_details.append(r.to_map())
+    if compact:
+        df = df_from_routes(route_details)
+    else:
+        df = pd.DataFrame(route_details).reset_index(drop=True)
+    assert len(df) == num_routes
+
+
+def benchmark_memory(
+    num_routes: int = NUM_ROUTES, baseline: bool = True,
+) -> Dict[str, float]:
+    """
+    Measure the peak RSS of the route details phase with compact Route records
+    and, if baseline is set, with a to_map() dict kept for every route.
+    """
+    compact = peak_rss_mb(route_details_phase, num_routes, True)
+    print(f'Compact Route records: peak RSS {compact:.0f} MB')
+    res = {'compact_rss_mb': compact}
+    if baseline:
+        maps = peak_rss_mb(route_details_phase, num_routes, False)
+        print(f'to_map() dicts: peak RSS {maps:.0f} MB')
+        res['maps_rss_mb'] = maps
+    return res
+
+
+def benchmark_output(
+    num_routes: int = NUM_ROUTES, baseline: bool = True,
+) -> Dict[str, float]:
+    """
+    Time the output stage on synthetic route details, with zero thresholds so
+    that every route with an output type goes through the whole pipeline.
+    """
+    areas, routes = make_areas_and_routes(num_routes)
+    route_details_df = df_from_routes(list(make_routes(routes, areas)))
+    areas_df = pd.DataFrame(list(areas.values()))
+    with tempfile.TemporaryDirectory() as tmp:
+        start_time = time()
+        build_outputs(
+            areas_df=areas_df,
+            route_details_df=route_details_df,
+            output_dir=tmp,
+            score_threshold=0,
+            votes_threshold=0,
+        )
+        seconds = time() - start_time
+        print(f'Output stage: {seconds:.2f}s')
+    return {'output_s': seconds}
+
+
+def benchmark_geo(
+    num_routes: int = NUM_ROUTES, baseline: bool = True,
+    num_queries: int = 1000,
+) -> Dict[str, float]:
+    """
+    Time building the spatial index over synthetic areas with num_routes
+    routes, then the latency of 50 km radius and 1x1 degree bounding box route
+    queries, and, if baseline is set, of a radius query scanning all routes.
+    """
+    areas, routes = make_areas_and_routes(num_routes)
+    start_time = time()
+    geo = GeoIndex(areas.values())
+    for r, route in enumerate(routes):
+        geo.add_route(r, route['location_chain'])
+    res = {'build_s': time() - start_time}
+    print(
+        f'Built spatial index of {len(geo.area_ids)} areas and '
+        f'{len(routes)} routes in {res["build_s"]:.2f}s'
+    )
+    rng = random.Random(0)
+    points = [
+        (rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0))
+        for _ in range(num_queries)
+    ]
+    for key, name, query in [
+        ('radius', '50 km radius', lambda p: geo.rows_within(p[0], p[1], 50)),
+        ('bbox', '1x1 degree bbox', lambda p: geo.rows_in_bbox(
+            (p[0], p[1], p[0] + 1, p[1] + 1)
+        )),
+    ]:
+        latencies, found = [], 0
+        for p in points:
+            start_time = time()
+            found += len(query(p))
+            latencies.append(time() - start_time)
+        print(
+            f'{name}: {found / num_queries:.0f} routes per query, '
+            f'{format_percentiles(latencies)}'
+        )
+        res.update(percentiles(latencies, f'{key}_'))
+    if baseline:
+        located = [
+            (r, geo.coordinates[a]) for r, a in enumerate(
+                geo.locate(route['location_chain']) for route in routes
+            ) if a is not None
+        ]
+        latencies = []
+        for p in points[:20]:
+            start_time = time()
+            [r for r, c in located if haversine_km(p[0], p[1], *c) <= 50]
+            latencies.append(time() - start_time)
+        print(f'50 km radius, full scan: {format_percentiles(latencies)}')
+        res.update(percentiles(latencies, 'scan_'))
+    return res
+
+
+def benchmark_parse(
+    num_routes: int = PARSE_ROUTES, baseline: bool = True,
+    keywords: bool = True,
+) -> Dict[str, float]:
+    """
+    Time the parsers of area.py and route.py on every page of a fixture
+    corpus with num_routes routes and, if keywords is set, generating the
+    keywords of every route from its comments and descriptions. Report the
+    pages per second and latency percentiles of every stage.
+    """
+    corpus = Corpus(num_routes)
+    # As fetch() returns them.
+    pages = {
+        kind: [str(corpus.page(path)) for path in paths]
+        for kind, paths in corpus.paths().items()
+    }
+    print(
+        f'Fixture corpus: {sum(len(p) for p in pages.values())} pages, '
+        f'{sum(len(h) for p in pages.values() for h in p) / 1e6:.1f} MB'
+    )
+    parsers = {
+        'area': parse_area_page,
+        'route': lambda h: Route.parse_route_page(h, ''),
+        'stats': Route.parse_stats_page,
+        'comments': Route.parse_comments_page,
+    }
+    res = dict()
+    parsed = dict()
+    for kind, parse in parsers.items():
+        parsed[kind] = []
+        latencies = []
+        for html in pages[kind]:
+            start_time = perf_counter()
+            parsed[kind].append(parse(html))
+            latencies.append(perf_counter() - start_time)
+        res.update(stage_result(kind, latencies))
+    if keywords:
+        text_analyzer = TextAnalyzer(SMALL)
+        latencies = []
+        for page, comments in zip(parsed['route'], parsed['comments']):
+            start_time = perf_counter()
+            Route.generate_keywords(
+                text_analyzer, comments + page['descriptions'], '', [],
+            )
+            latencies.append(perf_counter() - start_time)
+        res.update(stage_result('keywords', latencies))
+    return res
+
+
+def stage_result(stage: str, latencies: List[float]) -> Dict[str, float]:
+    """
+    Print and return the pages per second and latency percentiles of a
+    stage run once per page.
+    """
+    rate = len(latencies) / max(sum(latencies), 1e-9)
+    print(
+        f'{stage}: {len(latencies)} pages, {rate:.0f} pages/s, '
+        f'{format_percentiles(latencies)}'
+    )
+    res = {f'{stage}_pages_per_s': rate}
+    res.update(percentiles(latencies, f'{stage}_'))
+    return res
+
+
+def crawl_fixtures(
+    num_threads: int, keywords: bool, queue: multiprocessing.Queue,
+) -> None:
+    """
+    Crawl the areas and route details from the website in the MP_WEBSITE
+    environment variable, as update.py does, and put the timings, metrics and
+    peak RSS of the crawl in queue. Run in a fresh process, so MP_WEBSITE is
+    read when utils.py is imported.
+    """
+    text_analyzer = TextAnalyzer(SMALL) if keywords else None
+    start_time = perf_counter()
+    areas, routes, hierarchy = crawl_areas(
+        area_seeds(STATES), num_threads=num_threads,
+    )
+    areas_seconds = perf_counter() - start_time
+    start_time = perf_counter()
+    route_details = []
+    crawl_route_details(
+        routes, hierarchy, route_details,
+        text_analyzer=text_analyzer,
+        num_threads=num_threads,
+    )
+    queue.put({
+        'areas': len(areas),
+        'routes': len(route_details),
+        'areas_s': areas_seconds,
+        'route_details_s': perf_counter() - start_time,
+        'metrics': REGISTRY.snapshot(),
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def benchmark_crawl(
+    num_routes: int = CRAWL_ROUTES, baseline: bool = True,
+    keywords: bool = True,
+    latency: float = LATENCY,
+    jitter: float = JITTER,
+    error_rate: float = 0.0,
+    num_threads: int = CRAWL_THREADS,
+) -> Dict[str, float]:
+    """
+    Crawl a fixture corpus with num_routes routes end to end from a local stub
+    server, which adds latency plus up to jitter seconds to every page and
+    drops a share error_rate of the connections. Report the pages per second,
+    latency percentiles of fetching, parsing, keywords and tasks, and the peak
+    RSS of the crawl.
+    """
+    corpus = Corpus(num_routes)
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    website = os.environ.get('MP_WEBSITE')
+    server = StubServer(corpus, 0, latency, jitter, error_rate)
+    server.preload()
+    with server:
+        os.environ['MP_WEBSITE'] = server.website
+        try:
+            process = ctx.Process(
+                target=crawl_fixtures, args=(num_threads, keywords, queue),
+            )
+            process.start()
+            crawl = queue.get()
+            process.join()
+        finally:
+            if website is None:
+                os.environ.pop('MP_WEBSITE')
+            else:
+                os.environ['MP_WEBSITE'] = website
+        served = server.stats()
+
+    seconds = crawl['areas_s'] + crawl['route_details_s']
+    rss = rss_mb(crawl['max_rss'])
+    pages = {
+        m['labels']['kind']: m['count'] for m in crawl['metrics']
+        if m['name'] == 'fetch_seconds'
+    }
+    area_pages = pages.get('area', 0)
+    route_pages = sum(pages.values()) - area_pages
+    res = {
+        'pages_per_s': served['pages'] / seconds,
+        'area_pages_per_s': area_pages / crawl['areas_s'],
+        'route_pages_per_s': route_pages / crawl['route_details_s'],
+        'peak_rss_mb': rss,
+    }
+    print(
+        f"Crawled {crawl['areas']} areas and {crawl['routes']} routes in "
+        f'{seconds:.2f}s: {served["pages"]} pages '
+        f'({served["bytes"] / 1e6:.1f} MB), {served["errors"]} dropped, '
+        f"{res['pages_per_s']:.0f} pages/s. Areas {area_pages} pages, "
+        f"{res['area_pages_per_s']:.0f} pages/s. Route details "
+        f"{route_pages} pages, {res['route_pages_per_s']:.0f} pages/s. "
+        f'Peak RSS {rss:.0f} MB'
+    )
+    for m in crawl['metrics']:
+        labels = '_'.join(m['labels'].values())
+        name = f"{m['name']}_{labels}" if labels else m['name']
+        if m['type'] != Histogram.TYPE:
+            if m['name'].endswith('_total') and 'bytes' not in m['name']:
+                print(f"{name} = {m['value']:g}")
+                res[name] = m['value']
+            continue
+        if m['count'] == 0:
+            continue
+        quantiles = {
+            f'{name}_p{p}_ms': 1000 * bucket_quantile(m, p / 100)
+            for p in (50, 90, 99)
+        }
+        print(
+            f"{name}: count = {m['count']}, "
+            f"mean = {1000 * m['sum'] / m['count']:.1f}ms, "
+            + ', '.join(
+                f'p{p} <= {v:g}ms'
+                for p, v in zip((50, 90, 99), quantiles.values())
+            )
+        )
+        res[f'{name}_mean_ms'] = 1000 * m['sum'] / m['count']
+        res.update(quantiles)
+    return res
+
+
+def percentiles(latencies: List[float], prefix: str = '') -> Dict[str, float]:
+    """
+    Return the 50th, 90th and 99th percentiles of latencies given in seconds,
+    in milliseconds.
+    """
+    latencies = sorted(latencies)
+    res = dict()
+    for p in (50, 90, 99):
+        i = min(len(latencies) - 1, int(p / 100 * len(latencies)))
+        res[f'{prefix}p{p}_ms'] = 1000 * latencies[i]
+    return res
+
+
+def format_percentiles(latencies: List[float]) -> str:
+    """
+    Format the 50th, 90th and 99th percentiles of latencies given in seconds.
+    """
+    return ', '.join(
+        f'{k[:-3]} {v:.2f}ms' for k, v in percentiles(latencies).items()
+    )
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(
+    path: str, name: str, params: Dict[str, Any], results: Dict[str, float],
+) -> None:
+    """
+    Print how the results of a benchmark changed since its last run with the
+    same params saved in path, then append them to path as a JSON line.
+    """
+    last = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['benchmark'] == name and record['params'] == params:
+                    last = record
+    if last is not None:
+        print(
+            f"--- Compared with the run at commit {last['commit']} on "
+            f"{strftime('%Y-%m-%d %H:%M', localtime(last['time']))}"
+        )
+        for k, v in results.items():
+            old = last['results'].get(k)
+            if old:
+                change = 100 * (v / old - 1)
+                print(f'{k}: {old:.4g} -> {v:.4g} ({change:+.1f}%)')
+    record = {
+        'time': time(), 'commit': git_commit(), 'benchmark': name,
+        'params': params, 'results': results,
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def traced_mb(build: Callable[[], Any]) -> float:
+    """
+    Return the memory in MB still allocated by build() once it returns, which
+    is the memory held by what it built.
+    """
+    tracemalloc.start()
+    try:
+        res = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del res
+    return size / (1024 * 1024)
+
+
+def ancestor_rows(chains: List[List[str]]) -> Dict[str, List[int]]:
+    """
+    Build the rows of the routes under every area as the route index did
+    before it kept the area nodes of the routes.
+    """
+    rows = dict()
+    for r, chain in enumerate(chains):
+        for a in chain:
+            rows.setdefault(a, []).append(r)
+    return rows
+
+
+def fresh(s: str) -> str:
+    """
+    Return a new str equal to s, as parsing a page makes one.
+    """
+    return s.encode().decode()
+
+
+def frontier_tree(
+    areas: Dict[str, Dict[str, Any]], routes_by_area: Dict[str, List[str]],
+) -> AreaTree:
+    """
+    Build the AreaTree a crawl of the synthetic tree ends with.
+    """
+    tree = AreaTree()
+    nodes = dict()
+    for a in areas.values():
+        chain = a['location_chain']
+        parent = nodes[chain[-2]] if len(chain) > 1 else AreaTree.ROOT
+        nodes[a['area_id']] = node = tree.add_area(
+            int(a['area_id']), fresh(a['area_name']), parent,
+        )
+        tree.set_page(node, (
+            fresh(a['display_name']), fresh(a['latitude']),
+            fresh(a['longitude']),
+            [(int(r), fresh(r)) for r in routes_by_area.get(a['area_id'], [])],
+            [],
+        ))
+    return tree
+
+
+def frontier_maps(
+    areas: Dict[str, Dict[str, Any]], routes_by_area: Dict[str, List[str]],
+) -> Any:
+    """
+    Build the area tasks, area maps and route maps a crawl of the synthetic
+    tree ended with before the AreaTree, with str ids and a location chain
+    list for every area task, shared by the routes of the area.
+    """
+    ids = dict()
+    tasks = []
+    area_maps = dict()
+    route_maps = []
+    for a in areas.values():
+        area_id = ids[a['area_id']] = fresh(a['area_id'])
+        chain = [ids[x] for x in a['location_chain']]
+        task = (area_id, fresh(a['area_name']), chain)
+        tasks.append(task)
+        area_maps[area_id] = build_area_map(
+            area_id, task[1], fresh(a['display_name']),
+            fresh(a['latitude']), fresh(a['longitude']), chain,
+        )
+        for r in routes_by_area.get(a['area_id'], []):
+            route_maps.append(build_route_map(fresh(r), fresh(r), chain))
+    return tasks, area_maps, route_maps
+
+
+def benchmark_ids(
+    num_routes: int = IDS_ROUTES, baseline: bool = True,
+) -> Dict[str, float]:
+    """
+    Measure the memory of the frontier of the areas stage, the areas and
+    routes found, as an AreaTree, of the set of route ids read, which the
+    route details stage checks the frontier against, as an IdSet, and of the
+    area rows of the route index, as area nodes with the rows of every node,
+    on a synthetic tree. If baseline is set, measure them also as area tasks
+    and maps with str ids and location chains, as a set of str ids and as the
+    location chains with the rows of every ancestor.
+    """
+    areas, routes = make_areas_and_routes(num_routes)
+    hierarchy = AreaHierarchy.from_areas(areas.values())
+    routes_by_area = dict()
+    for r in routes:
+        routes_by_area.setdefault(r['location_chain'][-1], []).append(
+            r['route_id'],
+        )
+    res = {'tree_mb': traced_mb(lambda: frontier_tree(areas, routes_by_area))}
+    print(f"Frontier as an AreaTree: {res['tree_mb']:.1f} MB")
+    if baseline:
+        res['frontier_maps_mb'] = traced_mb(
+            lambda: frontier_maps(areas, routes_by_area),
+        )
+        print(
+            f"Frontier as area tasks and maps: "
+            f"{res['frontier_maps_mb']:.1f} MB "
+            f"({res['frontier_maps_mb'] / res['tree_mb']:.1f}x)"
+        )
+    del routes_by_area
+    with tempfile.TemporaryDirectory() as tmp:
+        route_details_file = os.path.join(tmp, 'route_details.pkl')
+        df_from_routes(list(make_routes(routes, areas))).to_pickle(
+            route_details_file,
+        )
+        del routes
+        df = pd.read_pickle(route_details_file)
+        ids = df['id'].tolist()
+        chains = df['location_chain'].tolist()
+        del df
+        print(f'Synthetic tree: {len(areas)} areas, {len(ids)} routes')
+
+        res['idset_mb'] = traced_mb(lambda: IdSet(ids))
+        res['area_nodes_mb'] = traced_mb(
+            lambda: index_areas(hierarchy, chains),
+        )
+        print(
+            f"IdSet of route ids: {res['idset_mb']:.1f} MB. Area nodes and "
+            f"rows: {res['area_nodes_mb']:.1f} MB"
+        )
+        if baseline:
+            res['str_set_mb'] = traced_mb(lambda: set(ids))
+            # The chains as loaded, kept by the index, and the rows of every
+            # ancestor.
+            res['chains_mb'] = traced_mb(lambda: (
+                pd.read_pickle(route_details_file)['location_chain'].tolist(),
+                ancestor_rows(chains),
+            ))
+            print(
+                f"Set of str ids: {res['str_set_mb']:.1f} MB "
+                f"({res['str_set_mb'] / res['idset_mb']:.1f}x). Chains and "
+                f"rows of every ancestor: {res['chains_mb']:.1f} MB "
+                f"({res['chains_mb'] / res['area_nodes_mb']:.1f}x)"
+            )
+    return res
+
+
+BENCHMARKS = {
+    'load': benchmark_load,
+    'memory': benchmark_memory,
+    'output': benchmark_output,
+    'geo': benchmark_geo,
+    'parse': benchmark_parse,
+    'crawl': benchmark_crawl,
+    'ids': benchmark_ids,
+}
+
+
+def main():
+    short_options = 'b:e:j:l:n:r:t:'
+    long_options = [
+        'benchmark=', 'error-rate=', 'jitter=', 'latency=', 'num-routes=',
+        'results=', 'threads=', 'no-baseline', 'no-keywords', 'no-save',
+    ]
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    names = []
+    # Options given, passed to the benchmarks that take them.
+    options = dict()
+    results_file = RESULTS_FILE
+    save = True
+    for a, v in args:
+        if a in ('-b', '--benchmark'):
+            if v not in BENCHMARKS:
+                print(f'Unknown benchmark {v}, choose from {list(BENCHMARKS)}')
+                sys.exit(2)
+            names.append(v)
+        elif a in ('-e', '--error-rate'):
+            options['error_rate'] = float(v)
+        elif a in ('-j', '--jitter'):
+            options['jitter'] = float(v)
+        elif a in ('-l', '--latency'):
+            options['latency'] = float(v)
+        elif a in ('-n', '--num-routes'):
+            options['num_routes'] = int(v)
+        elif a in ('-r', '--results'):
+            results_file = v
+        elif a in ('-t', '--threads'):
+            options['num_threads'] = int(v)
+        elif a == '--no-baseline':
+            options['baseline'] = False
+        elif a == '--no-keywords':
+            options['keywords'] = False
+        elif a == '--no-save':
+            save = False
+    if save and os.path.dirname(results_file):
+        os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    for name in names or list(BENCHMARKS):
+        print(f'=== {name} ===')
+        benchmark = BENCHMARKS[name]
+        params = {
+            k: v for k, v in options.items()
+            if k in signature(benchmark).parameters
+        }
+        results = benchmark(**params)
+        if save:
+            save_results(results_file, name, params, results)
+
+
+if __name__ == '__main__':
+    main()
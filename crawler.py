@@ -0,0 +1,510 @@
+"""
+@author: yuan.shao
+"""
+import sys
+from heapq import heappop, heappush
+from queue import Queue
+from threading import Event, Thread
+from time import time
+from array import array
+from typing import Any, Callable, Dict, List, Tuple
+
+from requests.exceptions import RequestException
+
+from area import AreaTask, AreaTree, read_an_area
+from deadletter import DeadLetters
+from hierarchy import AreaHierarchy
+from idset import IdSet
+from metrics import REGISTRY
+from profiling import profile_thread
+from recrawl import refresh_route, schedule
+from route import Route
+from scheduler import CrawlBudget, YieldModel
+from sink import RouteSink
+from text_analyzer import TextAnalyzer
+from text_index import TextIndexWriter
+from utils import elapsed, remaining
+
+MAX_RETRY = 3
+NUM_OF_THREADS = 100
+CHUNK = 1000
+# Threads of the deferred pass reading the dead letters again at the end of
+# a stage, fewer so a struggling server gets some relief.
+RETRY_THREADS = 8
+
+
+def run_tasks(
+    stage: str,
+    tasks: List[Any],
+    work: Callable[[Any], None],
+    describe: Callable[[Any], str],
+    on_chunk: Callable[[int, float], None] = None,
+    num_threads: int = NUM_OF_THREADS,
+    chunk: int = CHUNK,
+    on_failure: Callable[[Any, Exception, int], None] = None,
+    priority: Callable[[Any], float] = None,
+    crawl_budget: CrawlBudget = None,
+) -> List[Any]:
+    """
+    Run work on every task from num_threads threads, chunk tasks at a time,
+    trying each task up to MAX_RETRY times on request errors. Other errors,
+    e.g. of parsing, fail a task at once. on_failure is called with a failed
+    task, its last error and the number of tries. Tasks appended to the list
+    by work are run too. After every chunk, on_chunk is called with the
+    number of tasks run so far and the start time of the chunk. Metrics of
+    the tasks are recorded under the given stage name.
+
+    If priority is given, every chunk takes the tasks of highest priority
+    among those not run yet, instead of the next ones in the list. No task is
+    started once crawl_budget is spent. Return the tasks left unrun. On
+    Ctrl-C, the tasks queued are dropped and the program exits at once.
+    """
+    q = Queue()
+    # Set to skip the tasks still queued when the run is stopped.
+    stop = Event()
+    queue_depth = REGISTRY.gauge('queue_depth', stage=stage)
+    task_seconds = REGISTRY.histogram('task_seconds', stage=stage)
+    tasks_done = REGISTRY.counter('tasks_total', stage=stage)
+    retries = REGISTRY.counter('task_retries_total', stage=stage)
+    failures = REGISTRY.counter('task_failures_total', stage=stage)
+
+    def worker():
+        with profile_thread():
+            while True:
+                task = q.get()
+                if task is None:
+                    break
+                if stop.is_set():
+                    q.task_done()
+                    continue
+                queue_depth.set(q.qsize())
+                if crawl_budget is not None and crawl_budget.exhausted():
+                    left.append(task)
+                    q.task_done()
+                    continue
+                error = None
+                with task_seconds.time():
+                    for attempt in range(1, MAX_RETRY + 1):
+                        if attempt > 1:
+                            retries.inc()
+                        try:
+                            work(task)
+                            error = None
+                            break
+                        except RequestException as err:
+                            error = err
+                        except Exception as err:
+                            error = err
+                            break
+                if error is not None:
+                    failures.inc()
+                    print(
+                        f'Fail to read {describe(task)}: '
+                        f'{type(error).__name__}: {error}'
+                    )
+                    if on_failure is not None:
+                        on_failure(task, error, attempt)
+                tasks_done.inc()
+                q.task_done()
+
+    left = []
+    # (-priority, order, task) of the tasks appended but not run yet.
+    heap = []
+    pushed = 0
+    threads = [Thread(target=worker, daemon=True) for _ in range(num_threads)]
+    for th in threads:
+        th.start()
+    done = 0
+    try:
+        while done < len(tasks):
+            if crawl_budget is not None and crawl_budget.exhausted():
+                break
+            chunk_start_time = time()
+            if priority is None:
+                batch = tasks[done:(done + chunk)]
+            else:
+                for i in range(pushed, len(tasks)):
+                    heappush(heap, (-priority(tasks[i]), i, tasks[i]))
+                pushed = len(tasks)
+                batch = [
+                    heappop(heap)[2] for _ in range(min(chunk, len(heap)))
+                ]
+            for task in batch:
+                q.put(task)
+            q.join()
+            done += len(batch)
+            if on_chunk is not None:
+                # Tasks taken after the budget was spent were not run.
+                on_chunk(done - len(left), chunk_start_time)
+    except BaseException as err:
+        # Ctrl-C, or on_chunk stopping a shard whose claim was lost. The
+        # threads skip the tasks queued and exit after the ones they run,
+        # which are not waited for, as a fetch may hang.
+        stop.set()
+        for _ in threads:
+            q.put(None)
+        if isinstance(err, KeyboardInterrupt):
+            sys.exit(1)
+        raise
+    for _ in threads:
+        q.put(None)
+    for th in threads:
+        th.join()
+    if priority is None:
+        left.extend(tasks[done:])
+    else:
+        left.extend(t for _, _, t in heap)
+        left.extend(tasks[pushed:])
+    if left:
+        print(f'Budget spent, {len(left)} {stage} tasks left')
+    return left
+
+
+def area_seeds(states: List[str]) -> List[AreaTask]:
+    """
+    Return the area tasks of top-level areas given as 'id/name', as in STATES.
+    """
+    res = []
+    for state in states:
+        s = state.split('/')
+        res.append((s[0], s[1], [s[0]]))
+    return res
+
+
+def crawl_areas(
+    seeds: List[AreaTask],
+    checkpoint: Callable[[], None] = None,
+    num_threads: int = NUM_OF_THREADS,
+    dead_letters: DeadLetters = None,
+    yields: YieldModel = None,
+    crawl_budget: CrawlBudget = None,
+    deferred: List[AreaTask] = None,
+) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]], AreaHierarchy]:
+    """
+    Read the given areas and all areas under them, breadth first, or if yields
+    is given, areas with more good routes found before first. Return the
+    areas by id, the routes found under them and the area hierarchy.
+    checkpoint is called after every chunk of areas. Areas that fail are
+    added to dead_letters, and areas read are removed from it. Areas left
+    when crawl_budget is spent are appended to deferred.
+
+    While crawling, the areas and routes found are kept in an AreaTree, and
+    the tasks are its nodes. The str maps of the areas and routes are built
+    at the end.
+    """
+    start_time = time()
+    tree = AreaTree()
+    tasks = array('l', [tree.add_task(t) for t in seeds])
+
+    def read_area(node: int) -> None:
+        area_id = tree.area_ids[node]
+        if area_id in tree.read:
+            print(f'!!! REPEATED AREA: {tree.task(node)}')
+            return
+        page = read_an_area(area_id, tree.area_names[node])
+        next_areas = tree.set_page(node, page)
+        if next_areas is None:
+            print(f'!!! REPEATED AREA: {tree.task(node)}')
+            return
+        tasks.extend(next_areas)
+
+    def on_chunk(done: int, chunk_start_time: float) -> None:
+        print(
+            f'Read {done} areas, done in {elapsed(chunk_start_time)}. '
+            f'Length of area queue = {len(tasks) - done}. '
+            f'Elapsed {elapsed(start_time)}'
+        )
+        if checkpoint is not None:
+            checkpoint()
+
+    def on_failure(node: int, error: Exception, attempts: int) -> None:
+        if dead_letters is not None:
+            task = tree.task(node)
+            dead_letters.add('area', task[0], task, error, attempts)
+
+    def describe(node: int) -> str:
+        return f'area {tree.area_ids[node]}/{tree.area_names[node]}'
+
+    priority = None
+    if yields is not None:
+        def priority(node: int) -> float:
+            return yields.area_priority(tree.task(node))
+
+    left = run_tasks(
+        'area', tasks, read_area, describe, on_chunk, num_threads,
+        on_failure=on_failure, priority=priority, crawl_budget=crawl_budget,
+    )
+    if deferred is not None:
+        deferred.extend(tree.task(node) for node in left)
+    elif left:
+        print(f'!!! {len(left)} AREAS LEFT UNREAD')
+    areas = tree.areas()
+    if dead_letters is not None:
+        dead_letters.discard('area', areas)
+    return areas, tree.routes(), AreaHierarchy.from_areas(areas.values())
+
+
+def extend_areas(
+    seeds: List[AreaTask],
+    areas: Dict[str, Dict[str, Any]],
+    routes: List[Dict[str, Any]],
+    hierarchy: AreaHierarchy,
+    **kwargs: Any,
+) -> int:
+    """
+    Read the given areas not read yet, and all areas under them, as
+    crawl_areas does with kwargs, adding them to areas, routes and hierarchy.
+    Return the number of areas read.
+    """
+    seeds = [t for t in seeds if t[0] not in areas]
+    if not seeds:
+        return 0
+    new_areas, new_routes, _ = crawl_areas(seeds, **kwargs)
+    for area_id, area in new_areas.items():
+        if area_id not in areas:
+            areas[area_id] = area
+            hierarchy.add_area(
+                area['location_chain'], area['area_name'],
+                area['display_name'],
+            )
+    routes.extend(new_routes)
+    return len(new_areas)
+
+
+def retry_areas(
+    dead_letters: DeadLetters,
+    areas: Dict[str, Dict[str, Any]],
+    routes: List[Dict[str, Any]],
+    hierarchy: AreaHierarchy,
+    num_threads: int = RETRY_THREADS,
+    **kwargs: Any,
+) -> int:
+    """
+    Read again the areas in dead_letters, and all areas under them, as
+    extend_areas does with kwargs. Return the number of areas read.
+    """
+    seeds = [
+        (t[0], t[1], t[2]) for t in dead_letters.tasks('area')
+        if t[0] not in areas
+    ]
+    dead_letters.discard('area', areas)
+    if not seeds:
+        return 0
+    print(f'Read {len(seeds)} failed areas again')
+    return extend_areas(
+        seeds, areas, routes, hierarchy, num_threads=num_threads,
+        dead_letters=dead_letters, **kwargs,
+    )
+
+
+def crawl_route_details(
+    routes: List[Dict[str, Any]],
+    hierarchy: AreaHierarchy,
+    route_details: List[Route],
+    text_analyzer: TextAnalyzer = None,
+    text_index: TextIndexWriter = None,
+    score_threshold: float = None,
+    votes_threshold: int = None,
+    checkpoint: Callable[[], None] = None,
+    num_threads: int = NUM_OF_THREADS,
+    dead_letters: DeadLetters = None,
+    sink: RouteSink = None,
+    yields: YieldModel = None,
+    crawl_budget: CrawlBudget = None,
+) -> None:
+    """
+    Read the details of the routes not in route_details yet, appending them
+    to route_details and adding them to the rollups of the hierarchy and to
+    the text index and output sink if given. The thresholds are as in
+    Route.read_from_web. Routes likelier to be good by yields are read first
+    if given, and none are started once crawl_budget is spent.
+    checkpoint is called after every chunk of routes. Routes that fail are
+    added to dead_letters, and routes read are removed from it.
+    """
+    start_time = time()
+    read = IdSet(r.id for r in route_details)
+    tasks = [t for t in routes if t['route_id'] not in read]
+
+    def read_route(task: Dict[str, Any]) -> None:
+        route = Route.read_from_web(
+            route_id=task['route_id'],
+            route_name=task['route_name'],
+            location_chain=task['location_chain'],
+            location_name_chain=hierarchy.name_chain(task['location_chain']),
+            text_analyzer=text_analyzer,
+            keep_text=text_index is not None,
+            score_threshold=score_threshold,
+            votes_threshold=votes_threshold,
+        )
+        if text_index is not None:
+            text_index.add_route(route)
+            route.release_text()
+        if sink is not None:
+            sink.add(route)
+        route_details.append(route)
+        hierarchy.add_route(
+            route.location_chain, route.scores, route.types,
+            route.keyword_counts,
+        )
+
+    def on_chunk(done: int, chunk_start_time: float) -> None:
+        rem = remaining(
+            start_time=start_time, done_tasks=done, total_tasks=len(tasks),
+        )
+        print(
+            f'Read details of {done} of {len(tasks)} routes, done in '
+            f'{elapsed(chunk_start_time)}. Elapsed {elapsed(start_time)}. '
+            f'Remaining {rem}'
+        )
+        if score_threshold is not None:
+            lite = sum([r.lite for r in route_details])
+            print(f'{lite} of {len(route_details)} routes read as lite')
+        if checkpoint is not None:
+            checkpoint()
+
+    def on_failure(
+        task: Dict[str, Any], error: Exception, attempts: int,
+    ) -> None:
+        if dead_letters is not None:
+            dead_letters.add(
+                'route_details', task['route_id'], task, error, attempts,
+            )
+
+    run_tasks(
+        'route_details', tasks, read_route,
+        lambda t: f"details of route {t['route_id']}/{t['route_name']}",
+        on_chunk, num_threads, on_failure=on_failure,
+        priority=yields.route_priority if yields is not None else None,
+        crawl_budget=crawl_budget,
+    )
+    if dead_letters is not None:
+        dead_letters.discard(
+            'route_details', IdSet(r.id for r in route_details),
+        )
+
+
+def retry_route_details(
+    dead_letters: DeadLetters,
+    route_details: List[Route],
+    hierarchy: AreaHierarchy,
+    routes: List[Dict[str, Any]] = None,
+    num_threads: int = RETRY_THREADS,
+    **kwargs: Any,
+) -> None:
+    """
+    Read again the details of the routes in dead_letters, and of the given
+    routes not read yet, as crawl_route_details does with kwargs.
+    """
+    tasks = dead_letters.tasks('route_details') + (routes or [])
+    if tasks:
+        print(f'Read details of {len(tasks)} failed or new routes again')
+        crawl_route_details(
+            tasks, hierarchy, route_details, num_threads=num_threads,
+            dead_letters=dead_letters, **kwargs,
+        )
+
+
+def recrawl_route_details(
+    route_details: List[Route],
+    hierarchy: AreaHierarchy,
+    text_analyzer: TextAnalyzer = None,
+    score_threshold: float = None,
+    votes_threshold: int = None,
+    budget: int = None,
+    checkpoint: Callable[[], None] = None,
+    num_threads: int = NUM_OF_THREADS,
+    dead_letters: DeadLetters = None,
+    due: List[int] = None,
+    sink: RouteSink = None,
+    crawl_budget: CrawlBudget = None,
+) -> int:
+    """
+    Read again the routes due by the recrawl schedule, at most budget of them,
+    or the routes of the given indices, replacing them in route_details, in
+    the rollups of the hierarchy and in the output sink if given. No route
+    is started once crawl_budget is spent. Return the number of routes that
+    changed. Routes that fail are added to dead_letters, and routes read are
+    removed from it.
+    """
+    start_time = time()
+    if due is None:
+        due = schedule(route_details, time(), budget)
+    changed = []
+    refreshed = set()
+    print(f'{len(due)} of {len(route_details)} routes due to be read again')
+
+    def refresh(i: int) -> None:
+        old = route_details[i]
+        route = refresh_route(
+            old,
+            text_analyzer=text_analyzer,
+            score_threshold=score_threshold,
+            votes_threshold=votes_threshold,
+        )
+        route.release_text()
+        if sink is not None:
+            sink.add(route)
+        route_details[i] = route
+        hierarchy.remove_route(
+            old.location_chain, old.scores, old.types, old.keyword_counts,
+        )
+        hierarchy.add_route(
+            route.location_chain, route.scores, route.types,
+            route.keyword_counts,
+        )
+        if route.changed_at != old.changed_at:
+            changed.append(i)
+        refreshed.add(route.id)
+
+    def on_chunk(done: int, chunk_start_time: float) -> None:
+        rem = remaining(
+            start_time=start_time, done_tasks=done, total_tasks=len(due),
+        )
+        print(
+            f'Read {done} routes again in {elapsed(chunk_start_time)}, '
+            f'{len(changed)} changed. Elapsed {elapsed(start_time)}. '
+            f'Remaining {rem}'
+        )
+        if checkpoint is not None:
+            checkpoint()
+
+    def on_failure(i: int, error: Exception, attempts: int) -> None:
+        if dead_letters is not None:
+            dead_letters.add(
+                'recrawl', route_details[i].id, route_details[i].id, error,
+                attempts,
+            )
+
+    run_tasks(
+        'recrawl', due, refresh,
+        lambda i: f'route {route_details[i].id}/{route_details[i].name} again',
+        on_chunk, num_threads, on_failure=on_failure,
+        crawl_budget=crawl_budget,
+    )
+    if dead_letters is not None:
+        dead_letters.discard('recrawl', refreshed)
+    return len(changed)
+
+
+def retry_recrawl(
+    dead_letters: DeadLetters,
+    route_details: List[Route],
+    hierarchy: AreaHierarchy,
+    num_threads: int = RETRY_THREADS,
+    **kwargs: Any,
+) -> int:
+    """
+    Read again the routes in dead_letters that failed to be read again, as
+    recrawl_route_details does with kwargs. Return the number that changed.
+    """
+    keys = dead_letters.keys('recrawl')
+    due = [i for i, r in enumerate(route_details) if r.id in keys]
+    # Routes no longer in route_details cannot be read again.
+    dead_letters.discard('recrawl', keys - {route_details[i].id for i in due})
+    if not due:
+        return 0
+    print(f'Read {len(due)} failed routes again')
+    return recrawl_route_details(
+        route_details, hierarchy, num_threads=num_threads,
+        dead_letters=dead_letters, due=due, **kwargs,
+    )
@@ -0,0 +1,153 @@
+"""
+@author: yuan.shao
+"""
+import getopt
+import json
+import sqlite3
+import sys
+from contextlib import closing
+from time import localtime, strftime, time
+from typing import Any, Iterable, List, Set, Tuple
+
+from idset import IdSet
+
+DEAD_LETTERS_FILE = 'output/dead_letters.db'
+
+
+class DeadLetters:
+    """
+    Tasks of a crawl stage that failed every try, kept in an SQLite file with
+    the class and message of their last error, how many times they were
+    tried over all runs, and when they first and last failed. A task is
+    removed once it is read, so the store only holds the pages still missing.
+    """
+    def __init__(self, path: str = DEAD_LETTERS_FILE) -> None:
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS dead_letters ('
+                'stage TEXT, key TEXT, task TEXT, error TEXT, message TEXT, '
+                'attempts INTEGER, first_failed_at REAL, failed_at REAL, '
+                'PRIMARY KEY (stage, key))'
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def add(
+        self, stage: str, key: str, task: Any, error: BaseException,
+        attempts: int,
+    ) -> None:
+        """
+        Record a failed task, given as anything JSON can encode, adding to the
+        attempts of a task that failed before.
+        """
+        now = time()
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                'INSERT INTO dead_letters VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (stage, key) DO UPDATE SET task = excluded.task, '
+                'error = excluded.error, message = excluded.message, '
+                'attempts = attempts + excluded.attempts, '
+                'failed_at = excluded.failed_at',
+                (
+                    stage, key, json.dumps(task), type(error).__name__,
+                    str(error), attempts, now, now,
+                ),
+            )
+
+    def keys(self, stage: str) -> Set[str]:
+        with closing(self.connect()) as conn, conn:
+            return {
+                row[0] for row in conn.execute(
+                    'SELECT key FROM dead_letters WHERE stage = ?', (stage,),
+                )
+            }
+
+    def tasks(self, stage: str) -> List[Any]:
+        """
+        Return the failed tasks of a stage, first failed first.
+        """
+        with closing(self.connect()) as conn, conn:
+            return [
+                json.loads(row[0]) for row in conn.execute(
+                    'SELECT task FROM dead_letters WHERE stage = ? '
+                    'ORDER BY first_failed_at', (stage,),
+                )
+            ]
+
+    def discard(self, stage: str, done: Iterable[str]) -> int:
+        """
+        Remove the tasks of a stage whose keys are in done. Return how many
+        were removed.
+        """
+        keys = self.keys(stage)
+        if not keys:
+            return 0
+        if not isinstance(done, (set, dict, IdSet)):
+            done = set(done)
+        keys = [k for k in keys if k in done]
+        with closing(self.connect()) as conn, conn:
+            conn.executemany(
+                'DELETE FROM dead_letters WHERE stage = ? AND key = ?',
+                [(stage, k) for k in keys],
+            )
+        return len(keys)
+
+    def entries(self) -> List[Tuple[str, str, str, str, int, float, float]]:
+        """
+        Return the stage, key, error, message, attempts and first and last
+        failure times of every task.
+        """
+        with closing(self.connect()) as conn, conn:
+            return conn.execute(
+                'SELECT stage, key, error, message, attempts, '
+                'first_failed_at, failed_at FROM dead_letters '
+                'ORDER BY stage, first_failed_at'
+            ).fetchall()
+
+    def __len__(self) -> int:
+        with closing(self.connect()) as conn, conn:
+            return conn.execute(
+                'SELECT COUNT(*) FROM dead_letters'
+            ).fetchone()[0]
+
+
+def main():
+    short_options = 'f:v'
+    long_options = ['file=', 'verbose']
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    path = DEAD_LETTERS_FILE
+    verbose = False
+    for a, v in args:
+        if a in ('-f', '--file'):
+            path = v
+        elif a in ('-v', '--verbose'):
+            verbose = True
+
+    entries = DeadLetters(path).entries()
+    counts = dict()
+    for stage, _, error, _, _, _, _ in entries:
+        counts[(stage, error)] = counts.get((stage, error), 0) + 1
+    for (stage, error), n in sorted(counts.items()):
+        print(f'{stage}: {n} failed with {error}')
+    if verbose:
+        for stage, key, error, message, attempts, first, last in entries:
+            print(
+                f'{stage} {key}: {error}: {message}, {attempts} attempts, '
+                f"failed {strftime('%Y-%m-%d %H:%M', localtime(first))} to "
+                f"{strftime('%Y-%m-%d %H:%M', localtime(last))}"
+            )
+    print(
+        f'{len(entries)} dead letters in {path}. Replay them with '
+        f'python update.py --replay'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+@author: yuan.shao
+"""
+import random
+import re
+from typing import Dict, List, Optional
+
+from synthetic import make_areas_and_routes
+from utils import MP_WEBSITE, STATES
+
+GRADES = [
+    '5.6', '5.7', '5.8', '5.9', '5.10a', '5.10b/c', '5.10d', '5.11a',
+    '5.11c/d', '5.12a', '5.13b',
+]
+BOULDER_GRADES = ['V0', 'V1', 'V2', 'V3', 'V4-5', 'V6', 'V8']
+TYPES = ['Trad', 'Sport', 'TR', 'Alpine', 'Aid']
+ADJECTIVES = [
+    'classic', 'splitter', 'sustained', 'airy', 'polished', 'chossy',
+    'steep', 'exposed', 'technical', 'pumpy', 'sandbagged', 'clean',
+]
+FEATURES = [
+    'hand crack', 'finger crack', 'roof', 'slab', 'arete', 'chimney',
+    'dihedral', 'crimps', 'jugs', 'pockets', 'slopers', 'offwidth',
+    'flake', 'layback', 'mantle', 'traverse',
+]
+GEAR = [
+    'a single rack to 3 inches', 'doubles of 0.5 to 2', 'twelve quickdraws',
+    'a 70 m rope', 'small nuts and cams', 'a few long slings',
+]
+PLACES = [
+    'the first bolt', 'the crux', 'the roof', 'the anchor', 'the ledge',
+    'the second pitch', 'the top out', 'the start',
+]
+SENTENCES = [
+    'Great {adj} {feature} leading to {place}.',
+    'The {feature} past {place} felt {adj} and a bit runout.',
+    'Bring {gear}, the {feature} eats gear.',
+    'Climbed it in the sun, the {feature} above {place} is {adj}.',
+    'Watch for loose rock on the {feature} near {place}.',
+    'One of the best {adj} lines at the crag &amp; worth the approach.',
+    'Café after, the {feature} was way more {adj} than it looks.',
+    'Beta: stay left of the {feature} until {place}, then trend right.',
+]
+
+AREA_PATH = re.compile(r'^/area/(\d+)/([\w-]+)$')
+STATS_PATH = re.compile(r'^/route/stats/(\d+)/([\w-]*)$')
+ROUTE_PATH = re.compile(r'^/route/(\d+)/([\w-]*)$')
+COMMENTS_PATH = re.compile(r'^/Climb-Route/(\d+)/comments$')
+
+
+class Corpus:
+    """
+    Deterministic fixture pages of a synthetic area tree with num_routes
+    routes, in the formats the parsers of area.py and route.py read: area
+    pages, route pages, stats pages and comments pages. Ratings and comments
+    follow a long tail, so a few routes have stats pages with hundreds of
+    ratings and comments pages with dozens of comments.
+    """
+    def __init__(self, num_routes: int, seed: int = 0) -> None:
+        self.seed = seed
+        self.areas, routes = make_areas_and_routes(num_routes, seed=seed)
+        self.routes = {r['route_id']: r for r in routes}
+        # Top-level areas of the synthetic tree are listed on the pages of
+        # STATES, so the corpus is crawled from the same seeds as update.py.
+        self.children = {s.split('/')[0]: [] for s in STATES}
+        self.area_routes = dict()
+        for area_id, area in self.areas.items():
+            chain = area['location_chain']
+            if len(chain) == 1:
+                state = STATES[int(area_id) % len(STATES)]
+                self.children[state.split('/')[0]].append(area_id)
+            else:
+                self.children.setdefault(chain[-2], []).append(area_id)
+        for route in routes:
+            self.area_routes.setdefault(
+                route['location_chain'][-1], [],
+            ).append(route['route_id'])
+        self.state_names = dict(s.split('/') for s in STATES)
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def page(self, path: str, website: str = MP_WEBSITE) -> Optional[bytes]:
+        """
+        Return the page at a path of website, or None if there is none.
+        """
+        m = AREA_PATH.match(path)
+        if m is not None:
+            return self.area_page(m.group(1), website)
+        m = STATS_PATH.match(path)
+        if m is not None and m.group(1) in self.routes:
+            return self.stats_page(m.group(1))
+        m = ROUTE_PATH.match(path)
+        if m is not None and m.group(1) in self.routes:
+            return self.route_page(m.group(1))
+        m = COMMENTS_PATH.match(path)
+        if m is not None and m.group(1) in self.routes:
+            return self.comments_page(m.group(1))
+        return None
+
+    def rng(self, kind: str, page_id: str) -> random.Random:
+        return random.Random(f'{self.seed}/{kind}/{page_id}')
+
+    def area_page(
+        self, area_id: str, website: str = MP_WEBSITE,
+    ) -> Optional[bytes]:
+        if area_id in self.state_names:
+            display_name = self.state_names[area_id].title()
+            lat, lon = '39.0000', '-105.0000'
+        elif area_id in self.areas:
+            area = self.areas[area_id]
+            display_name = area['display_name']
+            lat, lon = area['latitude'], area['longitude']
+        else:
+            return None
+        if area_id in self.area_routes:
+            links = [
+                f'<a href="{website}/route/{r}/route-{r}">Route {r}</a>'
+                for r in self.area_routes[area_id]
+            ]
+        else:
+            links = [
+                f'<a href="{website}/area/{a}/area-{a}">Area {a}</a>'
+                for a in self.children.get(area_id, [])
+            ]
+        return '\n'.join([
+            '<!DOCTYPE html>',
+            f'<html><head><title>{display_name} | Rock Climbing</title>',
+            '</head><body>',
+            '<h1>',
+            f'    {display_name}',
+            '</h1>',
+            f'<a href="https://maps.google.com/maps?q={lat},{lon}&t=k">',
+            'View Map</a>',
+            '<div class="mp-sidebar">Show all routes',
+            *[f'<div class="lef-nav-row">{lk}</div>' for lk in links],
+            'Show All Routes</div>',
+            '</body></html>',
+        ]).encode()
+
+    def route_page(self, route_id: str) -> bytes:
+        rng = self.rng('route', route_id)
+        route_type = rng.choice(TYPES + ['Boulder'])
+        if route_type == 'Boulder':
+            grade = (
+                f'<h2 class="inline-block mr-2">'
+                f'{rng.choice(BOULDER_GRADES)}</h2>'
+            )
+            info = 'Boulder, 15 ft (5 m)'
+        else:
+            grade = (
+                f"<h2 class=\"inline-block mr-2\"><span class='rateYDS'>"
+                f'{rng.choice(GRADES)} <a href="/grade-conversions">YDS</a>'
+                f'</span></h2>'
+            )
+            types = sorted({route_type, rng.choice(TYPES)})
+            height = rng.randint(30, 900)
+            pitches = max(1, height // 120)
+            info = (
+                f'{", ".join(types)}, {height} ft ({int(0.3048 * height)} m)'
+            )
+            if pitches > 1:
+                info += f', {pitches} pitches, Grade {"I" * min(pitches, 3)}'
+        sections = []
+        for title in ('Description', 'Location', 'Protection'):
+            paragraphs = [
+                self.text(rng, rng.randint(2, 5))
+                for _ in range(rng.randint(1, 3))
+            ]
+            sections.extend([
+                f'<h2 class="mt-2">{title}</h2>',
+                f'<div class="fr-view">{"<br><br>".join(paragraphs)}</div>',
+            ])
+        return '\n'.join([
+            '<!DOCTYPE html>',
+            f'<html><head><title>Route {route_id}</title></head><body>',
+            '<h1>',
+            f'    Route {route_id}',
+            '</h1>',
+            grade,
+            '<table class="description-details"><tr>',
+            '<td>Type:</td>',
+            '    <td>',
+            f'    {info}',
+            '    </td></tr></table>',
+            *sections,
+            '</body></html>',
+        ]).encode()
+
+    def stats_page(self, route_id: str) -> bytes:
+        rng = self.rng('stats', route_id)
+        num_ratings = min(500, int(rng.paretovariate(0.9)) - 1)
+        rows = []
+        for i in range(num_ratings):
+            stars = min(4, max(0, int(rng.gauss(2.8, 1.0))))
+            if stars == 0:
+                img = '<img src="/img/stars/bombBlue.svg">'
+            else:
+                img = '<img src="/img/stars/starBlue.svg">' * stars
+            rows.append(
+                f'<tr><td><a href="/user/{1000 + i}">Climber {i}</a></td>'
+                f'<td><span class="scoreStars"><!--START-STARS-Climb-->'
+                f'{img}<!--END-STARS--></span></td></tr>'
+            )
+        return '\n'.join([
+            '<!DOCTYPE html>',
+            f'<html><head><title>Stats of route {route_id}</title></head>',
+            '<body><table class="table">',
+            *rows,
+            '</table></body></html>',
+        ]).encode()
+
+    def comments_page(self, route_id: str) -> bytes:
+        rng = self.rng('comments', route_id)
+        num_comments = min(80, int(rng.paretovariate(0.8)) - 1)
+        comments = []
+        for i in range(num_comments):
+            text = '<br>'.join(
+                self.text(rng, rng.randint(1, 4))
+                for _ in range(rng.randint(1, 2))
+            )
+            if rng.random() < 0.1:
+                text += f' Photos at https://example.com/p/{route_id}{i}.'
+            comments.append(
+                f'<div class="comment-body">'
+                f'<span id="{route_id}{i}-full" class="d-none">{text}</span>'
+                f'</div>'
+            )
+        return '\n'.join([
+            '<!DOCTYPE html>',
+            f'<html><head><title>Comments of route {route_id}</title></head>',
+            '<body>',
+            *comments,
+            '</body></html>',
+        ]).encode()
+
+    @staticmethod
+    def text(rng: random.Random, num_sentences: int) -> str:
+        return ' '.join(
+            rng.choice(SENTENCES).format(
+                adj=rng.choice(ADJECTIVES),
+                feature=rng.choice(FEATURES),
+                gear=rng.choice(GEAR),
+                place=rng.choice(PLACES),
+            )
+            for _ in range(num_sentences)
+        )
+
+    def paths(self) -> Dict[str, List[str]]:
+        """
+        Return the paths of all pages of the corpus by kind.
+        """
+        route_ids = list(self.routes)
+        return {
+            'area': [
+                f'/area/{a}/area-{a}' for a in self.areas
+            ] + [f'/area/{s}' for s in STATES],
+            'route': [f'/route/{r}/route-{r}' for r in route_ids],
+            'stats': [f'/route/stats/{r}/route-{r}' for r in route_ids],
+            'comments': [f'/Climb-Route/{r}/comments' for r in route_ids],
+        }
@@ -0,0 +1,160 @@
+"""
+@author: yuan.shao
+"""
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# (south, west, north, east) in degrees.
+BBox = Tuple[float, float, float, float]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Return the great-circle distance between two points in km.
+    """
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((p2 - p1) / 2) ** 2
+        + math.cos(p1) * math.cos(p2)
+        * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bboxes(lat: float, lon: float, km: float) -> List[BBox]:
+    """
+    Return bounding boxes together containing every point within km of a
+    point. A box crossing the antimeridian is split in two at +-180 degrees.
+    """
+    dlat = km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(89.9, abs(lat) + dlat)))
+    dlon = km / (KM_PER_DEGREE * cos_lat)
+    south, north = lat - dlat, lat + dlat
+    west, east = lon - dlon, lon + dlon
+    if dlon >= 180:
+        return [(south, -180.0, north, 180.0)]
+    if west < -180:
+        return [
+            (south, west + 360, north, 180.0), (south, -180.0, north, east),
+        ]
+    if east > 180:
+        return [
+            (south, west, north, 180.0), (south, -180.0, north, east - 360),
+        ]
+    return [(south, west, north, east)]
+
+
+def parse_coordinates(
+    latitude: Any, longitude: Any,
+) -> Optional[Tuple[float, float]]:
+    try:
+        return float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+
+
+class KDTree:
+    """
+    Static 2-d tree over (latitude, longitude) points, stored implicitly: the
+    median of every slice of the order array splits that slice along latitude
+    or longitude in turn.
+    """
+    def __init__(self, points: List[Tuple[float, float]]) -> None:
+        self.points = points
+        self.order = list(range(len(points)))
+        stack = [(0, len(points), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo <= 1:
+                continue
+            self.order[lo:hi] = sorted(
+                self.order[lo:hi], key=lambda i: points[i][axis],
+            )
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, 1 - axis))
+            stack.append((mid + 1, hi, 1 - axis))
+
+    def in_bbox(self, bbox: BBox) -> List[int]:
+        """
+        Return the indices of the points inside a bounding box.
+        """
+        low, high = (bbox[0], bbox[1]), (bbox[2], bbox[3])
+        res = []
+        stack = [(0, len(self.order), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            i = self.order[mid]
+            p = self.points[i]
+            if low[0] <= p[0] <= high[0] and low[1] <= p[1] <= high[1]:
+                res.append(i)
+            if low[axis] <= p[axis]:
+                stack.append((lo, mid, 1 - axis))
+            if p[axis] <= high[axis]:
+                stack.append((mid + 1, hi, 1 - axis))
+        return res
+
+
+class GeoIndex:
+    """
+    Spatial index over the located areas. Every route is placed at the nearest
+    area of its location chain that has coordinates, so routes are found by
+    looking up areas in the tree and then the routes placed at them.
+    """
+    def __init__(self, areas: Iterable[Dict[str, Any]]) -> None:
+        self.coordinates = dict()
+        for a in areas:
+            c = parse_coordinates(a.get('latitude'), a.get('longitude'))
+            if c is not None:
+                self.coordinates[a['area_id']] = c
+        self.area_ids = list(self.coordinates.keys())
+        self.tree = KDTree([self.coordinates[a] for a in self.area_ids])
+        self.area_rows = dict()  # area id -> rows of routes placed there
+
+    def locate(self, location_chain: List[str]) -> Optional[str]:
+        """
+        Return the nearest area of a location chain that has coordinates.
+        """
+        for a in reversed(location_chain):
+            if a in self.coordinates:
+                return a
+        return None
+
+    def add_route(self, row: int, location_chain: List[str]) -> None:
+        a = self.locate(location_chain)
+        if a is not None:
+            self.area_rows.setdefault(a, []).append(row)
+
+    def areas_in_bbox(self, bbox: BBox) -> List[str]:
+        return [self.area_ids[i] for i in self.tree.in_bbox(bbox)]
+
+    def areas_within(
+        self, lat: float, lon: float, km: float,
+    ) -> List[Tuple[str, float]]:
+        """
+        Return the areas within km of a point with their distances in km.
+        """
+        res = []
+        for bbox in radius_bboxes(lat, lon, km):
+            for a in self.areas_in_bbox(bbox):
+                d = haversine_km(lat, lon, *self.coordinates[a])
+                if d <= km:
+                    res.append((a, d))
+        return res
+
+    def rows_in_bbox(self, bbox: BBox) -> List[int]:
+        return [
+            r for a in self.areas_in_bbox(bbox)
+            for r in self.area_rows.get(a, [])
+        ]
+
+    def rows_within(self, lat: float, lon: float, km: float) -> List[int]:
+        return [
+            r for a, _ in self.areas_within(lat, lon, km)
+            for r in self.area_rows.get(a, [])
+        ]
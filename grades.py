@@ -0,0 +1,187 @@
+"""
+@author: yuan.shao
+"""
+import re
+from typing import List, Optional, Tuple
+
+YDS = 'yds'
+V_SCALE = 'v'
+ICE = 'ice'
+MIXED = 'mixed'
+AID = 'aid'
+SCALES = [YDS, V_SCALE, ICE, MIXED, AID]
+GRADE_COLUMNS = [f'{s}_{end}' for s in SCALES for end in ('low', 'high')]
+MISSING = -1
+
+# Every grade number is split into 4 steps, so that letter grades (5.10a to
+# 5.10d) and +/- grades (5.9-, 5.9+, V4+) map to ordinal keys on one scale.
+STEPS = 4
+LETTERS = 'abcd'
+YDS_PATTERN = re.compile(r'5\.(\d{1,2})([a-d](?:/[a-d])?)?([+-])?')
+V_PATTERN = re.compile(r'V(B|\d{1,2})(?:-(\d{1,2}))?([+-])?')
+ICE_PATTERN = re.compile(r'[WA]I(\d)(?:-(\d))?([+-])?')
+MIXED_PATTERN = re.compile(r'M(\d{1,2})(?:-(\d{1,2}))?([+-])?')
+AID_PATTERN = re.compile(r'[AC](\d)(?:-(\d))?([+-])?')
+
+# (scale, low key, high key)
+Grade = Tuple[str, int, int]
+
+
+def sub_grade_range(n: int, letters: str, sign: str) -> Tuple[int, int]:
+    """
+    Return the low and high keys of grade number n with optional letters such
+    as 'b' or 'b/c' and an optional '+' or '-' sign.
+    """
+    base = n * STEPS
+    if letters:
+        return (
+            base + LETTERS.index(letters[0]), base + LETTERS.index(letters[-1])
+        )
+    if sign == '-':
+        return base, base + 1
+    if sign == '+':
+        return base + 2, base + STEPS - 1
+    return base, base + STEPS - 1
+
+
+def number_range(n: int, end: Optional[int], sign: str) -> Tuple[int, int]:
+    """
+    Return the low and high keys of grade number n with an optional '+' or
+    '-' sign, or of the numbers n to end of a range such as 'WI4-5'.
+    """
+    low, high = sub_grade_range(n, '', sign)
+    if end is not None:
+        high = end * STEPS + STEPS - 1
+    return low, high
+
+
+def parse_yds(grade: str) -> Optional[Grade]:
+    m = YDS_PATTERN.fullmatch(grade)
+    if m is None:
+        return None
+    low, high = sub_grade_range(int(m[1]), m[2] or '', m[3] or '')
+    return YDS, low, high
+
+
+def parse_v_scale(grade: str) -> Optional[Grade]:
+    m = V_PATTERN.fullmatch(grade)
+    if m is None:
+        return None
+    # VB is below V0, so V-scale numbers are shifted up by one.
+    n = 0 if m[1] == 'B' else int(m[1]) + 1
+    end = int(m[2]) + 1 if m[2] is not None else None
+    low, high = number_range(n, end, m[3] or '')
+    return V_SCALE, low, high
+
+
+def parse_ice(grade: str) -> Optional[Grade]:
+    """
+    Parse a water ice (WI) or alpine ice (AI) grade or range of grades.
+    """
+    m = ICE_PATTERN.fullmatch(grade)
+    if m is None:
+        return None
+    end = int(m[2]) if m[2] is not None else None
+    low, high = number_range(int(m[1]), end, m[3] or '')
+    return ICE, low, high
+
+
+def parse_mixed(grade: str) -> Optional[Grade]:
+    m = MIXED_PATTERN.fullmatch(grade)
+    if m is None:
+        return None
+    end = int(m[2]) if m[2] is not None else None
+    low, high = number_range(int(m[1]), end, m[3] or '')
+    return MIXED, low, high
+
+
+def parse_aid(grade: str) -> Optional[Grade]:
+    """
+    Parse an aid grade. Clean aid (C) grades share the scale of aid (A) grades.
+    """
+    m = AID_PATTERN.fullmatch(grade)
+    if m is None:
+        return None
+    end = int(m[2]) if m[2] is not None else None
+    low, high = number_range(int(m[1]), end, m[3] or '')
+    return AID, low, high
+
+
+PARSERS = [parse_yds, parse_v_scale, parse_ice, parse_mixed, parse_aid]
+
+
+def parse_words(grade: str) -> List[Grade]:
+    """
+    Parse every word of a grade string that is a known grade, e.g. both
+    grades of '5.9 A1' or 'WI4 M5'.
+    """
+    res = []
+    for word in grade.split():
+        for parser in PARSERS:
+            g = parser(word)
+            if g is not None:
+                res.append(g)
+                break
+    return res
+
+
+def parse_grade(grade: str) -> Optional[Grade]:
+    """
+    Parse a grade string such as '5.10b/c', '5.9+ PG13' or 'WI4-5' into its
+    scale and low and high ordinal keys. Return None if no word of the string
+    is a known grade.
+    """
+    grades = parse_words(grade)
+    return grades[0] if grades else None
+
+
+def grade_keys(grades: List[str]) -> List[int]:
+    """
+    Return the low and high keys of the grade strings of a route on every
+    scale, in the order of GRADE_COLUMNS, with MISSING for the scales it has no
+    grade on. Several grades on one scale are merged into one range.
+    """
+    ranges = dict()
+    for s in grades:
+        for scale, low, high in parse_words(s):
+            if scale in ranges:
+                low = min(low, ranges[scale][0])
+                high = max(high, ranges[scale][1])
+            ranges[scale] = (low, high)
+    return [
+        k for scale in SCALES
+        for k in ranges.get(scale, (MISSING, MISSING))
+    ]
+
+
+def parse_grade_range(s: str) -> Optional[Grade]:
+    """
+    Parse a grade range such as '5.9..5.10c', '5.9–5.10c' or '5.9-5.10c', or a
+    single grade, into its scale and low and high keys. An open end such as
+    '5.10..' extends to the end of the scale. Return None if the range is not
+    recognized or its two ends are on different scales.
+    """
+    s = s.strip()
+    g = parse_grade(s)
+    if g is not None:
+        return g
+    for sep in ('..', '–', '-'):
+        if sep not in s:
+            continue
+        left, right = s.split(sep, 1)
+        low = parse_grade(left) if left.strip() else None
+        high = parse_grade(right) if right.strip() else None
+        # Both ends must be grades unless left open.
+        if (low is None and left.strip()) or (high is None and right.strip()):
+            continue
+        if low is None and high is None:
+            continue
+        if low is not None and high is not None and low[0] != high[0]:
+            return None
+        scale = (low or high)[0]
+        return (
+            scale,
+            low[1] if low is not None else -1,
+            high[2] if high is not None else 10 ** 6,
+        )
+    return None
@@ -0,0 +1,274 @@
+"""
+@author: yuan.shao
+"""
+from __future__ import annotations
+
+import sys
+from array import array
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sketch import SpaceSaving, SKETCH_SIZE
+
+
+class AreaHierarchy:
+    """
+    Index of the area tree. Every area id is interned to a node number, with a
+    parent pointer, the tuple of its ancestors from the root down to itself,
+    and cached name and display paths. Each node also keeps rollups of the
+    routes in its subtree, updated as routes are added, including a sketch of
+    the most frequent keywords in fixed memory.
+    """
+    ROOT = -1
+    PATH_SEP = ' > '
+
+    def __init__(self) -> None:
+        self.nodes = dict()  # area id -> node
+        self.ids = []  # node -> area id
+        self.parents = array('l')
+        self.ancestors = []  # node -> tuple of nodes from root to itself
+        self.children = []  # node -> list of child nodes
+        self.area_names = []
+        self.display_names = []
+        self.name_chains = dict()  # node -> tuple of area names
+        self.display_paths = dict()  # node -> display path
+        # Subtree rollups.
+        self.route_counts = array('l')
+        self.votes = array('q')
+        self.stars = array('q')
+        self.type_counts = []  # node -> dict of type -> route count
+        # node -> SpaceSaving of keyword counts, or None until a route with
+        # keywords is added under the node.
+        self.keyword_sketches = []
+        self.lock = Lock()
+
+    @classmethod
+    def from_areas(cls, areas: Iterable[Dict[str, Any]]) -> AreaHierarchy:
+        """
+        Build the hierarchy from area maps in the read_an_area format.
+        """
+        h = cls()
+        for a in areas:
+            h.add_area(
+                a['location_chain'], a.get('area_name', ''),
+                a.get('display_name', ''),
+            )
+        return h
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        # Hierarchies pickled before keyword sketches were kept have none.
+        if 'keyword_sketches' not in state:
+            self.keyword_sketches = [None] * len(self.ids)
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, area_id: str) -> bool:
+        return area_id in self.nodes
+
+    def add_chain(self, location_chain: List[str]) -> int:
+        """
+        Intern every area of a location chain, root first, linking each one to
+        the previous one as its parent. Return the node of the last area.
+        """
+        node = self.ROOT
+        with self.lock:
+            for area_id in location_chain:
+                parent = node
+                node = self.nodes.get(area_id)
+                if node is None:
+                    node = self.new_node(area_id, parent)
+        return node
+
+    def new_node(self, area_id: str, parent: int) -> int:
+        node = len(self.ids)
+        area_id = sys.intern(area_id)
+        self.nodes[area_id] = node
+        self.ids.append(area_id)
+        self.parents.append(parent)
+        self.ancestors.append(
+            (self.ancestors[parent] if parent != self.ROOT else ()) + (node,)
+        )
+        self.children.append([])
+        if parent != self.ROOT:
+            self.children[parent].append(node)
+        self.area_names.append('')
+        self.display_names.append('')
+        self.route_counts.append(0)
+        self.votes.append(0)
+        self.stars.append(0)
+        self.type_counts.append(dict())
+        self.keyword_sketches.append(None)
+        return node
+
+    def add_area(
+        self, location_chain: List[str], area_name: str, display_name: str,
+    ) -> int:
+        """
+        Add the last area of a location chain with its names. Return its node.
+        """
+        node = self.add_chain(location_chain)
+        self.area_names[node] = area_name
+        self.display_names[node] = display_name
+        # Names of this area may be part of paths cached before it was read.
+        self.name_chains.clear()
+        self.display_paths.clear()
+        return node
+
+    def node(self, location_chain: List[str]) -> int:
+        if location_chain and location_chain[-1] in self.nodes:
+            return self.nodes[location_chain[-1]]
+        return self.add_chain(location_chain)
+
+    def name_chain(self, location_chain: List[str]) -> Tuple[str, ...]:
+        """
+        Return the area names of a location chain.
+        """
+        if not location_chain:
+            return ()
+        node = self.node(location_chain)
+        if node not in self.name_chains:
+            self.name_chains[node] = tuple(
+                self.area_names[a] for a in self.ancestors[node]
+            )
+        return self.name_chains[node]
+
+    def display_path(self, location_chain: List[str]) -> str:
+        """
+        Return the display names of a location chain joined by PATH_SEP.
+        """
+        if not location_chain:
+            return ''
+        node = self.node(location_chain)
+        if node not in self.display_paths:
+            self.display_paths[node] = self.PATH_SEP.join(
+                self.display_names[a] for a in self.ancestors[node]
+            )
+        return self.display_paths[node]
+
+    def is_under(self, area_id: str, ancestor_id: str) -> bool:
+        """
+        Return whether an area is the given ancestor area or lies under it.
+        """
+        node = self.nodes.get(area_id)
+        ancestor = self.nodes.get(ancestor_id)
+        if node is None or ancestor is None:
+            return False
+        return ancestor in self.ancestors[node]
+
+    def subtree(self, area_id: str) -> List[str]:
+        """
+        Return the ids of an area and of all areas under it.
+        """
+        if area_id not in self.nodes:
+            return []
+        res = []
+        stack = [self.nodes[area_id]]
+        while stack:
+            node = stack.pop()
+            res.append(self.ids[node])
+            stack.extend(self.children[node])
+        return res
+
+    def find(self, name: str) -> List[str]:
+        """
+        Return the ids of the areas whose area name or display name matches the
+        given name, ignoring case and dashes.
+        """
+        key = ' '.join(name.lower().replace('-', ' ').split())
+        return [
+            self.ids[node]
+            for node in range(len(self.ids))
+            if key in (
+                ' '.join(self.area_names[node].lower().split('-')),
+                self.display_names[node].lower(),
+            )
+        ]
+
+    def add_route(
+        self, location_chain: List[str], scores: List[int], types: List[str],
+        keyword_counts: Iterable[Any] = (),
+    ) -> None:
+        """
+        Add a route to the rollups of every area in its location chain, given
+        its vote counts of 0 to 4 stars, its types and its flattened (keyword,
+        count) pairs.
+        """
+        self.update_rollups(location_chain, scores, types, keyword_counts, 1)
+
+    def remove_route(
+        self, location_chain: List[str], scores: List[int], types: List[str],
+        keyword_counts: Iterable[Any] = (),
+    ) -> None:
+        """
+        Remove a route added by add_route, e.g. before adding it again with
+        its ratings read again. Its keywords are only taken back from the
+        sketches as far as they are still counted.
+        """
+        self.update_rollups(location_chain, scores, types, keyword_counts, -1)
+
+    def update_rollups(
+        self, location_chain: List[str], scores: List[int], types: List[str],
+        keyword_counts: Iterable[Any], sign: int,
+    ) -> None:
+        if not location_chain:
+            return
+        node = self.node(location_chain)
+        votes = sign * sum(scores)
+        stars = sign * sum([s * n for s, n in enumerate(scores)])
+        with self.lock:
+            for a in self.ancestors[node]:
+                self.route_counts[a] += sign
+                self.votes[a] += votes
+                self.stars[a] += stars
+                type_counts = self.type_counts[a]
+                for t in types:
+                    type_counts[t] = type_counts.get(t, 0) + sign
+                    if type_counts[t] == 0:
+                        del type_counts[t]
+                if keyword_counts:
+                    sketch = self.keyword_sketches[a]
+                    if sketch is None:
+                        sketch = SpaceSaving(SKETCH_SIZE)
+                        self.keyword_sketches[a] = sketch
+                    sketch.update(keyword_counts, sign)
+
+    def rollup(self, area_id: str) -> Dict[str, Any]:
+        """
+        Return the route count, vote-weighted average score, vote count, type
+        mix and top keywords of the routes under an area.
+        """
+        node = self.nodes[area_id]
+        votes = self.votes[node]
+        return {
+            'route_count': self.route_counts[node],
+            'votes': votes,
+            'avg_score': (
+                self.stars[node] / votes if votes > 0 else float('nan')
+            ),
+            'type_mix': dict(self.type_counts[node]),
+            'keywords': [k for k, _ in self.top_keywords(area_id)],
+        }
+
+    def top_keywords(
+        self, area_id: str, n: int = 10,
+    ) -> List[Tuple[str, int]]:
+        """
+        Return the n most frequent keywords of the routes under an area with
+        the counts they are guaranteed to have, most frequent first. Keywords
+        not guaranteed to be more frequent than every keyword left out of the
+        sketch are left out too.
+        """
+        node = self.nodes.get(area_id)
+        if node is None or self.keyword_sketches[node] is None:
+            return []
+        return [
+            (k, c - e) for k, c, e in self.keyword_sketches[node].top(n)
+        ]
@@ -0,0 +1,91 @@
+"""
+@author: yuan.shao
+"""
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Union
+
+# Ids buffered in a set before they are merged into the sorted array, at
+# least this many or an eighth of the ids already merged.
+MERGE_SIZE = 4096
+
+Id = Union[int, str]
+
+
+class IdSet:
+    """
+    Set of numeric ids, such as the 9-digit area and route ids, parsed to
+    integers once and kept in a sorted array('Q') of 8 bytes per id instead of
+    as str objects in a set. Ids added are buffered in a small set and merged
+    into the array in batches. Membership accepts ids as int or str.
+    """
+    __slots__ = ['ids', 'pending']
+
+    def __init__(self, ids: Iterable[Id] = ()) -> None:
+        self.ids = array('Q')
+        self.pending = set()
+        self.update(ids)
+
+    def __len__(self) -> int:
+        self.flush()
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        self.flush()
+        return iter(self.ids)
+
+    def __contains__(self, x: Id) -> bool:
+        try:
+            x = int(x)
+        except (TypeError, ValueError):
+            return False
+        return x in self.pending or self.merged(x)
+
+    def merged(self, x: int) -> bool:
+        i = bisect_left(self.ids, x)
+        return i < len(self.ids) and self.ids[i] == x
+
+    def __getstate__(self) -> bytes:
+        self.flush()
+        return self.ids.tobytes()
+
+    def __setstate__(self, state: bytes) -> None:
+        self.ids = array('Q')
+        self.ids.frombytes(state)
+        self.pending = set()
+
+    def add(self, x: Id) -> None:
+        self.pending.add(int(x))
+        if len(self.pending) >= max(MERGE_SIZE, len(self.ids) >> 3):
+            self.flush()
+
+    def update(self, ids: Iterable[Id]) -> None:
+        for x in ids:
+            self.add(x)
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Merge the buffered ids into the sorted array. The merged ids are
+        copied to the new array as bytes, in runs between the places of the
+        new ids, so no Python int is made for them.
+        """
+        if not self.pending:
+            return
+        new = sorted(x for x in self.pending if not self.merged(x))
+        self.pending.clear()
+        if not new:
+            return
+        ids = array('Q')
+        size = ids.itemsize
+        start = 0
+        with memoryview(self.ids) as view, view.cast('B') as old:
+            for x in new:
+                i = bisect_left(self.ids, x, start)
+                ids.frombytes(old[start * size:i * size])
+                ids.append(x)
+                start = i
+            ids.frombytes(old[start * size:])
+        self.ids = ids
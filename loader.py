@@ -0,0 +1,65 @@
+"""
+@author: yuan.shao
+"""
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from route import intern_tuple, Route
+
+# Route details columns whose values are sequences.
+OBJECT_COLUMNS = {
+    'location_chain', 'location_name_chain', 'grade', 'types', 'keywords',
+    'keyword_counts',
+}
+
+
+def records_from_df(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Convert a DataFrame into a list of dicts, one per row. Each column is read
+    into a Python list once and the lists are zipped together, so no per-row
+    pandas objects are created as they are with iterrows().
+    """
+    columns = [str(c) for c in df.columns]
+    values = [df[c].tolist() for c in df.columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def load_areas(areas_file: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Load the areas pickle written by update.py. Return the area maps keyed by
+    area id.
+    """
+    areas_df = pd.read_pickle(areas_file)
+    return {a['area_id']: a for a in records_from_df(areas_df)}
+
+
+def load_routes(routes_file: str) -> List[Dict[str, Any]]:
+    """
+    Load the routes pickle written by update.py. Return the list of route maps.
+    The location chains are interned, so the routes of an area share one.
+    """
+    routes = records_from_df(pd.read_pickle(routes_file))
+    for r in routes:
+        r['location_chain'] = intern_tuple(r['location_chain'])
+    return routes
+
+
+def load_route_details(route_details_file: str) -> List[Dict[str, Any]]:
+    """
+    Load the route details pickle written by update.py. Return the list of maps
+    in the Route.to_map() format.
+    """
+    return records_from_df(pd.read_pickle(route_details_file))
+
+
+def df_from_routes(routes: List[Route]) -> pd.DataFrame:
+    """
+    Build the route details DataFrame from Route objects one column at a time,
+    so only one column of intermediate Python lists exists at any moment.
+    """
+    df = pd.DataFrame(index=pd.RangeIndex(len(routes)))
+    for c, values in Route.iter_columns(routes):
+        dtype = object if c in OBJECT_COLUMNS else None
+        df[c] = pd.Series(values, dtype=dtype)
+    return df
@@ -0,0 +1,245 @@
+"""
+@author: yuan.shao
+"""
+from __future__ import annotations
+
+import getopt
+import json
+import os
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, List
+
+# Upper bounds of the latency buckets in seconds.
+LATENCY_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+]
+
+
+class Counter:
+    TYPE = 'counter'
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, n: float = 1) -> None:
+        with self.lock:
+            self.value += n
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'value': self.value}
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """
+    Count of observations in buckets of upper bounds, with their sum.
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, buckets: List[float] = None) -> None:
+        self.buckets = buckets or LATENCY_BUCKETS
+        # The last count is of the observations above every bound.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        return {
+            'buckets': self.buckets, 'counts': counts, 'count': sum(counts),
+            'sum': total,
+        }
+
+
+class Registry:
+    """
+    Named metrics with labels, created on first use, e.g.
+    REGISTRY.counter('fetch_bytes_total', kind='route').inc(n).
+    """
+    def __init__(self) -> None:
+        self.metrics = dict()  # (name, labels) -> metric
+        self.lock = Lock()
+
+    def get(self, cls: type, name: str, labels: Dict[str, str]) -> Any:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, cls())
+        return metric
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        return self.get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels: str) -> Gauge:
+        return self.get(Gauge, name, labels)
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        return self.get(Histogram, name, labels)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            items = sorted(self.metrics.items(), key=lambda x: x[0])
+        return [
+            {
+                'name': name, 'type': metric.TYPE, 'labels': dict(labels),
+                **metric.snapshot(),
+            }
+            for (name, labels), metric in items
+        ]
+
+    def write_jsonl(self, path: str) -> None:
+        """
+        Append a snapshot of every metric as one JSON line.
+        """
+        line = json.dumps({'time': time(), 'metrics': self.snapshot()})
+        with open(path, 'a') as f:
+            f.write(line + '\n')
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Replace path with every metric in the Prometheus text format.
+        """
+        lines = []
+        typed = set()
+        for m in self.snapshot():
+            name = m['name']
+            if name not in typed:
+                lines.append(f"# TYPE {name} {m['type']}")
+                typed.add(name)
+            labels = format_labels(m['labels'])
+            if m['type'] != Histogram.TYPE:
+                lines.append(f"{name}{labels} {m['value']}")
+                continue
+            cumulative = 0
+            for bound, count in zip(m['buckets'] + ['+Inf'], m['counts']):
+                cumulative += count
+                le = format_labels({**m['labels'], 'le': str(bound)})
+                lines.append(f'{name}_bucket{le} {cumulative}')
+            lines.append(f"{name}_sum{labels} {m['sum']}")
+            lines.append(f"{name}_count{labels} {m['count']}")
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+
+    def write(self, path: str) -> None:
+        """
+        Write the metrics in the Prometheus text format if path ends with
+        .prom, or else append them as JSON lines.
+        """
+        if path.endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class Exporter(Thread):
+    """
+    Thread writing the metrics of a registry to a file every interval
+    seconds, and once more when stopped.
+    """
+    def __init__(
+        self, registry: Registry, path: str, interval: float = 60,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.registry.write(self.path)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+        self.registry.write(self.path)
+
+
+REGISTRY = Registry()
+
+
+def bucket_quantile(m: Dict[str, Any], q: float) -> float:
+    """
+    Return the upper bound of the bucket holding the q quantile of a
+    histogram snapshot, or inf if it is above every bound.
+    """
+    cumulative = 0
+    for bound, count in zip(m['buckets'], m['counts']):
+        cumulative += count
+        if cumulative >= q * m['count']:
+            return bound
+    return float('inf')
+
+
+def main():
+    short_options = 'f:'
+    long_options = ['file=']
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    path = 'output/metrics.jsonl'
+    for a, v in args:
+        if a in ('-f', '--file'):
+            path = v
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if not lines:
+        print(f'No metrics in {path}')
+        sys.exit(1)
+    # Print the latest snapshot.
+    for m in json.loads(lines[-1])['metrics']:
+        name = f"{m['name']}{format_labels(m['labels'])}"
+        if m['type'] != Histogram.TYPE:
+            print(f"{name} = {m['value']:g}")
+        elif m['count'] > 0:
+            print(
+                f"{name}: count = {m['count']}, "
+                f"total = {m['sum']:.1f}s, "
+                f"mean = {1000 * m['sum'] / m['count']:.1f}ms, "
+                f"p50 <= {1000 * bucket_quantile(m, 0.5):g}ms, "
+                f"p95 <= {1000 * bucket_quantile(m, 0.95):g}ms"
+            )
+
+
+if __name__ == '__main__':
+    main()
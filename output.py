@@ -0,0 +1,273 @@
+"""
+@author: yuan.shao
+"""
+import getopt
+import os
+import sys
+from time import time
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from grades import (
+    Grade, GRADE_COLUMNS, grade_keys, MISSING, parse_grade_range,
+)
+from hierarchy import AreaHierarchy
+from loader import records_from_df
+from route import Route
+from utils import elapsed
+
+OUTPUT_DIR = 'output'
+
+SCORE_THRESHOLD = 3.0
+VOTES_THRESHOLD = 10
+
+TYPE_BITS = {t: 1 << i for i, t in enumerate(sorted(Route.TYPES))}
+UNKNOWN_TYPE_BIT = 1 << len(TYPE_BITS)
+OUTPUT_TYPES_MASK = sum(
+    TYPE_BITS[t] for t in ['Sport', 'Trad', 'Boulder', 'Aid', 'Alpine', 'TR']
+)
+
+
+def type_masks(types: pd.Series) -> pd.Series:
+    """
+    Turn a column of type lists into a column of bitmasks over TYPE_BITS.
+    """
+    exploded = types.explode().dropna()
+    bits = exploded.map(TYPE_BITS).fillna(UNKNOWN_TYPE_BIT).astype('int64')
+    return (
+        bits.groupby(level=0).sum()
+        .reindex(types.index, fill_value=0)
+        .astype('int64')
+    )
+
+
+def join_exploded(
+    exploded: pd.Series, index: pd.Index, sep: str,
+) -> pd.Series:
+    """
+    Join an exploded column of strings back into one string per row of index
+    with a grouped join. Rows without any string get ''.
+    """
+    exploded = exploded.dropna().astype(str)
+    # Prefix every string but the first of its row with the separator, so the
+    # join becomes a grouped sum instead of a Python call per row.
+    first = ~exploded.index.duplicated()
+    return (
+        exploded.where(first, sep + exploded)
+        .groupby(level=0).sum()
+        .reindex(index, fill_value='')
+    )
+
+
+def area_table(
+    areas_df: pd.DataFrame, hierarchy: AreaHierarchy,
+) -> pd.DataFrame:
+    """
+    Index the areas by area id, keeping the columns used in the outputs and
+    adding the display path of every area from the hierarchy.
+    """
+    areas = (
+        areas_df[['area_id', 'latitude', 'longitude', 'location_chain']]
+        .drop_duplicates(subset='area_id')
+        .set_index('area_id')
+    )
+    areas['path'] = areas.pop('location_chain').map(hierarchy.display_path)
+    return areas
+
+
+def ensure_grade_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the numeric grade key columns to route details stored before they
+    were computed at ingest.
+    """
+    if all(c in df.columns for c in GRADE_COLUMNS):
+        return df
+    keys = pd.DataFrame(
+        df['grade'].map(grade_keys).tolist(), columns=GRADE_COLUMNS,
+        index=df.index,
+    )
+    df = df.drop(columns=GRADE_COLUMNS, errors='ignore')
+    return pd.concat([df, keys], axis=1)
+
+
+def good_routes(
+    df: pd.DataFrame,
+    score_threshold: float = SCORE_THRESHOLD,
+    votes_threshold: int = VOTES_THRESHOLD,
+    grade_range: Optional[Grade] = None,
+) -> pd.DataFrame:
+    """
+    Return the route details with enough votes and a high enough average score,
+    of output types only, with a known location and, if grade_range is given,
+    a low grade key in that range. A 'type_mask' column is added.
+    """
+    df = ensure_grade_columns(df.reset_index(drop=True))
+    df['type_mask'] = type_masks(df['types'])
+    keep = (
+        (df['avg_score'] >= score_threshold)
+        & (df['votes'] >= votes_threshold)
+        & ((df['type_mask'] & ~OUTPUT_TYPES_MASK) == 0)
+        & (df['location_chain'].str.len() > 0)
+    )
+    if grade_range is not None:
+        scale, low, high = grade_range
+        keys = df[f'{scale}_low']
+        keep &= (keys != MISSING) & (keys >= low) & (keys <= high)
+    return df[keep].reset_index(drop=True)
+
+
+def sort_by_grade(df: pd.DataFrame, keys: pd.Series) -> pd.DataFrame:
+    """
+    Stable sort of a table by ascending grade keys, routes without a grade on
+    the scale last, keeping the current order among routes of the same grade.
+    """
+    keys = keys.where(keys != MISSING, keys.max() + 1)
+    return df.loc[keys.sort_values(kind='stable').index]
+
+
+def build_output_df(
+    df: pd.DataFrame, areas_df: pd.DataFrame, hierarchy: AreaHierarchy,
+) -> pd.DataFrame:
+    """
+    Build the output table of the given good routes, sorted by score, votes and
+    name, with the location paths and coordinates joined from the areas.
+    """
+    areas = area_table(areas_df, hierarchy)
+    last_area = df['location_chain'].str[-1]
+
+    output_df = pd.DataFrame(index=df.index)
+    output_df['name'] = df['display_name']
+    location = last_area.map(areas['path'])
+    missing = location.isna()
+    if missing.any():
+        # Routes under areas that failed to be read.
+        location[missing] = (
+            df.loc[missing, 'location_chain'].map(hierarchy.display_path)
+        )
+    output_df['location'] = location
+    output_df['latitude'] = last_area.map(areas['latitude']).fillna('')
+    output_df['longitude'] = last_area.map(areas['longitude']).fillna('')
+    output_df['score'] = df['avg_score']
+    output_df['votes'] = df['votes']
+    output_df['types'] = join_exploded(
+        df['types'].explode(), df.index, ' / ',
+    )
+    output_df['grade'] = join_exploded(
+        df['grade'].explode(), df.index, ' / ',
+    )
+    output_df['height'] = (
+        df['height'].astype(str).where(df['height'] > 0, '')
+    )
+    output_df['pitches'] = (
+        df['pitches'].astype(str).where(df['pitches'] > 1, '')
+    )
+    output_df['keywords'] = join_exploded(
+        df['keywords'].explode(), df.index, ' | ',
+    )
+    output_df['link'] = df['link']
+    output_df['type_mask'] = df['type_mask']
+    output_df['yds_low'] = df['yds_low']
+    output_df['v_low'] = df['v_low']
+    return output_df.sort_values(
+        by=['score', 'votes', 'name'], ascending=[False, False, True],
+    )
+
+
+def build_outputs(
+    areas_df: pd.DataFrame,
+    route_details_df: pd.DataFrame,
+    output_dir: str = OUTPUT_DIR,
+    score_threshold: float = SCORE_THRESHOLD,
+    votes_threshold: int = VOTES_THRESHOLD,
+    hierarchy: AreaHierarchy = None,
+    grade_range: Optional[Grade] = None,
+    by_grade: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Filter the good routes and write them to boulder_routes.csv and
+    rope_routes.csv in output_dir. Return the boulder and rope tables. The
+    area hierarchy is built from areas_df if not given. Routes are sorted by
+    score, votes and name, or, if by_grade is set, first by V grade for
+    boulders and YDS grade for rope routes.
+    """
+    df = good_routes(
+        route_details_df, score_threshold, votes_threshold, grade_range,
+    )
+    print(f'Total {len(df)} good routes found')
+    if hierarchy is None:
+        hierarchy = AreaHierarchy.from_areas(records_from_df(areas_df))
+    output_df = build_output_df(df, areas_df, hierarchy)
+
+    mask = output_df.pop('type_mask')
+    yds_keys = output_df.pop('yds_low')
+    v_keys = output_df.pop('v_low')
+    is_boulder = (
+        ((mask & TYPE_BITS['Boulder']) != 0) & (output_df['pitches'] == '')
+    )
+    is_rope = mask != TYPE_BITS['Boulder']
+    boulder_df = output_df[is_boulder]
+    rope_df = output_df[is_rope]
+    if by_grade:
+        boulder_df = sort_by_grade(boulder_df, v_keys[is_boulder])
+        rope_df = sort_by_grade(rope_df, yds_keys[is_rope])
+    boulder_df = boulder_df.reset_index(drop=True)
+    boulder_df.to_csv(f'{output_dir}/boulder_routes.csv')
+    rope_df = rope_df.reset_index(drop=True)
+    rope_df.to_csv(f'{output_dir}/rope_routes.csv')
+    print(
+        f'Output {len(boulder_df)} boulder routes, {len(rope_df)} rope routes'
+    )
+    return boulder_df, rope_df
+
+
+def main():
+    short_options = 'd:g:s:v:'
+    long_options = ['output-dir=', 'grade=', 'score=', 'votes=', 'by-grade']
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    output_dir = OUTPUT_DIR
+    score_threshold = SCORE_THRESHOLD
+    votes_threshold = VOTES_THRESHOLD
+    grade_range = None
+    by_grade = False
+    for a, v in args:
+        if a in ('-d', '--output-dir'):
+            output_dir = v
+        elif a in ('-g', '--grade'):
+            grade_range = parse_grade_range(v)
+            if grade_range is None:
+                print(f'Unrecognized grade range {v}')
+                sys.exit(2)
+        elif a == '--by-grade':
+            by_grade = True
+        elif a in ('-s', '--score'):
+            score_threshold = float(v)
+        elif a in ('-v', '--votes'):
+            votes_threshold = int(v)
+
+    areas_file = f'{output_dir}/areas.pkl'
+    route_details_file = f'{output_dir}/route_details.pkl'
+    for f in (areas_file, route_details_file):
+        if not os.path.exists(f):
+            print(f'{f} not found, run update.py first')
+            sys.exit(1)
+    start_time = time()
+    build_outputs(
+        areas_df=pd.read_pickle(areas_file),
+        route_details_df=pd.read_pickle(route_details_file),
+        output_dir=output_dir,
+        score_threshold=score_threshold,
+        votes_threshold=votes_threshold,
+        grade_range=grade_range,
+        by_grade=by_grade,
+    )
+    print(f'Done in {elapsed(start_time)}')
+
+
+if __name__ == '__main__':
+    main()
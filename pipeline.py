@@ -0,0 +1,337 @@
+"""
+@author: yuan.shao
+"""
+import json
+import os
+from time import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import output
+from deadletter import DeadLetters
+from hierarchy import AreaHierarchy
+from loader import df_from_routes, load_areas, load_routes, records_from_df
+from output import OUTPUT_DIR, SCORE_THRESHOLD, VOTES_THRESHOLD
+from profiling import profile_stage
+from route import Route
+from scheduler import CrawlBudget, YieldModel
+from sink import RouteSink
+from utils import elapsed, STATES
+
+# The stages of a full run, in order. The crawler, and with it requests, is
+# only imported by the stages reading pages, and spaCy only once a text
+# analyzer is needed, so loading the stored results or writing the outputs
+# starts in a fraction of a second.
+STAGES = ['areas', 'details', 'output']
+
+AREAS_FILE = 'areas.pkl'
+ROUTES_FILE = 'routes.pkl'
+ROUTE_DETAILS_FILE = 'route_details.pkl'
+DEAD_LETTERS_NAME = 'dead_letters.db'
+# Area tasks left unread when the crawl budget was spent, read first by the
+# next run. They did not fail, so they are kept apart from the dead letters.
+DEFERRED_AREAS_FILE = 'deferred_areas.json'
+
+AreasAndRoutes = Tuple[
+    Dict[str, Dict[str, Any]], List[Dict[str, Any]], AreaHierarchy,
+]
+
+
+def open_dead_letters(output_dir: str = OUTPUT_DIR) -> DeadLetters:
+    return DeadLetters(f'{output_dir}/{DEAD_LETTERS_NAME}')
+
+
+def load_areas_and_routes(
+    output_dir: str = OUTPUT_DIR,
+) -> Optional[AreasAndRoutes]:
+    """
+    Load the areas and routes stored in output_dir, with the hierarchy of the
+    areas. Return None if they were not stored yet.
+    """
+    areas_file = f'{output_dir}/{AREAS_FILE}'
+    routes_file = f'{output_dir}/{ROUTES_FILE}'
+    if not (os.path.exists(areas_file) and os.path.exists(routes_file)):
+        return None
+    areas = load_areas(areas_file)
+    routes = load_routes(routes_file)
+    print(f'Areas and routes loaded from {areas_file} and {routes_file}')
+    return areas, routes, AreaHierarchy.from_areas(areas.values())
+
+
+def save_areas_and_routes(
+    areas: Dict[str, Dict[str, Any]],
+    routes: List[Dict[str, Any]],
+    output_dir: str = OUTPUT_DIR,
+) -> None:
+    areas_file = f'{output_dir}/{AREAS_FILE}'
+    routes_file = f'{output_dir}/{ROUTES_FILE}'
+    areas_df = pd.DataFrame(list(areas.values())).reset_index(drop=True)
+    areas_df.to_pickle(areas_file)
+    print(f'Areas written to {areas_file}')
+    routes_df = pd.DataFrame(routes).reset_index(drop=True)
+    routes_df.to_pickle(routes_file)
+    print(f'Routes written to {routes_file}')
+
+
+def load_deferred_areas(output_dir: str = OUTPUT_DIR) -> List[Any]:
+    path = f'{output_dir}/{DEFERRED_AREAS_FILE}'
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [tuple(t) for t in json.load(f)]
+
+
+def save_deferred_areas(
+    tasks: List[Any], output_dir: str = OUTPUT_DIR,
+) -> None:
+    path = f'{output_dir}/{DEFERRED_AREAS_FILE}'
+    if not tasks:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(tasks, f)
+    os.replace(f'{path}.tmp', path)
+    print(f'{len(tasks)} areas left for the next run in {path}')
+
+
+def crawl_areas(
+    output_dir: str = OUTPUT_DIR,
+    dead_letters: DeadLetters = None,
+    crawl_budget: CrawlBudget = None,
+    prioritize: bool = False,
+) -> Tuple[
+    Dict[str, Dict[str, Any]], List[Dict[str, Any]], AreaHierarchy,
+    List[Dict[str, Any]],
+]:
+    """
+    Load the areas and routes stored in output_dir, or read them from the
+    pages of STATES, then read again the areas that failed in this run or an
+    earlier one. Areas left when crawl_budget is spent are read first by the
+    next run, the same way, and if prioritize, areas with more good routes in
+    the stored route details are read first. Return the areas, the routes,
+    the hierarchy of the areas and the routes found by reading the areas
+    left or failed before.
+    """
+    import crawler
+
+    if dead_letters is None:
+        dead_letters = open_dead_letters(output_dir)
+    loaded = load_areas_and_routes(output_dir)
+    seeds = load_deferred_areas(output_dir)
+    yields = None
+    if prioritize and (
+        loaded is None or seeds or dead_letters.keys('area')
+    ):
+        yields = YieldModel(
+            load_route_details(output_dir), SCORE_THRESHOLD, VOTES_THRESHOLD,
+        )
+    kwargs = dict(yields=yields, crawl_budget=crawl_budget, deferred=[])
+    if loaded is not None:
+        areas, routes, hierarchy = loaded
+        num_routes = len(routes)
+        if seeds:
+            print(f'Read {len(seeds)} areas left by the last run')
+            with profile_stage('areas'):
+                crawler.extend_areas(
+                    seeds, areas, routes, hierarchy,
+                    dead_letters=dead_letters, **kwargs,
+                )
+    else:
+        with profile_stage('areas'):
+            areas, routes, hierarchy = crawler.crawl_areas(
+                crawler.area_seeds(STATES), dead_letters=dead_letters,
+                **kwargs,
+            )
+        num_routes = len(routes)
+    with profile_stage('areas_retry'):
+        crawler.retry_areas(
+            dead_letters, areas, routes, hierarchy, **kwargs,
+        )
+    if loaded is None or len(routes) > num_routes or seeds:
+        save_areas_and_routes(areas, routes, output_dir)
+    save_deferred_areas(kwargs['deferred'], output_dir)
+    print(
+        f'Total number of areas = {len(areas)}, '
+        f'number of routes = {len(routes)}'
+    )
+    return areas, routes, hierarchy, routes[num_routes:]
+
+
+def load_route_details(
+    output_dir: str = OUTPUT_DIR,
+    hierarchy: AreaHierarchy = None,
+) -> List[Route]:
+    """
+    Load the route details stored in output_dir, adding them to the rollups
+    of hierarchy if given. Return an empty list if none were stored yet.
+    """
+    route_details_file = f'{output_dir}/{ROUTE_DETAILS_FILE}'
+    if not os.path.exists(route_details_file):
+        return []
+    route_details = [
+        Route.from_map(m)
+        for m in records_from_df(pd.read_pickle(route_details_file))
+    ]
+    if hierarchy is not None:
+        for r in route_details:
+            hierarchy.add_route(
+                r.location_chain, r.scores, r.types, r.keyword_counts,
+            )
+    print(f'Load {len(route_details)} route details from {route_details_file}')
+    return route_details
+
+
+def crawl_route_details(
+    routes: List[Dict[str, Any]],
+    hierarchy: AreaHierarchy,
+    output_dir: str = OUTPUT_DIR,
+    text_analyzer=None,
+    dead_letters: DeadLetters = None,
+    new_routes: List[Dict[str, Any]] = None,
+    replay: bool = False,
+    build_text_index: bool = False,
+    prune_by_stats: bool = True,
+    recrawl: bool = False,
+    recrawl_budget: int = None,
+    sink: RouteSink = None,
+    crawl_budget: CrawlBudget = None,
+    prioritize: bool = False,
+    snapshot_interval: float = None,
+) -> List[Route]:
+    """
+    Read the details of the routes not stored in output_dir yet, then the
+    routes that failed in this run or an earlier one, and if recrawl, the
+    stored routes due by the recrawl schedule. When replaying, only the
+    failed routes and new_routes, those under the areas read again, are
+    read. Return all route details, saved to output_dir along the way.
+    text_analyzer defaults to the small spaCy model, loaded here. The stored
+    and new route details are streamed to sink if given, and its outputs
+    written every snapshot_interval seconds if given.
+
+    No route is started once crawl_budget is spent, and the routes left are
+    read by the next run. If prioritize, the routes under areas with a larger
+    share of good routes in the stored route details are read first.
+    """
+    import crawler
+    from text_index import TEXT_INDEX_FILE, TextIndexWriter
+
+    if text_analyzer is None:
+        from text_analyzer import SMALL, TextAnalyzer
+
+        text_analyzer = TextAnalyzer(SMALL)
+    if dead_letters is None:
+        dead_letters = open_dead_letters(output_dir)
+    start_time = time()
+    route_details = load_route_details(output_dir, hierarchy)
+    if sink is not None:
+        sink.extend(route_details)
+    yields = None
+    if prioritize:
+        yields = YieldModel(route_details, SCORE_THRESHOLD, VOTES_THRESHOLD)
+    route_details_file = f'{output_dir}/{ROUTE_DETAILS_FILE}'
+    text_index_file = f'{output_dir}/{TEXT_INDEX_FILE}'
+    text_index = None
+    if build_text_index:
+        if route_details and os.path.exists(text_index_file):
+            text_index = TextIndexWriter.load(text_index_file)
+            print(f'Load text index of {len(text_index)} routes')
+        else:
+            text_index = TextIndexWriter()
+
+    last_snapshot = time()
+
+    def save_route_details():
+        nonlocal last_snapshot
+        df_from_routes(route_details).to_pickle(route_details_file)
+        if text_index is not None:
+            text_index.write(text_index_file)
+        if sink is None:
+            return
+        if (
+            snapshot_interval is not None
+            and time() - last_snapshot >= snapshot_interval
+        ):
+            sink.snapshot()
+            last_snapshot = time()
+        else:
+            sink.flush()
+
+    kwargs = dict(
+        text_analyzer=text_analyzer,
+        score_threshold=SCORE_THRESHOLD if prune_by_stats else None,
+        votes_threshold=VOTES_THRESHOLD,
+        checkpoint=save_route_details,
+        sink=sink,
+        crawl_budget=crawl_budget,
+    )
+    if not replay:
+        with profile_stage('route_details'):
+            crawler.crawl_route_details(
+                routes, hierarchy, route_details, text_index=text_index,
+                dead_letters=dead_letters, yields=yields, **kwargs,
+            )
+    # Routes that failed in this run or an earlier one, and when replaying,
+    # the routes under the areas read again.
+    with profile_stage('route_details_retry'):
+        crawler.retry_route_details(
+            dead_letters, route_details, hierarchy,
+            routes=new_routes if replay else None, text_index=text_index,
+            yields=yields, **kwargs,
+        )
+    if recrawl and not replay:
+        with profile_stage('recrawl'):
+            crawler.recrawl_route_details(
+                route_details, hierarchy, budget=recrawl_budget,
+                dead_letters=dead_letters, **kwargs,
+            )
+    with profile_stage('recrawl_retry'):
+        crawler.retry_recrawl(dead_letters, route_details, hierarchy, **kwargs)
+    if len(dead_letters):
+        print(
+            f'!!! {len(dead_letters)} PAGES STILL FAILING, SEE python '
+            f'deadletter.py -f {dead_letters.path}'
+        )
+    print(f'Route details done. Elapsed {elapsed(start_time)}')
+    return route_details
+
+
+def build_outputs(
+    areas: Dict[str, Dict[str, Any]] = None,
+    route_details: List[Route] = None,
+    hierarchy: AreaHierarchy = None,
+    output_dir: str = OUTPUT_DIR,
+    score_threshold: float = SCORE_THRESHOLD,
+    votes_threshold: int = VOTES_THRESHOLD,
+    sink: RouteSink = None,
+) -> None:
+    """
+    Write the good routes to the outputs in output_dir. If the route details
+    were streamed to sink, its partial outputs are sorted into the final ones
+    in bounded memory. Otherwise the areas, route details and hierarchy not
+    given are loaded from output_dir and the outputs built in memory.
+    """
+    if sink is not None:
+        with profile_stage('output'):
+            sink.close()
+        return
+    if areas is None:
+        areas = load_areas(f'{output_dir}/{AREAS_FILE}')
+    if route_details is None:
+        route_details = load_route_details(output_dir)
+    if hierarchy is None:
+        hierarchy = AreaHierarchy.from_areas(areas.values())
+        for r in route_details:
+            hierarchy.add_route(
+                r.location_chain, r.scores, r.types, r.keyword_counts,
+            )
+    with profile_stage('output'):
+        output.build_outputs(
+            areas_df=pd.DataFrame(list(areas.values())),
+            route_details_df=df_from_routes(route_details),
+            output_dir=output_dir,
+            score_threshold=score_threshold,
+            votes_threshold=votes_threshold,
+            hierarchy=hierarchy,
+        )
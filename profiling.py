@@ -0,0 +1,282 @@
+"""
+@author: yuan.shao
+"""
+from __future__ import annotations
+
+import cProfile
+import importlib
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+MODES = [CPROFILE, SAMPLE]
+PROFILE_DIR = 'profiles'
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 15
+# Before Python 3.12 cProfile only profiles the thread enabling it, so each
+# worker thread needs its own profile. From 3.12 one profile covers all
+# threads and no other can be enabled at the same time.
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+IDLE_FRAMES = ('wait (threading.py', '_wait_for_tstate_lock (threading.py')
+
+# (label, module, qualified names) of the functions timed by trace_route,
+# nested under the label before them with more indentation.
+TRACE_FUNCTIONS = [
+    ('fetch (network)', 'web', ['fetch']),
+    ('parse pages', 'route', [
+        'Route.parse_route_page', 'Route.parse_stats_page',
+        'Route.parse_comments_page',
+    ]),
+    ('  clean_text', 'utils', ['clean_text']),
+    ('  dedupe', 'utils', ['dedupe']),
+    ('keywords', 'route', ['Route.generate_keywords']),
+    ('  spaCy pipeline', 'spacy.language', ['Language.__call__']),
+    ('  Sentence phrase extraction', 'text_analyzer', [
+        'Sentence.__init__', 'Sentence.extract_phrases',
+    ]),
+]
+
+
+def frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return (
+        f'{code.co_name} '
+        f'({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+    )
+
+
+class Sampler(Thread):
+    """
+    Low-overhead profiler: a thread taking the stacks of all other threads
+    every interval seconds and counting them by stage, in the collapsed stack
+    format read by flame graph tools.
+    """
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stage = None
+        self.counts = dict()  # stage -> collapsed stack -> samples
+        self.stopped = Event()
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            stage = self.stage
+            if stage is None:
+                continue
+            counts = self.counts.setdefault(stage, dict())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+class Profiler:
+    """
+    Profiles named stages, writing for each stage to output_dir either
+    {stage}.prof, a cProfile dump of the calling thread and of every thread
+    wrapped in profile_thread(), or {stage}.folded, the collapsed stacks
+    sampled from all threads, which flamegraph.pl and speedscope read.
+    """
+    def __init__(
+        self,
+        mode: str = SAMPLE,
+        output_dir: str = PROFILE_DIR,
+        interval: float = SAMPLE_INTERVAL,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f'Unknown profile mode {mode}')
+        self.mode = mode
+        self.output_dir = output_dir
+        self.stage_name = None
+        self.stats = None
+        self.lock = Lock()
+        self.sampler = None
+        if mode == SAMPLE:
+            self.sampler = Sampler(interval)
+            self.sampler.start()
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self.stage_name = name
+        start = perf_counter()
+        if self.sampler is not None:
+            self.sampler.stage = name
+            try:
+                yield
+            finally:
+                self.sampler.stage = None
+                self.write_samples(name)
+        else:
+            self.stats = None
+            with self.thread(main=True):
+                yield
+            self.stats.dump_stats(f'{self.output_dir}/{name}.prof')
+            self.print_stats(name)
+        self.stage_name = None
+        print(f'Stage {name} profiled in {perf_counter() - start:.2f}s')
+
+    @contextmanager
+    def thread(self, main: bool = False) -> Iterator[None]:
+        """
+        Profile the calling thread with cProfile until the end of the block,
+        adding it to the profile of the current stage.
+        """
+        if self.mode != CPROFILE or self.stage_name is None or not (
+            main or PER_THREAD_CPROFILE
+        ):
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def print_stats(self, name: str) -> None:
+        print(f'=== Profile of stage {name}')
+        self.stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+    def write_samples(self, name: str) -> None:
+        counts = self.sampler.counts.pop(name, dict())
+        with open(f'{self.output_dir}/{name}.folded', 'w') as f:
+            for stack, n in sorted(counts.items()):
+                f.write(f'{stack} {n}\n')
+        # Functions most often on top of the stacks, apart from threads
+        # waiting on a lock, e.g. idle workers or the thread joining them.
+        leaves = dict()
+        idle = 0
+        for stack, n in counts.items():
+            leaf = stack.rsplit(';', 1)[-1]
+            if leaf.startswith(IDLE_FRAMES):
+                idle += n
+                continue
+            leaves[leaf] = leaves.get(leaf, 0) + n
+        total = idle + sum(leaves.values())
+        print(f'=== {total} samples of stage {name}')
+        if total == 0:
+            return
+        print(f'{100 * idle / total:5.1f}%  (waiting)')
+        for leaf, n in sorted(leaves.items(), key=lambda x: -x[1])[
+            :TOP_FUNCTIONS
+        ]:
+            print(f'{100 * n / total:5.1f}%  {leaf}')
+
+    def close(self) -> None:
+        if self.sampler is not None:
+            self.sampler.stop()
+
+
+PROFILER: Optional[Profiler] = None
+
+
+def enable(
+    mode: str, output_dir: str = PROFILE_DIR,
+    interval: float = SAMPLE_INTERVAL,
+) -> Profiler:
+    global PROFILER
+    PROFILER = Profiler(mode, output_dir, interval)
+    return PROFILER
+
+
+@contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """
+    Profile a named stage if profiling is enabled.
+    """
+    if PROFILER is None:
+        yield
+    else:
+        with PROFILER.stage(name):
+            yield
+
+
+@contextmanager
+def profile_thread() -> Iterator[None]:
+    """
+    Profile a worker thread as part of the current stage if profiling with
+    cProfile is enabled.
+    """
+    if PROFILER is None:
+        yield
+    else:
+        with PROFILER.thread():
+            yield
+
+
+def trace_route(read: Any, *args: Any, **kwargs: Any) -> Any:
+    """
+    Call read, e.g. Route.read_from_web, under cProfile and print how its
+    time splits into network, page parsing, text cleaning, spaCy and phrase
+    extraction. Return what read returns.
+    """
+    profile = cProfile.Profile()
+    start = perf_counter()
+    res = profile.runcall(read, *args, **kwargs)
+    total = perf_counter() - start
+    stats = pstats.Stats(profile).stats
+    print(f'=== Trace of {read.__qualname__}: {1000 * total:.1f}ms')
+    for label, seconds in trace_breakdown(stats):
+        print(
+            f'{label:<32}{1000 * seconds:10.1f}ms'
+            f'{100 * seconds / total:7.1f}%'
+        )
+    return res
+
+
+def trace_breakdown(
+    stats: Dict[Tuple[str, int, str], Tuple[Any, ...]],
+) -> List[Tuple[str, float]]:
+    """
+    Return the cumulative seconds of each group of TRACE_FUNCTIONS in raw
+    pstats stats.
+    """
+    res = []
+    for label, module, names in TRACE_FUNCTIONS:
+        seconds = 0.0
+        for name in names:
+            key = function_key(module, name)
+            if key in stats:
+                seconds += stats[key][3]
+        res.append((label, seconds))
+    return res
+
+
+def function_key(module: str, name: str) -> Optional[Tuple[str, int, str]]:
+    """
+    Return the pstats key of a function given by module and qualified name.
+    """
+    try:
+        f = importlib.import_module(module)
+    except ImportError:
+        return None
+    for part in name.split('.'):
+        f = getattr(f, part, None)
+    code = getattr(f, '__code__', None)
+    if code is None:
+        return None
+    return code.co_filename, code.co_firstlineno, code.co_name
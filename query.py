@@ -0,0 +1,443 @@
+"""
+@author: yuan.shao
+"""
+from __future__ import annotations
+
+import csv
+import getopt
+import json
+import math
+import os
+import pickle
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from time import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from geo import BBox, GeoIndex
+from grades import Grade, MISSING, parse_grade_range, SCALES
+from hierarchy import AreaHierarchy
+from loader import records_from_df
+from output import ensure_grade_columns, OUTPUT_DIR
+
+INDEX_FILE = 'route_index.pkl'
+# Version of the index layout, so indexes saved by older versions are built
+# again.
+INDEX_VERSION = 3
+NUMERIC_FIELDS = ['avg_score', 'votes', 'pitches', 'height']
+OUTPUT_FIELDS = [
+    'name', 'location', 'latitude', 'longitude', 'score', 'votes', 'types',
+    'grade', 'height', 'pitches', 'keywords', 'link',
+]
+AREA_FIELDS = ['name', 'location', 'routes', 'score', 'votes', 'keywords']
+
+
+class SortedIndex:
+    """
+    Secondary index over one sortable key: the keys in ascending order with the
+    row of each key, so a key range maps to a contiguous slice of rows.
+    """
+    def __init__(self, keyed_rows: Iterable[Tuple[Any, int]]) -> None:
+        pairs = sorted(keyed_rows)
+        self.keys = [k for k, _ in pairs]
+        self.rows = [r for _, r in pairs]
+
+    def span(self, low: Any = None, high: Any = None) -> Tuple[int, int]:
+        i = 0 if low is None else bisect_left(self.keys, low)
+        j = len(self.keys) if high is None else bisect_right(self.keys, high)
+        return i, max(i, j)
+
+
+def index_areas(
+    hierarchy: AreaHierarchy, chains: List[List[str]],
+) -> Tuple[array, Dict[int, array]]:
+    """
+    Return the node in the hierarchy of the area of every route, given their
+    location chains, and the rows of the routes of every node.
+    """
+    area_nodes = array('i')
+    node_rows = dict()
+    for r, chain in enumerate(chains):
+        node = hierarchy.node(chain) if chain else AreaHierarchy.ROOT
+        area_nodes.append(node)
+        if node not in node_rows:
+            node_rows[node] = array('I')
+        node_rows[node].append(r)
+    return area_nodes, node_rows
+
+
+class RouteIndex:
+    """
+    In-memory route table built from the stored route details and areas, with
+    secondary indexes on avg_score, votes, pitches, height, grade, type, area
+    subtree and location. Location chains are not kept per route: every route
+    keeps the node of its area in the hierarchy, whose parent pointers give
+    the rest of the chain.
+    """
+    def __init__(
+        self, route_details_df: pd.DataFrame, areas_df: pd.DataFrame,
+    ) -> None:
+        areas = records_from_df(areas_df)
+        self.hierarchy = AreaHierarchy.from_areas(areas)
+        self.coordinates = {
+            a['area_id']: (a['latitude'], a['longitude']) for a in areas
+        }
+        route_details_df = ensure_grade_columns(route_details_df)
+        self.columns = {
+            c: route_details_df[c].tolist() for c in route_details_df.columns
+        }
+        self.size = len(route_details_df)
+        self.version = INDEX_VERSION
+
+        self.numeric = {
+            f: SortedIndex(
+                (v, r) for r, v in enumerate(self.columns[f])
+                if not math.isnan(v)
+            )
+            for f in NUMERIC_FIELDS
+        }
+        self.grade_index = {
+            scale: SortedIndex(
+                (k, r) for r, k in enumerate(self.columns[f'{scale}_low'])
+                if k != MISSING
+            )
+            for scale in SCALES
+        }
+        self.type_rows = dict()
+        for r, types in enumerate(self.columns['types']):
+            for t in types:
+                self.type_rows.setdefault(t, set()).add(r)
+        chains = self.columns.pop('location_chain')
+        self.columns.pop('location_name_chain', None)
+        self.area_nodes, self.node_rows = index_areas(self.hierarchy, chains)
+        self.geo = GeoIndex(areas)
+        scores = [self.columns[f'score_{s}'] for s in range(5)]
+        for r, chain in enumerate(chains):
+            self.geo.add_route(r, chain)
+            self.hierarchy.add_route(
+                chain, [s[r] for s in scores], self.columns['types'][r],
+                self.columns['keyword_counts'][r],
+            )
+
+    @classmethod
+    def load(cls, output_dir: str = OUTPUT_DIR) -> RouteIndex:
+        """
+        Load the index saved in output_dir, or build it from the route details
+        and areas pickles and save it if they are newer than the saved index.
+        """
+        index_file = f'{output_dir}/{INDEX_FILE}'
+        sources = [
+            f'{output_dir}/route_details.pkl', f'{output_dir}/areas.pkl',
+        ]
+        if os.path.exists(index_file) and all(
+            os.path.getmtime(index_file) >= os.path.getmtime(f)
+            for f in sources
+        ):
+            with open(index_file, 'rb') as f:
+                index = pickle.load(f)
+            if getattr(index, 'version', 1) == INDEX_VERSION:
+                return index
+        index = cls(pd.read_pickle(sources[0]), pd.read_pickle(sources[1]))
+        with open(index_file, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return index
+
+    def query(
+        self,
+        types: List[str] = None,
+        grade: Optional[Grade] = None,
+        ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = None,
+        area_ids: List[str] = None,
+        near: Optional[Tuple[float, float, float]] = None,
+        bbox: Optional[BBox] = None,
+    ) -> List[int]:
+        """
+        Return the rows of the routes having all the given types, a grade on
+        the scale of the given grade range whose low key lies in that range,
+        the NUMERIC_FIELDS values within the given (low, high) ranges (None for
+        an open end), lying under any of the given areas, within near[2] km of
+        the point (near[0], near[1]) and inside the (south, west, north, east)
+        bbox. Rows are sorted by score, votes and name.
+
+        The most selective condition is read from its index and the others are
+        checked on the resulting rows only.
+        """
+        # (number of candidate rows, function returning the candidate rows,
+        # predicate on a row)
+        conditions = []
+        for t in types or []:
+            rows = self.type_rows.get(t, set())
+            conditions.append((len(rows), lambda s=rows: s, rows.__contains__))
+        for field, (low, high) in (ranges or dict()).items():
+            index = self.numeric[field]
+            i, j = index.span(low, high)
+            conditions.append((
+                j - i, lambda s=index.rows, i=i, j=j: s[i:j],
+                self.range_predicate(self.columns[field], low, high),
+            ))
+        if grade is not None:
+            conditions.append(self.grade_condition(grade))
+        if area_ids is not None:
+            conditions.append(self.area_condition(area_ids))
+        if near is not None:
+            rows = set(self.geo.rows_within(*near))
+            conditions.append((len(rows), lambda s=rows: s, rows.__contains__))
+        if bbox is not None:
+            rows = set(self.geo.rows_in_bbox(bbox))
+            conditions.append((len(rows), lambda s=rows: s, rows.__contains__))
+
+        if conditions:
+            conditions.sort(key=lambda c: c[0])
+            _, rows, _ = conditions[0]
+            predicates = [p for _, _, p in conditions[1:]]
+            res = [r for r in rows() if all(p(r) for p in predicates)]
+        else:
+            res = list(range(self.size))
+        scores = self.columns['avg_score']
+        votes = self.columns['votes']
+        names = self.columns['display_name']
+        res.sort(key=lambda r: (
+            -scores[r] if not math.isnan(scores[r]) else math.inf,
+            -votes[r], names[r],
+        ))
+        return res
+
+    def grade_condition(
+        self, grade: Grade,
+    ) -> Tuple[int, Callable[[], Iterable[int]], Callable[[int], bool]]:
+        scale, low, high = grade
+        index = self.grade_index[scale]
+        keys = self.columns[f'{scale}_low']
+        i, j = index.span(low, high)
+        return j - i, lambda: index.rows[i:j], (
+            lambda r: keys[r] != MISSING and low <= keys[r] <= high
+        )
+
+    def area_condition(
+        self, area_ids: List[str],
+    ) -> Tuple[int, Callable[[], Iterable[int]], Callable[[int], bool]]:
+        h = self.hierarchy
+        nodes = {h.nodes[a] for a in area_ids if a in h}
+        subtree = set()
+        for a in area_ids:
+            subtree.update(h.nodes[i] for i in h.subtree(a))
+        node_rows = [self.node_rows[n] for n in subtree if n in self.node_rows]
+        ancestors = h.ancestors
+        area_nodes = self.area_nodes
+        return sum(len(rows) for rows in node_rows), (
+            lambda: set(r for rows in node_rows for r in rows)
+        ), (
+            lambda r: area_nodes[r] != AreaHierarchy.ROOT
+            and not nodes.isdisjoint(ancestors[area_nodes[r]])
+        )
+
+    @staticmethod
+    def range_predicate(
+        values: List[float], low: Optional[float], high: Optional[float],
+    ) -> Callable[[int], bool]:
+        low = -math.inf if low is None else low
+        high = math.inf if high is None else high
+        return lambda r: low <= values[r] <= high
+
+    def resolve_area(self, area: str) -> List[str]:
+        """
+        Return the ids of the areas matching an area id or name.
+        """
+        if area in self.hierarchy:
+            return [area]
+        return self.hierarchy.find(area)
+
+    def area_row(self, area_id: str) -> Dict[str, Any]:
+        """
+        Return the rollups of the routes under an area, with the keywords it
+        is known for and their approximate counts.
+        """
+        h = self.hierarchy
+        rollup = h.rollup(area_id)
+        return {
+            'name': h.display_names[h.nodes[area_id]],
+            'location': h.display_path([area_id]),
+            'routes': rollup['route_count'],
+            'score': rollup['avg_score'],
+            'votes': rollup['votes'],
+            'keywords': ' | '.join(
+                f'{k}: {c}' for k, c in h.top_keywords(area_id)
+            ),
+        }
+
+    def output_row(self, r: int) -> Dict[str, Any]:
+        """
+        Return a route in the format of the output CSV files.
+        """
+        c = self.columns
+        node = self.area_nodes[r]
+        area_id = ''
+        if node != AreaHierarchy.ROOT:
+            area_id = self.hierarchy.ids[node]
+        latitude, longitude = self.coordinates.get(area_id, ('', ''))
+        return {
+            'name': c['display_name'][r],
+            'location': self.hierarchy.display_path(
+                [area_id] if area_id else [],
+            ),
+            'latitude': latitude,
+            'longitude': longitude,
+            'score': c['avg_score'][r],
+            'votes': c['votes'][r],
+            'types': ' / '.join(c['types'][r]),
+            'grade': ' / '.join(c['grade'][r]),
+            'height': str(c['height'][r]) if c['height'][r] > 0 else '',
+            'pitches': str(c['pitches'][r]) if c['pitches'][r] > 1 else '',
+            'keywords': ' | '.join(c['keywords'][r]),
+            'link': c['link'][r],
+        }
+
+
+def write_rows(
+    rows: Iterable[Dict[str, Any]], out: Any, output_format: str,
+    fields: List[str] = None,
+) -> int:
+    """
+    Stream rows to a file object as CSV or JSON lines. Return the number of
+    rows written.
+    """
+    n = 0
+    if output_format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=fields or OUTPUT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + '\n')
+            n += 1
+    return n
+
+
+def parse_range(s: str) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Parse a numeric range 'LOW..HIGH', where either end may be left out, or a
+    single number meaning at least that number.
+    """
+    if '..' not in s:
+        return float(s), None
+    low, high = s.split('..', 1)
+    return (
+        float(low) if low.strip() else None,
+        float(high) if high.strip() else None,
+    )
+
+
+def main():
+    short_options = 'a:b:d:f:g:kl:n:o:p:s:t:v:'
+    long_options = [
+        'area=', 'bbox=', 'output-dir=', 'format=', 'grade=', 'keywords',
+        'limit=', 'near=', 'output=', 'pitches=', 'score=', 'type=',
+        'votes=', 'height=',
+    ]
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    output_dir = OUTPUT_DIR
+    output_format = 'csv'
+    output_file = None
+    limit = None
+    types, areas, grade, ranges = [], [], None, dict()
+    near, bbox = None, None
+    # Whether to write the rollups and top keywords of the areas instead of
+    # their routes.
+    summary = False
+    for a, v in args:
+        if a in ('-a', '--area'):
+            areas.append(v)
+        elif a in ('-b', '--bbox'):
+            bbox = tuple(float(x) for x in v.split(','))
+            if len(bbox) != 4:
+                print('--bbox takes SOUTH,WEST,NORTH,EAST')
+                sys.exit(2)
+        elif a in ('-d', '--output-dir'):
+            output_dir = v
+        elif a in ('-f', '--format'):
+            if v not in ('csv', 'json'):
+                print(f'Unknown format {v}, choose from csv and json')
+                sys.exit(2)
+            output_format = v
+        elif a in ('-g', '--grade'):
+            grade = parse_grade_range(v)
+            if grade is None:
+                print(f'Unrecognized grade range {v}')
+                sys.exit(2)
+        elif a in ('-k', '--keywords'):
+            summary = True
+        elif a in ('-l', '--limit'):
+            limit = int(v)
+        elif a in ('-n', '--near'):
+            near = tuple(float(x) for x in v.split(','))
+            if len(near) != 3:
+                print('--near takes LATITUDE,LONGITUDE,KM')
+                sys.exit(2)
+        elif a in ('-o', '--output'):
+            output_file = v
+        elif a in ('-p', '--pitches'):
+            ranges['pitches'] = parse_range(v)
+        elif a in ('-s', '--score'):
+            ranges['avg_score'] = parse_range(v)
+        elif a in ('-t', '--type'):
+            types.append(v)
+        elif a in ('-v', '--votes'):
+            ranges['votes'] = parse_range(v)
+        elif a == '--height':
+            ranges['height'] = parse_range(v)
+
+    start_time = time()
+    index = RouteIndex.load(output_dir)
+    print(
+        f'Index of {index.size} routes loaded in {time() - start_time:.2f}s',
+        file=sys.stderr,
+    )
+    area_ids = None
+    if areas:
+        area_ids = [i for area in areas for i in index.resolve_area(area)]
+        if not area_ids:
+            print(f'No area found for {areas}', file=sys.stderr)
+            sys.exit(1)
+    if summary:
+        if area_ids is None:
+            print('--keywords takes areas given by --area', file=sys.stderr)
+            sys.exit(2)
+        write_rows(
+            (index.area_row(a) for a in area_ids), sys.stdout, output_format,
+            AREA_FIELDS,
+        )
+        return
+
+    start_time = time()
+    rows = index.query(
+        types=types, grade=grade, ranges=ranges, area_ids=area_ids,
+        near=near, bbox=bbox,
+    )
+    query_time = time() - start_time
+    if limit is not None:
+        rows = rows[:limit]
+    out = open(output_file, 'w', newline='') if output_file else sys.stdout
+    try:
+        n = write_rows(
+            (index.output_row(r) for r in rows), out, output_format,
+        )
+    finally:
+        if output_file:
+            out.close()
+    print(
+        f'{n} routes found in {1000 * query_time:.1f}ms', file=sys.stderr,
+    )
+
+
+if __name__ == '__main__':
+    main()
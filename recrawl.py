@@ -0,0 +1,79 @@
+"""
+@author: yuan.shao
+"""
+import math
+from typing import List
+
+from route import Route
+from text_analyzer import TextAnalyzer
+
+DAY = 24 * 3600
+# A route with no votes is read again about every BASE_INTERVAL. More popular
+# routes, and routes that changed when last read, are read more often, but
+# not more often than every MIN_INTERVAL.
+BASE_INTERVAL = 60 * DAY
+MIN_INTERVAL = 3 * DAY
+# New comments rarely come without a new rating, so the comments of a route
+# whose pages are unchanged are only read again this long after last read.
+TEXT_INTERVAL = 180 * DAY
+
+
+def recrawl_interval(route: Route) -> float:
+    """
+    Return how long after it was last read a route is due to be read again.
+    """
+    interval = BASE_INTERVAL / (1 + math.log1p(route.votes()))
+    if route.changed_at >= route.checked_at > 0:
+        interval /= 2
+    return max(MIN_INTERVAL, interval)
+
+
+def priority(route: Route, now: float) -> float:
+    """
+    Return the age of a route since it was last read in units of its
+    recrawl interval, so it is due once its priority reaches 1. Routes never
+    read with fingerprints come first.
+    """
+    if route.checked_at <= 0:
+        return math.inf
+    return (now - route.checked_at) / recrawl_interval(route)
+
+
+def schedule(routes: List[Route], now: float, budget: int = None) -> List[int]:
+    """
+    Return the indices of the routes due to be read again, highest priority
+    first, at most budget of them.
+    """
+    priorities = [priority(r, now) for r in routes]
+    due = [i for i, p in enumerate(priorities) if p >= 1]
+    due.sort(key=lambda i: -priorities[i])
+    return due if budget is None else due[:budget]
+
+
+def refresh_route(
+    old: Route,
+    text_analyzer: TextAnalyzer = None,
+    score_threshold: float = None,
+    votes_threshold: int = None,
+) -> Route:
+    """
+    Read a route again and return the new Route object. If its route and
+    stats pages are unchanged, its comments are assumed unchanged too and are
+    not read again, unless they were last read TEXT_INTERVAL ago or it was a
+    lite record. Its keywords are only generated again if its comments or
+    descriptions changed. Other arguments are as in Route.read_from_web.
+    """
+    r = Route.read_pages(
+        old.id, old.name, old.location_chain, old.location_name_chain,
+    )
+    if (
+        r.page_hash == old.page_hash
+        and not old.lite
+        and r.checked_at - old.text_checked_at < TEXT_INTERVAL
+    ):
+        r.reuse_text(old)
+    else:
+        r.read_text(text_analyzer, score_threshold, votes_threshold, old=old)
+    if (r.page_hash, r.text_hash) == (old.page_hash, old.text_hash):
+        r.changed_at = old.changed_at
+    return r
@@ -4,18 +4,55 @@
 from __future__ import annotations
 
 import getopt
+import hashlib
+import json
 import re
 import sys
-from typing import Any, Union
+from array import array
+from collections import deque
+from concurrent.futures import (
+    as_completed, Future, FIRST_COMPLETED, ThreadPoolExecutor, wait,
+)
+from contextlib import redirect_stdout
+from itertools import chain
+from threading import RLock
+from time import time
+from typing import (
+    Any, Callable, Iterable, Iterator, Optional, Tuple, Union,
+)
 from typing import Dict, List
 
-import requests
-
+from grades import (
+    Grade, GRADE_COLUMNS, grade_keys, MISSING, parse_grade_range,
+)
+from metrics import REGISTRY
+from profiling import enable, MODES, profile_stage, trace_route
 from text_analyzer import SMALL, TextAnalyzer
 from utils import (
     clean_text, dedupe, flatten, MP_WEBSITE, replace_special_chars,
     TRIVIAL_KEYWORDS,
 )
+from web import fetch
+
+# Tuples shared between routes. Entries are never evicted, so only values
+# that repeat across many routes, e.g. location chains, are interned.
+INTERNED_TUPLES = dict()
+
+
+def intern_tuple(items: List[Any]) -> Tuple[Any, ...]:
+    """
+    Return a tuple equal to the given items, shared with every other tuple
+    interned with the same items. Strings in it are interned too.
+    """
+    t = tuple(sys.intern(x) if isinstance(x, str) else x for x in items)
+    return INTERNED_TUPLES.setdefault(t, t)
+
+
+def content_hash(*parts: Any) -> str:
+    """
+    Return a short hash of the parsed content of a page.
+    """
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
 
 
 class Route:
@@ -24,55 +61,160 @@ class Route:
         'Sport', 'Trad', 'Aid', 'TR', 'Boulder', 'Alpine', 'Ice', 'Snow',
         'Mixed',
     }
-    
+    # Fingerprints of the pages of a route when it was last read: hashes of
+    # the parsed route and stats pages and of the texts keywords are generated
+    # from, the number of comments, when it was last read and changed, and
+    # when its comments were last read.
+    FINGERPRINT_COLUMNS = [
+        'page_hash', 'text_hash', 'num_comments', 'checked_at', 'changed_at',
+        'text_checked_at',
+    ]
+    COLUMNS = [
+        'id', 'name', 'link', 'display_name', 'location_chain',
+        'location_name_chain', 'grade', 'types', 'height', 'pitches',
+        'commitment', 'score_0', 'score_1', 'score_2', 'score_3', 'score_4',
+        'avg_score', 'votes', 'keywords', 'keyword_counts', 'lite',
+        *GRADE_COLUMNS, *FINGERPRINT_COLUMNS,
+    ]
+    LIST_COLUMNS = {
+        'location_chain', 'location_name_chain', 'grade', 'types', 'keywords',
+        'keyword_counts',
+    }
+    __slots__ = (
+        'id', 'name', 'display_name', 'location_chain', 'location_name_chain',
+        'grade', 'grade_keys', 'types', 'height', 'pitches', 'commitment',
+        'scores', 'comments', 'descriptions', 'keywords', 'keyword_counts',
+        'lite', 'page_hash', 'text_hash', 'num_comments', 'checked_at',
+        'changed_at', 'text_checked_at',
+    )
+
     def __init__(
         self, route_id: str, route_name: str, display_name: str,
         location_chain: List[str], location_name_chain: List[str],
         grade: List[str], types: List[str], height: int, pitches: int,
         commitment: str, scores: Dict[int, int], comments: List[str],
         descriptions: List[str], keywords: List[str],
-        keyword_counts: List[Union[str, int]],
+        keyword_counts: List[Union[str, int]], lite: bool = False,
+        stored_grade_keys: List[int] = None,
     ) -> None:
         self.id = route_id
         self.name = route_name
-        self.link = self.get_link(route_id, route_name)
         self.display_name = display_name
-        self.location_chain = location_chain
-        self.location_name_chain = location_name_chain
-        self.grade = grade
-        self.types = types
+        # Location chains, grades and types repeat across many routes, so
+        # intern them to share one object between all routes.
+        self.location_chain = intern_tuple(location_chain)
+        self.location_name_chain = intern_tuple(location_name_chain)
+        self.grade = intern_tuple(grade)
+        # Numeric keys of the grades, parsed once when the route is read so
+        # that sorting and filtering by grade never re-parse the grade strings.
+        if stored_grade_keys is None:
+            stored_grade_keys = grade_keys(self.grade)
+        self.grade_keys = array('h', stored_grade_keys)
+        self.types = intern_tuple(types)
         self.height = height
         self.pitches = pitches
-        self.commitment = commitment
-        self.scores = scores
+        self.commitment = sys.intern(commitment)
+        # Vote counts of 0 (bomb) to 4 stars.
+        self.scores = array('I', [scores[s] for s in range(5)])
         self.comments = comments
         self.descriptions = descriptions
-        self.keywords = keywords
-        self.keyword_counts = keyword_counts
-    
+        # Keywords are mostly unique to a route, so they are not interned,
+        # which would keep them in INTERNED_TUPLES for good.
+        self.keywords = tuple(keywords)
+        self.keyword_counts = tuple(keyword_counts)
+        # A lite route was pruned by its star ratings, so its comments were
+        # never read and it has no keywords.
+        self.lite = lite
+        self.page_hash = ''
+        self.text_hash = ''
+        self.num_comments = 0
+        self.checked_at = 0.0
+        self.changed_at = 0.0
+        self.text_checked_at = 0.0
+
+    @property
+    def link(self) -> str:
+        return self.get_link(self.id, self.name)
+
+    def release_text(self) -> None:
+        """
+        Drop the raw comments and descriptions, which are only needed to
+        generate keywords.
+        """
+        self.comments = []
+        self.descriptions = []
+
     def to_map(self) -> Dict[str, Any]:
-        return {
-            'id': self.id,
-            'name': self.name,
-            'link': self.link,
-            'display_name': self.display_name,
-            'location_chain': self.location_chain,
-            'location_name_chain': self.location_name_chain,
-            'grade': self.grade,
-            'types': self.types,
-            'height': self.height,
-            'pitches': self.pitches,
-            'commitment': self.commitment,
-            'score_0': self.scores[0],
-            'score_1': self.scores[1],
-            'score_2': self.scores[2],
-            'score_3': self.scores[3],
-            'score_4': self.scores[4],
-            'avg_score': self.avg_score(),
-            'votes': self.votes(),
-            'keywords': self.keywords,
-            'keyword_counts': self.keyword_counts,
-        }
+        return dict(zip(self.COLUMNS, self.to_row()))
+
+    @classmethod
+    def from_map(cls, m: Dict[str, Any]) -> Route:
+        """
+        Construct a Route object from a map in the to_map() format. The raw
+        comments and descriptions are not part of the map and are left empty.
+        The stored grade keys are used if the map has them, and parsed from
+        the grades otherwise.
+        """
+        keys = [m.get(c) for c in GRADE_COLUMNS]
+        # Keys are missing from route details stored before they were kept,
+        # and NaN in rows concatenated with those.
+        if any(k is None or k != k for k in keys):
+            keys = None
+        else:
+            keys = [int(k) for k in keys]
+        r = cls(
+            m['id'], m['name'], m['display_name'], m['location_chain'],
+            m['location_name_chain'], m['grade'], m['types'], m['height'],
+            m['pitches'], m['commitment'],
+            {s: m[f'score_{s}'] for s in range(5)}, [], [], m['keywords'],
+            m['keyword_counts'], m.get('lite', False), keys,
+        )
+        # Route details stored before fingerprints were kept have none.
+        for c in cls.FINGERPRINT_COLUMNS:
+            if c in m:
+                setattr(r, c, m[c])
+        return r
+
+    @classmethod
+    def iter_columns(
+        cls, routes: List[Route],
+    ) -> Iterator[Tuple[str, List[Any]]]:
+        """
+        Yield the to_map() fields of the given routes one column at a time, so
+        a DataFrame can be built without a map for every route.
+        """
+        for c in cls.COLUMNS:
+            if c.startswith('score_'):
+                s = int(c[-1])
+                yield c, [r.scores[s] for r in routes]
+            elif c == 'avg_score':
+                yield c, [r.avg_score() for r in routes]
+            elif c == 'votes':
+                yield c, [r.votes() for r in routes]
+            elif c in GRADE_COLUMNS:
+                k = GRADE_COLUMNS.index(c)
+                yield c, [r.grade_keys[k] for r in routes]
+            elif c in cls.LIST_COLUMNS:
+                # Stored as lists, as to_map() returns them, not as the
+                # tuples held by the routes.
+                yield c, [list(getattr(r, c)) for r in routes]
+            else:
+                yield c, [getattr(r, c) for r in routes]
+
+    def to_row(self) -> List[Any]:
+        """
+        Return the to_map() values of this route in the order of COLUMNS.
+        """
+        return [
+            self.id, self.name, self.link, self.display_name,
+            list(self.location_chain), list(self.location_name_chain),
+            list(self.grade), list(self.types), self.height, self.pitches,
+            self.commitment, *self.scores, self.avg_score(), self.votes(),
+            list(self.keywords), list(self.keyword_counts), self.lite,
+            *self.grade_keys, self.page_hash, self.text_hash,
+            self.num_comments, self.checked_at, self.changed_at,
+            self.text_checked_at,
+        ]
 
     def print(self) -> None:
         print(
@@ -81,11 +223,11 @@ class Route:
             f'link = {self.link}'
         )
         print(
-            f'grade = {self.grade}, types = {self.types}, '
+            f'grade = {list(self.grade)}, types = {list(self.types)}, '
             f'height = {self.height}m, pitches = {self.pitches}'
         )
         print(
-            f'score = {self.scores}, '
+            f'score = {dict(enumerate(self.scores))}, '
             f'avg_score = {self.avg_score():.4f}, votes = {self.votes()}'
         )
         print(f'keywords = {self.keywords}')
@@ -110,19 +252,137 @@ class Route:
         location_name_chain: List[str] = None,
         text_analyzer: TextAnalyzer = None,
         print_details: bool = False,
+        keep_text: bool = True,
+        score_threshold: float = None,
+        votes_threshold: int = None,
     ) -> Route:
         """
         Read the details of a route. Construct and return a Route object.
+            - Read the stats page and parse star ratings.
             - Read the route page and parse grade, types, height, number of
             pitches, etc.
-            - Read the stats page and parse star ratings.
             - Read the comments page, then analyze the comments together with
             route descriptions on the route page to generate top keywords.
+        If score_threshold is given, a route whose star ratings already fall
+        below it, or below votes_threshold if given, is returned as a lite
+        record, without reading its comments or generating its keywords. If
+        keep_text is False, the raw comments and descriptions are released
+        once the keywords are generated.
+        """
+        r = cls.read_pages(
+            route_id, route_name, location_chain, location_name_chain,
+        )
+        r.read_text(
+            text_analyzer, score_threshold, votes_threshold, print_details,
+        )
+        if print_details:
+            r.print()
+        if not keep_text:
+            r.release_text()
+        return r
+
+    @classmethod
+    def read_pages(
+        cls,
+        route_id: str,
+        route_name: str,
+        location_chain: List[str] = None,
+        location_name_chain: List[str] = None,
+    ) -> Route:
+        """
+        Read the stats page and the route page of a route. Return a Route
+        object without comments or keywords.
         """
         route_link = cls.get_link(route_id, route_name)
-        response = requests.get(route_link)
-        html = str(response.content)
-        
+        stats_link = f'{MP_WEBSITE}/route/stats/{route_id}/{route_name}'
+        html = fetch(stats_link, 'stats')
+        with REGISTRY.histogram('parse_seconds', kind='stats').time():
+            scores = cls.parse_stats_page(html)
+        html = fetch(route_link, 'route')
+        with REGISTRY.histogram('parse_seconds', kind='route').time():
+            page = cls.parse_route_page(html, route_link)
+        r = cls(
+            route_id, route_name, page['display_name'], location_chain or [],
+            location_name_chain or [], page['grade'], page['types'],
+            page['height'], page['pitches'], page['commitment'], scores, [],
+            page['descriptions'], [], [],
+        )
+        r.page_hash = content_hash(
+            page['display_name'], page['grade'], page['types'],
+            page['height'], page['pitches'], page['commitment'],
+            page['descriptions'], scores,
+        )
+        r.checked_at = r.changed_at = time()
+        return r
+
+    def read_text(
+        self,
+        text_analyzer: TextAnalyzer = None,
+        score_threshold: float = None,
+        votes_threshold: int = None,
+        print_details: bool = False,
+        old: Route = None,
+    ) -> None:
+        """
+        Read the comments of a route read by read_pages and generate its
+        keywords, or mark it lite without reading them if its star ratings
+        fall below the thresholds, as read_from_web does. If old, the route as
+        last read, had keywords generated from the same comments and
+        descriptions, they are kept instead of generated again.
+        """
+        if score_threshold is not None and not self.qualifies(
+            score_threshold, votes_threshold,
+        ):
+            self.lite = True
+            return
+        self.comments = self.read_comments(self.id)
+        self.update_text_hash()
+        if (
+            old is not None and not old.lite
+            and old.text_hash == self.text_hash
+        ):
+            self.keywords = old.keywords
+            self.keyword_counts = old.keyword_counts
+        elif text_analyzer is not None:
+            keywords, keyword_counts = self.generate_keywords(
+                text_analyzer, self.comments + self.descriptions, self.name,
+                self.location_name_chain, print_details,
+            )
+            self.keywords = tuple(keywords)
+            self.keyword_counts = tuple(keyword_counts)
+
+    def reuse_text(self, old: Route) -> None:
+        """
+        Take the text fingerprints and keywords of old, the route as last read,
+        instead of reading its comments again.
+        """
+        self.text_hash = old.text_hash
+        self.num_comments = old.num_comments
+        self.text_checked_at = old.text_checked_at
+        self.keywords = old.keywords
+        self.keyword_counts = old.keyword_counts
+
+    def update_text_hash(self) -> None:
+        """
+        Fingerprint the comments and descriptions, once the comments are read.
+        """
+        self.text_hash = content_hash(self.comments, self.descriptions)
+        self.num_comments = len(self.comments)
+        self.text_checked_at = time()
+
+    @classmethod
+    def read_comments(cls, route_id: str) -> List[str]:
+        comments_link = f'{MP_WEBSITE}/Climb-Route/{route_id}/comments'
+        html = fetch(comments_link, 'comments')
+        with REGISTRY.histogram('parse_seconds', kind='comments').time():
+            return cls.parse_comments_page(html)
+
+    @classmethod
+    def parse_route_page(cls, html: str, route_link: str) -> Dict[str, Any]:
+        """
+        Parse the display name, grade, types, height, number of pitches,
+        commitment grade and descriptions from a route page.
+        """
         display_name = ''
         display_name_read = re.findall(r'<h1>\\n(.*?)\\n', html)
         if len(display_name_read) > 0:
@@ -174,7 +434,6 @@ class Route:
                     commitment = commitment_read[0]
                     continue
                 print(f'!!! UNRECOGNIZED INFO: {i}, LINK = {route_link}')
-        types = sorted(types_set)
         
         descriptions_read = re.findall(
             r'</h2>\\n\s*?<div class="fr-view">(.*?)</div>\\n', html,
@@ -182,11 +441,21 @@ class Route:
         descriptions = dedupe(
             flatten([clean_text(d) for d in descriptions_read])
         )
-        
-        stats_link = f'{MP_WEBSITE}/route/stats/{route_id}/{route_name}'
-        response = requests.get(stats_link)
-        html = str(response.content)
-        
+        return {
+            'display_name': display_name,
+            'grade': grade,
+            'types': sorted(types_set),
+            'height': height,
+            'pitches': pitches,
+            'commitment': commitment,
+            'descriptions': descriptions,
+        }
+
+    @staticmethod
+    def parse_stats_page(html: str) -> Dict[int, int]:
+        """
+        Return the number of votes of 0 (bomb) to 4 stars on a stats page.
+        """
         scores = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
         ratings = html.split('!--START-STARS-Climb')
         for r in ratings[1:]:
@@ -197,86 +466,374 @@ class Route:
             b = r.count('/img/stars/bombBlue.svg')
             if b > 0:
                 scores[0] += 1
-        
-        comments_link = f'{MP_WEBSITE}/Climb-Route/{route_id}/comments'
-        response = requests.get(comments_link)
-        html = str(response.content)
+        return scores
+
+    @staticmethod
+    def parse_comments_page(html: str) -> List[str]:
         comments_read = re.findall(
             r'<span id="\d+-full".*?>(.*?)</span>', html,
         )
-        comments = dedupe(flatten([clean_text(c) for c in comments_read]))
+        return dedupe(flatten([clean_text(c) for c in comments_read]))
 
-        if location_chain is None:
-            location_chain = []
-        if location_name_chain is None:
-            location_name_chain = []
-
-        keywords, keyword_counts = [], []
-        if text_analyzer is not None:
+    @classmethod
+    def generate_keywords(
+        cls,
+        text_analyzer: TextAnalyzer,
+        texts: List[str],
+        route_name: str,
+        location_name_chain: List[str],
+        print_details: bool = False,
+    ) -> Tuple[List[str], List[Union[str, int]]]:
+        """
+        Return the top keywords of the texts of a route and the flattened
+        (keyword, count) pairs, leaving out trivial keywords and the names of
+        the route and its areas.
+        """
+        keywords = []
+        with REGISTRY.histogram('nlp_seconds').time():
             raw_keywords, counts = text_analyzer.generate_keywords(
-                texts=comments + descriptions, print_details=print_details,
+                texts=texts, print_details=print_details,
             )
-            own_name = ' '.join(route_name.split('-'))
-            location_names = [
-                ' '.join(name.split('-')) for name in location_name_chain
-            ]
-            raw_keywords = [
-                p for p in raw_keywords
-                if not (
-                    p in TRIVIAL_KEYWORDS
-                    or p in own_name
-                    or any([(p in name) for name in location_names])
-                    or len(p) == 1
-                    or p.isnumeric()
-                )
-            ]
-            keyword_counts = flatten([[p, counts[p]] for p in raw_keywords])
-            for word in raw_keywords:
-                if any([(word in w) for w in keywords]):
-                    continue
-                keywords.append(word)
-                if len(keywords) == cls.TOP_KEYWORDS:
-                    break
+        own_name = ' '.join(route_name.split('-'))
+        location_names = [
+            ' '.join(name.split('-')) for name in location_name_chain
+        ]
+        raw_keywords = [
+            p for p in raw_keywords
+            if not (
+                p in TRIVIAL_KEYWORDS
+                or p in own_name
+                or any([(p in name) for name in location_names])
+                or len(p) == 1
+                or p.isnumeric()
+            )
+        ]
+        keyword_counts = flatten([[p, counts[p]] for p in raw_keywords])
+        for word in raw_keywords:
+            if any([(word in w) for w in keywords]):
+                continue
+            keywords.append(word)
+            if len(keywords) == cls.TOP_KEYWORDS:
+                break
+        return keywords, keyword_counts
 
-        r = cls(
-            route_id, route_name, display_name, location_chain,
-            location_name_chain, grade, types, height, pitches, commitment,
-            scores, comments, descriptions, keywords, keyword_counts,
-        )
-        if print_details:
-            r.print()
-        return r
+    def qualifies(
+        self, score_threshold: Optional[float], votes_threshold: Optional[int],
+    ) -> bool:
+        """
+        Return whether the route has enough votes and a high enough average
+        score to be output. A threshold of None is no constraint.
+        """
+        if votes_threshold is not None and self.votes() < votes_threshold:
+            return False
+        return score_threshold is None or self.avg_score() >= score_threshold
     
     def votes(self) -> int:
-        return sum(self.scores.values())
+        return sum(self.scores)
     
     def avg_score(self) -> float:
         if self.votes() == 0:
             return float('nan')
-        return sum([s * n for s, n in self.scores.items()]) / self.votes()
+        return sum([s * n for s, n in enumerate(self.scores)]) / self.votes()
+
+
+class LazyRoute(Route):
+    """
+    Route read from its route and stats pages only. Its comments are read the
+    first time they are accessed, and its keywords are generated the first
+    time they or their counts are accessed, then kept. So a consumer choosing
+    routes by their grades, types or star ratings reads the comments and
+    generates the keywords of only the routes it keeps.
+    """
+    __slots__ = (
+        '_comments', '_keywords', '_keyword_counts', 'text_analyzer', 'lock',
+    )
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.text_analyzer = None
+        # Reentrant, as generating the keywords reads the comments.
+        self.lock = RLock()
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def read_from_web(
+        cls,
+        route_id: str,
+        route_name: str,
+        location_chain: List[str] = None,
+        location_name_chain: List[str] = None,
+        text_analyzer: TextAnalyzer = None,
+    ) -> LazyRoute:
+        r = cls.read_pages(
+            route_id, route_name, location_chain, location_name_chain,
+        )
+        r._comments = None
+        r._keywords = None
+        r._keyword_counts = None
+        r.text_analyzer = text_analyzer
+        return r
+
+    @property
+    def comments(self) -> List[str]:
+        with self.lock:
+            if self._comments is None:
+                self._comments = self.read_comments(self.id)
+                self.update_text_hash()
+        return self._comments
+
+    @comments.setter
+    def comments(self, comments: List[str]) -> None:
+        self._comments = comments
+
+    @property
+    def keywords(self) -> Tuple[str, ...]:
+        self.load_keywords()
+        return self._keywords
+
+    @keywords.setter
+    def keywords(self, keywords: Iterable[str]) -> None:
+        self._keywords = tuple(keywords)
+
+    @property
+    def keyword_counts(self) -> Tuple[Union[str, int], ...]:
+        self.load_keywords()
+        return self._keyword_counts
+
+    @keyword_counts.setter
+    def keyword_counts(
+        self, keyword_counts: Iterable[Union[str, int]],
+    ) -> None:
+        self._keyword_counts = tuple(keyword_counts)
+
+    def load_keywords(self) -> None:
+        """
+        Generate the keywords once, reading the comments first if needed. A
+        route without a text analyzer gets no keywords.
+        """
+        with self.lock:
+            if self._keywords is not None:
+                return
+            texts = self.comments + self.descriptions
+            keywords, keyword_counts = [], []
+            if self.text_analyzer is not None:
+                keywords, keyword_counts = self.generate_keywords(
+                    self.text_analyzer, texts, self.name,
+                    self.location_name_chain,
+                )
+            self._keyword_counts = tuple(keyword_counts)
+            self._keywords = tuple(keywords)
+
+
+BATCH_THREADS = 16
+
+
+def route_filter(
+    score_threshold: float = None,
+    votes_threshold: int = None,
+    grade_range: Grade = None,
+) -> Optional[Callable[[Route], bool]]:
+    """
+    Return a function telling whether a route has a high enough average
+    score, enough votes and, if grade_range is given, a low grade key in that
+    range, as output.good_routes does, or None if nothing is filtered.
+    """
+    if score_threshold is None and votes_threshold is None and (
+        grade_range is None
+    ):
+        return None
+
+    def select(r: Route) -> bool:
+        if not r.qualifies(score_threshold, votes_threshold):
+            return False
+        if grade_range is None:
+            return True
+        scale, low, high = grade_range
+        key = r.grade_keys[GRADE_COLUMNS.index(f'{scale}_low')]
+        return key != MISSING and low <= key <= high
+
+    return select
+
+
+def split_link(link: str) -> Tuple[str, str]:
+    """
+    Return the route id and route name of a route link.
+    """
+    s = link.strip().rstrip('/').split('/')
+    return s[-2], s[-1]
+
+
+def read_link(
+    link: str,
+    text_analyzer: TextAnalyzer,
+    select: Callable[[Route], bool] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Read the route of a link as a LazyRoute. Return None if select is given
+    and rejects the route, whose comments are then never read nor its
+    keywords generated. Otherwise return its to_map(), which reads them, or
+    the link and the error if it cannot be read or parsed, so one bad link
+    does not stop the others.
+    """
+    try:
+        route_id, route_name = split_link(link)
+        r = LazyRoute.read_from_web(
+            route_id, route_name, text_analyzer=text_analyzer,
+        )
+        if select is not None and not select(r):
+            return None
+        m = r.to_map()
+    except Exception as err:
+        return {'link': link, 'error': f'{type(err).__name__}: {err}'}
+    # The average score of a route without votes is NaN, which is not JSON.
+    if m['avg_score'] != m['avg_score']:
+        m['avg_score'] = None
+    return m
+
+
+def read_batch(
+    links: Iterable[str],
+    text_analyzer: TextAnalyzer,
+    num_threads: int = BATCH_THREADS,
+    ordered: bool = False,
+    select: Callable[[Route], bool] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Read the routes of links from num_threads threads sharing text_analyzer,
+    yielding the results of read_link as they complete or, if ordered, in the
+    order of the links. Links are taken from the iterable as threads free up,
+    so it can be a stream. Only the routes select keeps are yielded, and only
+    their comments are read and keywords generated.
+    """
+    window = 4 * num_threads
+    with ThreadPoolExecutor(num_threads) as executor:
+        pending = deque() if ordered else set()
+
+        def done() -> List[Future]:
+            nonlocal pending
+            if ordered:
+                return [pending.popleft()]
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            return list(finished)
+
+        for link in links:
+            future = executor.submit(read_link, link, text_analyzer, select)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+            while len(pending) >= window:
+                for f in done():
+                    if f.result() is not None:
+                        yield f.result()
+        for f in pending if ordered else as_completed(pending):
+            if f.result() is not None:
+                yield f.result()
+
+
+def read_links(paths: List[str]) -> Iterator[str]:
+    """
+    Yield the links in the given files, one per line, with - for stdin.
+    Blank lines and lines starting with # are skipped.
+    """
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
 
 
 def main():
-    short_options = 'l:'
-    long_options = ['link=']
+    short_options = 'bf:g:l:n:op:s:tv:'
+    long_options = [
+        'batch', 'file=', 'grade=', 'link=', 'threads=', 'ordered',
+        'profile=', 'score-threshold=', 'trace-route', 'votes-threshold=',
+    ]
     try:
-        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+        args, rest = getopt.getopt(sys.argv[1:], short_options, long_options)
     except getopt.error as err:
         print(str(err))
         sys.exit(2)
 
-    text_analyzer = TextAnalyzer(SMALL)
+    links = []
+    files = []
+    batch = False
+    num_threads = BATCH_THREADS
+    ordered = False
+    profile_mode = None
+    # In batch mode, only the routes with at least these scores and votes and
+    # a grade in this range are output, and only their comments are read.
+    score_threshold = None
+    votes_threshold = None
+    grade_range = None
+    trace = False
     for a, v in args:
-        if a in ('-l', '--link'):
-            if v[-1] == '/':
-                v = v[:-1]
-            s = v.split('/')
-            Route.read_from_web(
-                route_id=s[-2],
-                route_name=s[-1],
-                text_analyzer=text_analyzer,
-                print_details=True,
-            )
+        if a in ('-b', '--batch'):
+            batch = True
+        elif a in ('-f', '--file'):
+            files.append(v)
+        elif a in ('-g', '--grade'):
+            grade_range = parse_grade_range(v)
+            if grade_range is None:
+                print(f'Unrecognized grade range {v}')
+                sys.exit(2)
+        elif a in ('-l', '--link'):
+            links.append(v)
+        elif a in ('-n', '--threads'):
+            num_threads = int(v)
+        elif a in ('-o', '--ordered'):
+            ordered = True
+        elif a in ('-p', '--profile'):
+            if v not in MODES:
+                print(f'Unknown profile mode {v}, choose from {MODES}')
+                sys.exit(2)
+            profile_mode = v
+        elif a in ('-s', '--score-threshold'):
+            score_threshold = float(v)
+        elif a in ('-t', '--trace-route'):
+            trace = True
+        elif a in ('-v', '--votes-threshold'):
+            votes_threshold = int(v)
+
+    links.extend(rest)
+    if batch and not links and not files:
+        files.append('-')
+
+    text_analyzer = TextAnalyzer(SMALL)
+    if batch:
+        # One JSON line per route on stdout, with anything else printed while
+        # reading the routes sent to stderr.
+        out = sys.stdout
+        with redirect_stdout(sys.stderr):
+            for m in read_batch(
+                chain(links, read_links(files)), text_analyzer, num_threads,
+                ordered,
+                route_filter(score_threshold, votes_threshold, grade_range),
+            ):
+                out.write(json.dumps(m) + '\n')
+                out.flush()
+        return
+
+    profiler = enable(profile_mode) if profile_mode else None
+    for v in chain(links, read_links(files)):
+        route_id, route_name = split_link(v)
+        kwargs = {
+            'route_id': route_id,
+            'route_name': route_name,
+            'text_analyzer': text_analyzer,
+            'print_details': not trace,
+        }
+        if trace:
+            trace_route(Route.read_from_web, **kwargs)
+        else:
+            with profile_stage(f'route_{route_id}'):
+                Route.read_from_web(**kwargs)
+    if profiler is not None:
+        profiler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+"""
+@author: yuan.shao
+"""
+from time import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from route import Route
+from web import REQUESTS
+
+# Routes of the overall share of good routes mixed into the share of an area,
+# so an area with few routes read is not trusted too much either way.
+PRIOR_ROUTES = 10
+
+
+class CrawlBudget:
+    """
+    Wall-clock and request budget of a crawl, shared by all its stages. No
+    task is started once either is spent, so a crawl stops within about one
+    task of its budget.
+    """
+    def __init__(self, seconds: float = None, requests: int = None) -> None:
+        self.deadline = None if seconds is None else time() + seconds
+        self.requests = requests
+        self.start_requests = REQUESTS.value
+
+    def exhausted(self) -> bool:
+        if self.deadline is not None and time() >= self.deadline:
+            return True
+        return (
+            self.requests is not None
+            and REQUESTS.value - self.start_requests >= self.requests
+        )
+
+    def __str__(self) -> str:
+        parts = []
+        if self.deadline is not None:
+            parts.append(f'{max(0.0, self.deadline - time()):.0f}s')
+        if self.requests is not None:
+            used = REQUESTS.value - self.start_requests
+            parts.append(f'{max(0, self.requests - used)} requests')
+        return ' and '.join(parts) + ' left' if parts else 'unlimited'
+
+
+class YieldModel:
+    """
+    Expected yield of the area and route tasks of a crawl, learned from the
+    route details of earlier runs: how many good routes were found under every
+    area, and which share of the routes read under it were good. Tasks of
+    areas never read before are all alike, so they keep their crawl order.
+    """
+    def __init__(
+        self,
+        route_details: Iterable[Route],
+        score_threshold: float,
+        votes_threshold: int,
+    ) -> None:
+        self.routes = dict()  # area id -> routes read under it
+        self.good = dict()  # area id -> good routes under it
+        num_routes = 0
+        num_good = 0
+        for r in route_details:
+            good = r.qualifies(score_threshold, votes_threshold)
+            for a in r.location_chain:
+                self.routes[a] = self.routes.get(a, 0) + 1
+                if good:
+                    self.good[a] = self.good.get(a, 0) + 1
+            num_routes += 1
+            num_good += good
+        self.rate = num_good / num_routes if num_routes else 0.0
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def area_priority(self, task: Tuple[str, str, List[str]]) -> float:
+        """
+        Return the number of good routes found under an area before.
+        """
+        return self.good.get(task[0], 0)
+
+    def route_priority(self, task: Dict[str, Any]) -> float:
+        """
+        Return the estimated chance of a route to be good: the share of good
+        routes under the nearest area of its location chain with routes read
+        before, mixed with the overall share.
+        """
+        for a in reversed(task['location_chain']):
+            n = self.routes.get(a)
+            if n:
+                return (
+                    (self.good.get(a, 0) + PRIOR_ROUTES * self.rate)
+                    / (n + PRIOR_ROUTES)
+                )
+        return self.rate
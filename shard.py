@@ -0,0 +1,361 @@
+"""
+@author: yuan.shao
+"""
+import getopt
+import os
+import socket
+import sqlite3
+import sys
+from contextlib import closing
+from multiprocessing import Process
+from time import time
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+
+from crawler import (
+    crawl_areas, crawl_route_details, NUM_OF_THREADS, retry_areas,
+    retry_route_details,
+)
+from deadletter import DeadLetters
+from hierarchy import AreaHierarchy
+from loader import df_from_routes, load_areas, load_routes, records_from_df
+from metrics import Exporter, REGISTRY
+from output import OUTPUT_DIR, SCORE_THRESHOLD, VOTES_THRESHOLD
+from route import Route
+from text_analyzer import SMALL, TextAnalyzer
+from utils import elapsed, STATES
+
+FRONTIER_FILE = f'{OUTPUT_DIR}/frontier.db'
+SHARD_DIR = f'{OUTPUT_DIR}/shards'
+# A claimed shard whose worker has not renewed its claim for this long is
+# assumed dead and can be claimed by another worker.
+LEASE = 3600
+# (file name, id column) of the shard files merged.
+MERGE_KEYS = [
+    ('areas', 'area_id'), ('routes', 'route_id'), ('route_details', 'id'),
+]
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+
+
+class LeaseLost(Exception):
+    """
+    Raised to a worker whose claim of an area expired and was taken by
+    another worker, so it stops writing to the shard of the area.
+    """
+
+
+class Frontier:
+    """
+    Work queue of the top-level areas shared by all workers, kept in an SQLite
+    file. A worker claims one area at a time in a write transaction, so no
+    two workers get the same area, and renews its claim as it makes progress.
+    """
+    def __init__(self, path: str = FRONTIER_FILE) -> None:
+        self.path = path
+        with closing(self.connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS shards ('
+                'area_id TEXT PRIMARY KEY, area_name TEXT, status TEXT, '
+                'worker TEXT, claimed_at REAL)'
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def add(self, states: List[str]) -> None:
+        """
+        Add top-level areas given as 'id/name', as in STATES, that are not in
+        the frontier yet.
+        """
+        with closing(self.connect()) as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO shards VALUES (?, ?, ?, NULL, NULL)',
+                [(*state.split('/'), PENDING) for state in states],
+            )
+
+    def claim(self, worker: str) -> Optional[Tuple[str, str]]:
+        """
+        Claim the next pending area, or an area whose claim expired. Return
+        its id and name, or None if no area is left.
+        """
+        now = time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT area_id, area_name FROM shards WHERE status = ? OR '
+                '(status = ? AND claimed_at < ?) ORDER BY rowid LIMIT 1',
+                (PENDING, CLAIMED, now - LEASE),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE shards SET status = ?, worker = ?, claimed_at = ? '
+                    'WHERE area_id = ?',
+                    (CLAIMED, worker, now, row[0]),
+                )
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return row
+
+    def renew(self, area_id: str, worker: str) -> None:
+        """
+        Renew the claim of a worker on an area. Raise LeaseLost if another
+        worker claimed it since.
+        """
+        self.update(
+            'UPDATE shards SET claimed_at = ? '
+            'WHERE area_id = ? AND worker = ? AND status = ?',
+            (time(), area_id, worker, CLAIMED), area_id, worker,
+        )
+
+    def finish(self, area_id: str, worker: str) -> None:
+        """
+        Mark an area claimed by a worker done. Raise LeaseLost if another
+        worker claimed it since.
+        """
+        self.update(
+            'UPDATE shards SET status = ? '
+            'WHERE area_id = ? AND worker = ? AND status = ?',
+            (DONE, area_id, worker, CLAIMED), area_id, worker,
+        )
+
+    def update(
+        self, sql: str, params: Tuple, area_id: str, worker: str,
+    ) -> None:
+        with closing(self.connect()) as conn:
+            if conn.execute(sql, params).rowcount == 0:
+                raise LeaseLost(f'{worker} lost its claim on {area_id}')
+
+    def status(self) -> List[Tuple[str, str, str, Optional[str]]]:
+        """
+        Return the id, name, status and worker of every area.
+        """
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                'SELECT area_id, area_name, status, worker FROM shards '
+                'ORDER BY rowid'
+            ).fetchall()
+
+
+def crawl_shard(
+    area_id: str,
+    area_name: str,
+    shard_dir: str,
+    text_analyzer: TextAnalyzer,
+    prune: bool = True,
+    checkpoint: Callable[[], None] = None,
+    num_threads: int = NUM_OF_THREADS,
+) -> None:
+    """
+    Read a top-level area, all areas and routes under it and the details of
+    the routes into areas.pkl, routes.pkl and route_details.pkl in shard_dir,
+    resuming from the files already there. checkpoint is called after every
+    chunk of areas read and before every write to shard_dir, and stops the
+    crawl if it raises. Pages that fail every try are kept in dead_letters.db
+    in shard_dir and read again at the end of their stage.
+    """
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    areas_file = f'{shard_dir}/areas.pkl'
+    routes_file = f'{shard_dir}/routes.pkl'
+    route_details_file = f'{shard_dir}/route_details.pkl'
+    dead_letters = DeadLetters(f'{shard_dir}/dead_letters.db')
+
+    def save_areas_and_routes():
+        if checkpoint is not None:
+            checkpoint()
+        pd.DataFrame(list(areas.values())).to_pickle(areas_file)
+        pd.DataFrame(routes).to_pickle(routes_file)
+
+    if os.path.exists(areas_file) and os.path.exists(routes_file):
+        areas = load_areas(areas_file)
+        routes = load_routes(routes_file)
+        hierarchy = AreaHierarchy.from_areas(areas.values())
+    else:
+        areas, routes, hierarchy = crawl_areas(
+            [(area_id, area_name, [area_id])], checkpoint, num_threads,
+            dead_letters,
+        )
+        save_areas_and_routes()
+    if retry_areas(dead_letters, areas, routes, hierarchy):
+        save_areas_and_routes()
+    print(f'{area_name}: {len(areas)} areas, {len(routes)} routes')
+
+    route_details = []
+    if os.path.exists(route_details_file):
+        route_details = [
+            Route.from_map(m)
+            for m in records_from_df(pd.read_pickle(route_details_file))
+        ]
+
+    def save_route_details():
+        if checkpoint is not None:
+            checkpoint()
+        df_from_routes(route_details).to_pickle(route_details_file)
+
+    crawl_route_details(
+        routes, hierarchy, route_details,
+        text_analyzer=text_analyzer,
+        score_threshold=SCORE_THRESHOLD if prune else None,
+        votes_threshold=VOTES_THRESHOLD,
+        checkpoint=save_route_details,
+        num_threads=num_threads,
+        dead_letters=dead_letters,
+    )
+    retry_route_details(
+        dead_letters, route_details, hierarchy,
+        text_analyzer=text_analyzer,
+        score_threshold=SCORE_THRESHOLD if prune else None,
+        votes_threshold=VOTES_THRESHOLD,
+        checkpoint=save_route_details,
+    )
+    if not os.path.exists(route_details_file):
+        save_route_details()
+
+
+def work(
+    frontier_file: str,
+    shard_dir: str,
+    worker: str,
+    prune: bool = True,
+    num_threads: int = NUM_OF_THREADS,
+) -> None:
+    """
+    Claim top-level areas from the frontier and crawl each into its own shard
+    until no area is left. The metrics of the worker are written to
+    metrics-{worker}.jsonl in shard_dir.
+    """
+    frontier = Frontier(frontier_file)
+    text_analyzer = TextAnalyzer(SMALL)
+    exporter = Exporter(REGISTRY, f'{shard_dir}/metrics-{worker}.jsonl')
+    exporter.start()
+    while True:
+        claim = frontier.claim(worker)
+        if claim is None:
+            break
+        area_id, area_name = claim
+        start_time = time()
+        print(f'{worker} claimed {area_id}/{area_name}')
+        try:
+            crawl_shard(
+                area_id, area_name, f'{shard_dir}/{area_id}', text_analyzer,
+                prune=prune,
+                checkpoint=lambda: frontier.renew(area_id, worker),
+                num_threads=num_threads,
+            )
+            frontier.finish(area_id, worker)
+        except LeaseLost as err:
+            # The worker that took the claim resumes from the shard files.
+            print(f'!!! {err}, STOPPED')
+            continue
+        print(f'{worker} done with {area_name} in {elapsed(start_time)}')
+    exporter.stop()
+
+
+def merge_shards(
+    frontier_file: str, shard_dir: str, output_dir: str = OUTPUT_DIR,
+) -> None:
+    """
+    Combine the areas, routes and route details of all done shards into
+    areas.pkl, routes.pkl and route_details.pkl in output_dir. An area or
+    route written more than once, as by two workers racing on an expired
+    claim, is kept once.
+    """
+    done = []
+    for area_id, area_name, status, _ in Frontier(frontier_file).status():
+        if status == DONE:
+            done.append(area_id)
+        else:
+            print(f'!!! SHARD {area_id}/{area_name} IS {status.upper()}')
+    if not done:
+        print('No shard is done yet')
+        return
+    for name, key in MERGE_KEYS:
+        df = pd.concat(
+            [pd.read_pickle(f'{shard_dir}/{a}/{name}.pkl') for a in done],
+            ignore_index=True,
+        )
+        if key in df.columns:
+            df = df.drop_duplicates(key, keep='last', ignore_index=True)
+        df.to_pickle(f'{output_dir}/{name}.pkl')
+        print(f'{len(df)} {name} of {len(done)} shards merged')
+
+
+def main():
+    short_options = 'd:f:imn:o:st:w'
+    long_options = [
+        'shard-dir=', 'frontier=', 'init', 'merge', 'processes=',
+        'output-dir=', 'status', 'threads=', 'work', 'no-prune',
+    ]
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    frontier_file = FRONTIER_FILE
+    shard_dir = SHARD_DIR
+    output_dir = OUTPUT_DIR
+    num_processes = 1
+    num_threads = NUM_OF_THREADS
+    prune = True
+    modes = []
+    for a, v in args:
+        if a in ('-d', '--shard-dir'):
+            shard_dir = v
+        elif a in ('-f', '--frontier'):
+            frontier_file = v
+        elif a in ('-i', '--init'):
+            modes.append('init')
+        elif a in ('-m', '--merge'):
+            modes.append('merge')
+        elif a in ('-n', '--processes'):
+            num_processes = int(v)
+        elif a in ('-o', '--output-dir'):
+            output_dir = v
+        elif a in ('-s', '--status'):
+            modes.append('status')
+        elif a in ('-t', '--threads'):
+            num_threads = int(v)
+        elif a in ('-w', '--work'):
+            modes.append('work')
+        elif a == '--no-prune':
+            prune = False
+
+    for path in (os.path.dirname(frontier_file), shard_dir, output_dir):
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+    if 'init' in modes:
+        Frontier(frontier_file).add(STATES)
+    if 'work' in modes:
+        host = socket.gethostname()
+        processes = [
+            Process(
+                target=work,
+                args=(
+                    frontier_file, shard_dir, f'{host}-{os.getpid()}-{i}',
+                    prune, num_threads,
+                ),
+            )
+            for i in range(num_processes)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+    if 'status' in modes:
+        for area_id, area_name, status, worker in Frontier(
+            frontier_file
+        ).status():
+            print(f'{area_id}/{area_name}: {status} {worker or ""}')
+    if 'merge' in modes:
+        merge_shards(frontier_file, shard_dir, output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+@author: yuan.shao
+"""
+import csv
+import heapq
+import json
+import os
+from contextlib import ExitStack
+from itertools import islice
+from tempfile import mkstemp
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Tuple
+
+from hierarchy import AreaHierarchy
+from output import (
+    OUTPUT_DIR, OUTPUT_TYPES_MASK, SCORE_THRESHOLD, TYPE_BITS,
+    UNKNOWN_TYPE_BIT, VOTES_THRESHOLD,
+)
+from query import OUTPUT_FIELDS
+from route import Route
+
+GEO_FIELDS = ['name', 'location', 'score', 'votes', 'types', 'grade', 'link']
+KINDS = ['boulder', 'rope']
+# Rows sorted in memory at a time by the external sort of the final outputs.
+RUN_SIZE = 50000
+
+
+def sort_key(row: List[str]) -> Tuple[float, int, str]:
+    """
+    Key of a partial file row, a sequence number followed by OUTPUT_FIELDS,
+    ordering by score and votes, highest first, then by name.
+    """
+    return -float(row[5]), -int(row[6]), row[1]
+
+
+class RouteSink:
+    """
+    Streaming writer of the outputs. Good routes are appended as they are read
+    to boulder_routes.partial.csv, rope_routes.partial.csv and
+    routes.partial.geojsonl in output_dir, which are usable while the crawl
+    runs. close() sorts them into boulder_routes.csv and rope_routes.csv, in
+    the format and order of output.build_outputs, with an external merge sort
+    holding at most run_size rows in memory, and writes the GeoJSON features
+    to routes.geojson. snapshot() writes the same outputs of the routes added
+    so far while more are added.
+
+    A route added again, as the recrawl does, replaces the rows written for
+    it before. Only the link and sequence number of the last rows of every
+    good route are kept in memory to tell which rows are current.
+    """
+    def __init__(
+        self,
+        areas: Dict[str, Dict[str, Any]],
+        hierarchy: AreaHierarchy,
+        output_dir: str = OUTPUT_DIR,
+        score_threshold: float = SCORE_THRESHOLD,
+        votes_threshold: int = VOTES_THRESHOLD,
+        run_size: int = RUN_SIZE,
+    ) -> None:
+        self.coordinates = {
+            a['area_id']: (a['latitude'], a['longitude'])
+            for a in areas.values()
+        }
+        self.hierarchy = hierarchy
+        self.output_dir = output_dir
+        self.score_threshold = score_threshold
+        self.votes_threshold = votes_threshold
+        self.run_size = run_size
+        self.seq = 0
+        self.last = dict()  # link -> sequence number of its current rows
+        self.counts = {kind: 0 for kind in KINDS + ['geo']}  # rows written
+        self.lock = Lock()
+        self.files = {
+            kind: open(self.partial_path(kind), 'w', newline='')
+            for kind in KINDS
+        }
+        self.writers = {
+            kind: csv.writer(f, lineterminator='\n')
+            for kind, f in self.files.items()
+        }
+        for writer in self.writers.values():
+            writer.writerow(['seq', *OUTPUT_FIELDS])
+        self.geo_file = open(self.partial_path('geo'), 'w')
+
+    def partial_path(self, kind: str) -> str:
+        if kind == 'geo':
+            return f'{self.output_dir}/routes.partial.geojsonl'
+        return f'{self.output_dir}/{kind}_routes.partial.csv'
+
+    def kinds(self, route: Route) -> List[str]:
+        """
+        Return the outputs a route goes to, as output.good_routes and
+        output.build_outputs choose them.
+        """
+        if not (
+            route.votes() >= self.votes_threshold
+            and route.avg_score() >= self.score_threshold
+            and route.location_chain
+        ):
+            return []
+        mask = 0
+        for t in route.types:
+            mask += TYPE_BITS.get(t, UNKNOWN_TYPE_BIT)
+        if mask & ~OUTPUT_TYPES_MASK:
+            return []
+        kinds = []
+        if mask & TYPE_BITS['Boulder'] and route.pitches <= 1:
+            kinds.append('boulder')
+        if mask != TYPE_BITS['Boulder']:
+            kinds.append('rope')
+        return kinds
+
+    def output_row(self, route: Route) -> List[Any]:
+        """
+        Return a route in the format of the output CSV files.
+        """
+        latitude, longitude = self.coordinates.get(
+            route.location_chain[-1], ('', ''),
+        )
+        return [
+            route.display_name,
+            self.hierarchy.display_path(route.location_chain),
+            latitude, longitude, route.avg_score(), route.votes(),
+            ' / '.join(route.types), ' / '.join(route.grade),
+            str(route.height) if route.height > 0 else '',
+            str(route.pitches) if route.pitches > 1 else '',
+            ' | '.join(route.keywords), route.link,
+        ]
+
+    @staticmethod
+    def feature(row: List[Any]) -> Dict[str, Any]:
+        """
+        Return the GeoJSON point feature of an output row, located at the
+        coordinates of its area, or without a geometry if they are unknown.
+        """
+        properties = dict(zip(OUTPUT_FIELDS, row))
+        geometry = None
+        if properties['latitude'] and properties['longitude']:
+            geometry = {
+                'type': 'Point',
+                'coordinates': [
+                    float(properties['longitude']),
+                    float(properties['latitude']),
+                ],
+            }
+        return {
+            'type': 'Feature',
+            'geometry': geometry,
+            'properties': {f: properties[f] for f in GEO_FIELDS},
+        }
+
+    def add(self, route: Route) -> None:
+        """
+        Append a route to the outputs it goes to, replacing the rows of the
+        same route added before. Safe to call from many threads.
+        """
+        kinds = self.kinds(route)
+        row = self.output_row(route) if kinds else None
+        with self.lock:
+            link = route.link
+            if row is None:
+                self.last.pop(link, None)
+                return
+            self.seq += 1
+            self.last[link] = self.seq
+            for kind in kinds:
+                self.writers[kind].writerow([self.seq, *row])
+                self.counts[kind] += 1
+            self.geo_file.write(json.dumps(
+                [self.seq, self.feature(row)], ensure_ascii=False,
+            ) + '\n')
+            self.counts['geo'] += 1
+
+    def extend(self, routes: List[Route]) -> None:
+        for route in routes:
+            self.add(route)
+
+    def flush(self) -> None:
+        with self.lock:
+            for f in self.files.values():
+                f.flush()
+            self.geo_file.flush()
+
+    def current_rows(
+        self, kind: str, count: int, last: Dict[str, int],
+    ) -> Iterator[List[str]]:
+        """
+        Yield the rows among the first count of a partial CSV file that are
+        current by last.
+        """
+        with open(self.partial_path(kind), newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in islice(reader, count):
+                if last.get(row[-1]) == int(row[0]):
+                    yield row
+
+    def sorted_runs(
+        self, kind: str, count: int, last: Dict[str, int],
+    ) -> List[str]:
+        """
+        Sort the current rows of a partial CSV file in runs of run_size rows,
+        each written to a temporary file. Return the paths of the runs.
+        """
+        runs = []
+        rows = []
+
+        def write_run():
+            rows.sort(key=sort_key)
+            fd, path = mkstemp(
+                prefix=f'{kind}_run_', suffix='.csv', dir=self.output_dir,
+            )
+            with open(fd, 'w', newline='') as f:
+                csv.writer(f, lineterminator='\n').writerows(rows)
+            runs.append(path)
+            rows.clear()
+
+        for row in self.current_rows(kind, count, last):
+            rows.append(row)
+            if len(rows) >= self.run_size:
+                write_run()
+        if rows or not runs:
+            write_run()
+        return runs
+
+    def write_sorted(
+        self, kind: str, count: int, last: Dict[str, int],
+    ) -> int:
+        """
+        Merge the sorted runs of a partial CSV file into its final output.
+        Return the number of routes written.
+        """
+        path = f'{self.output_dir}/{kind}_routes.csv'
+        runs = self.sorted_runs(kind, count, last)
+        n = 0
+        try:
+            with ExitStack() as stack, open(
+                f'{path}.tmp', 'w', newline='',
+            ) as out:
+                readers = [
+                    csv.reader(stack.enter_context(open(r, newline='')))
+                    for r in runs
+                ]
+                writer = csv.writer(out, lineterminator='\n')
+                writer.writerow(['', *OUTPUT_FIELDS])
+                for row in heapq.merge(*readers, key=sort_key):
+                    writer.writerow([n, *row[1:]])
+                    n += 1
+            os.replace(f'{path}.tmp', path)
+        finally:
+            for r in runs:
+                os.remove(r)
+        return n
+
+    def write_geojson(self, count: int, last: Dict[str, int]) -> int:
+        """
+        Write the current features among the first count to routes.geojson as
+        a feature collection. Return the number of features written.
+        """
+        path = f'{self.output_dir}/routes.geojson'
+        n = 0
+        with open(self.partial_path('geo')) as f, open(
+            f'{path}.tmp', 'w',
+        ) as out:
+            out.write('{"type": "FeatureCollection", "features": [\n')
+            for line in islice(f, count):
+                seq, feature = json.loads(line)
+                if last.get(feature['properties']['link']) != seq:
+                    continue
+                if n:
+                    out.write(',\n')
+                out.write(json.dumps(feature, ensure_ascii=False))
+                n += 1
+            out.write('\n]}\n')
+        os.replace(f'{path}.tmp', path)
+        return n
+
+    def snapshot(self) -> Tuple[int, int]:
+        """
+        Write the outputs of the routes added so far, as close() does, while
+        more routes are added. The rows added meanwhile are left out, so the
+        outputs are consistent. Return the numbers of boulder and rope routes
+        written.
+        """
+        with self.lock:
+            for f in self.files.values():
+                f.flush()
+            self.geo_file.flush()
+            counts = dict(self.counts)
+            last = dict(self.last)
+        return self.write_outputs(counts, last)
+
+    def close(self) -> Tuple[int, int]:
+        """
+        Write the final sorted outputs and GeoJSON layer. Return the numbers
+        of boulder and rope routes written.
+        """
+        for f in self.files.values():
+            f.close()
+        self.geo_file.close()
+        return self.write_outputs(self.counts, self.last)
+
+    def write_outputs(
+        self, counts: Dict[str, int], last: Dict[str, int],
+    ) -> Tuple[int, int]:
+        num_boulders = self.write_sorted('boulder', counts['boulder'], last)
+        num_ropes = self.write_sorted('rope', counts['rope'], last)
+        num_features = self.write_geojson(counts['geo'], last)
+        print(
+            f'Output {num_boulders} boulder routes, {num_ropes} rope routes, '
+            f'{num_features} routes in routes.geojson'
+        )
+        return num_boulders, num_ropes
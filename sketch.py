@@ -0,0 +1,94 @@
+"""
+@author: yuan.shao
+"""
+from typing import Dict, Iterable, List, Tuple
+
+# Items counted by every sketch. A sketch holds up to twice as many before it
+# is pruned back to this size. With too few counters for the distinct keywords
+# of a region-level subtree, the floor grows to the counts of its top keywords
+# and none of them is counted with a useful guarantee.
+SKETCH_SIZE = 128
+
+
+class SpaceSaving:
+    """
+    Heavy hitters of a stream of weighted items in fixed memory, after the
+    Space-Saving algorithm: at most 2 * size counters are kept, and when
+    there are more the smallest are dropped in one batch. floor is the
+    largest count dropped, so an item not counted was seen at most floor
+    times, and an item counted first when the floor was f may be overcounted
+    by f, its error. Every item seen more than total / size times is kept.
+    """
+    __slots__ = ['size', 'counts', 'errors', 'floor']
+
+    def __init__(self, size: int = SKETCH_SIZE) -> None:
+        self.size = size
+        self.counts = dict()  # item -> count, overestimated by its error
+        self.errors = dict()
+        self.floor = 0
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __getstate__(self) -> Tuple[int, Dict[str, int], Dict[str, int], int]:
+        return self.size, self.counts, self.errors, self.floor
+
+    def __setstate__(
+        self, state: Tuple[int, Dict[str, int], Dict[str, int], int],
+    ) -> None:
+        self.size, self.counts, self.errors, self.floor = state
+
+    def add(self, item: str, count: int = 1) -> None:
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        self.counts[item] = self.floor + count
+        self.errors[item] = self.floor
+        if len(self.counts) > 2 * self.size:
+            self.prune()
+
+    def remove(self, item: str, count: int = 1) -> None:
+        """
+        Take back count of an item added before, as far as it is counted.
+        Counts are not lowered below the floor, so removals are approximate.
+        """
+        if item in self.counts:
+            self.counts[item] = max(self.floor, self.counts[item] - count)
+
+    def update(self, keyword_counts: Iterable, sign: int = 1) -> None:
+        """
+        Add, or remove if sign is negative, flattened (item, count) pairs as
+        in Route.keyword_counts.
+        """
+        it = iter(keyword_counts)
+        for item, count in zip(it, it):
+            if sign > 0:
+                self.add(item, count)
+            else:
+                self.remove(item, count)
+
+    def prune(self) -> None:
+        """
+        Keep the size largest counts, raising the floor to the largest count
+        dropped.
+        """
+        items = sorted(self.counts, key=self.counts.get, reverse=True)
+        for item in items[self.size:]:
+            self.floor = max(self.floor, self.counts.pop(item))
+            del self.errors[item]
+
+    def top(self, n: int = None) -> List[Tuple[str, int, int]]:
+        """
+        Return up to n items with the largest guaranteed counts, their counts
+        minus their errors, with their counts and errors, largest first. The
+        true count of an item is between its guaranteed count and its count.
+        Only items whose guaranteed count exceeds the floor are returned, as
+        any other item, counted or not, may have been seen as often.
+        """
+        guaranteed = {x: c - self.errors[x] for x, c in self.counts.items()}
+        items = [x for x, g in guaranteed.items() if g > self.floor]
+        items.sort(key=lambda x: (-guaranteed[x], -self.counts[x], x))
+        return [
+            (item, self.counts[item], self.errors[item])
+            for item in items[:n or self.size]
+        ]
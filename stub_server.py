@@ -0,0 +1,179 @@
+"""
+@author: yuan.shao
+"""
+import getopt
+import random
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, Optional, Tuple
+
+from fixtures import Corpus
+
+HOST = '127.0.0.1'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, as the pooled sessions of web.py expect.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        server = self.server
+        delay, fail = server.draw()
+        if delay > 0:
+            sleep(delay)
+        if fail:
+            # Drop the connection without a response, which requests raises
+            # as a ConnectionError.
+            server.count('errors')
+            self.close_connection = True
+            return
+        page = server.page(self.path)
+        if page is None:
+            server.count('not_found')
+            self.send_error(404)
+            return
+        server.count('pages')
+        server.count('bytes', len(page))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Local HTTP server serving the pages of a fixture corpus in place of
+    Mountain Project, to be pointed at with the MP_WEBSITE environment
+    variable. Every request waits latency seconds plus up to jitter seconds,
+    and a share error_rate of the requests fail with a dropped connection.
+    """
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(
+        self,
+        corpus: Corpus,
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__((HOST, port), StubHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.pages = dict()  # path -> page, rendered on first request
+        self.counts = {'pages': 0, 'bytes': 0, 'errors': 0, 'not_found': 0}
+        self.lock = Lock()
+        self.thread = None
+
+    @property
+    def website(self) -> str:
+        return f'http://{HOST}:{self.server_address[1]}'
+
+    def draw(self) -> Tuple[float, bool]:
+        """
+        Return the delay of a request and whether it fails.
+        """
+        with self.lock:
+            return (
+                self.latency + self.rng.uniform(0, self.jitter),
+                self.rng.random() < self.error_rate,
+            )
+
+    def page(self, path: str) -> Optional[bytes]:
+        page = self.pages.get(path)
+        if page is None:
+            page = self.corpus.page(path, self.website)
+            self.pages[path] = page
+        return page
+
+    def preload(self) -> None:
+        """
+        Render every page of the corpus up front, so the server does not slow
+        down the first reads of the pages.
+        """
+        for paths in self.corpus.paths().values():
+            for path in paths:
+                self.page(path)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counts[name] += n
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+    def start(self) -> None:
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def __enter__(self) -> 'StubServer':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def main():
+    short_options = 'e:j:l:n:p:'
+    long_options = [
+        'error-rate=', 'jitter=', 'latency=', 'num-routes=', 'port=',
+    ]
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    num_routes = 2000
+    port = 8000
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    for a, v in args:
+        if a in ('-e', '--error-rate'):
+            error_rate = float(v)
+        elif a in ('-j', '--jitter'):
+            jitter = float(v)
+        elif a in ('-l', '--latency'):
+            latency = float(v)
+        elif a in ('-n', '--num-routes'):
+            num_routes = int(v)
+        elif a in ('-p', '--port'):
+            port = int(v)
+
+    server = StubServer(
+        Corpus(num_routes), port, latency, jitter, error_rate,
+    )
+    server.preload()
+    print(
+        f'Serving {num_routes} routes at {server.website}, e.g.\n'
+        f'MP_WEBSITE={server.website} python update.py'
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(server.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+@author: yuan.shao
+"""
+import random
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+from route import Route
+
+AREA_FANOUT = 8
+ROUTES_PER_LEAF = 25
+
+
+def make_areas_and_routes(
+    num_routes: int,
+    fanout: int = AREA_FANOUT,
+    routes_per_leaf: int = ROUTES_PER_LEAF,
+    seed: int = 0,
+) -> Tuple[
+    Dict[str, Dict[str, Union[str, List[str]]]],
+    List[Dict[str, Union[str, List[str]]]],
+]:
+    """
+    Build a synthetic area tree shaped like the one read by read_an_area, with
+    num_routes routes spread over its leaf areas. Return the areas dict keyed
+    by area id and the list of route maps, in the same formats as update.py.
+    """
+    rng = random.Random(seed)
+    num_leaves = max(1, -(-num_routes // routes_per_leaf))
+    areas = dict()
+    routes = []
+    next_id = [100000000]
+
+    def new_id() -> str:
+        next_id[0] += 1
+        return str(next_id[0])
+
+    def add_area(location_chain: List[str]) -> None:
+        area_id = location_chain[-1]
+        lat = f'{rng.uniform(25.0, 49.0):.4f}'
+        lon = f'{rng.uniform(-124.0, -67.0):.4f}'
+        areas[area_id] = {
+            'area_id': area_id,
+            'area_name': f'area-{area_id}',
+            'display_name': f'Area {area_id}',
+            'latitude': lat,
+            'longitude': lon,
+            'location_chain': location_chain,
+        }
+
+    level = []
+    for _ in range(fanout):
+        chain = [new_id()]
+        add_area(chain)
+        level.append(chain)
+    while len(level) < num_leaves:
+        next_level = []
+        for chain in level:
+            for _ in range(fanout):
+                child = chain + [new_id()]
+                add_area(child)
+                next_level.append(child)
+        level = next_level
+    for i in range(num_routes):
+        chain = level[i % len(level)]
+        route_id = str(200000000 + i)
+        routes.append({
+            'route_id': route_id,
+            'route_name': f'route-{route_id}',
+            'location_chain': chain,
+        })
+    return areas, routes
+
+
+def make_routes(
+    routes: List[Dict[str, Union[str, List[str]]]],
+    areas: Dict[str, Dict[str, Union[str, List[str]]]],
+    num_comments: int = 0,
+    seed: int = 0,
+) -> Iterator[Route]:
+    """
+    Yield synthetic Route objects for the given route maps, each with
+    num_comments raw comments of a few hundred characters.
+    """
+    rng = random.Random(seed)
+    grades = ['5.7', '5.8', '5.9', '5.10a', '5.10b/c', '5.11a', 'V2', 'V4-5']
+    types = sorted(Route.TYPES)
+    words = [
+        'crack', 'hand crack', 'finger crack', 'roof', 'slab', 'arete',
+        'chimney', 'dihedral', 'crimp', 'jug', 'pocket', 'sloper', 'runout',
+    ]
+    for r in routes:
+        scores = {s: rng.randint(0, 8) for s in range(5)}
+        keywords = rng.sample(words, 5)
+        comments = [
+            ' '.join(rng.choice(words) for _ in range(40)) + f' #{i}'
+            for i in range(num_comments)
+        ]
+        yield Route(
+            r['route_id'], r['route_name'], f"Route {r['route_id']}",
+            r['location_chain'],
+            [
+                areas.get(a, dict()).get('area_name', '')
+                for a in r['location_chain']
+            ],
+            [rng.choice(grades)], sorted(rng.sample(types, rng.randint(1, 2))),
+            rng.randint(0, 300), rng.randint(1, 6), '', scores, comments,
+            comments[:1], keywords,
+            [x for k in keywords for x in (k, rng.randint(2, 9))],
+        )
+
+
+def make_route_details(
+    routes: List[Dict[str, Union[str, List[str]]]],
+    areas: Dict[str, Dict[str, Union[str, List[str]]]],
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Build synthetic route details in the Route.to_map() format for the given
+    route maps.
+    """
+    return [r.to_map() for r in make_routes(routes, areas, seed=seed)]
@@ -0,0 +1,8 @@
+"""
+@author: yuan.shao
+"""
+import os
+import sys
+
+# The modules live at the top of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+"""
+@author: yuan.shao
+"""
+from area import AreaTree, parse_area_page
+from utils import MP_WEBSITE
+
+
+def area_page(routes=(), areas=()):
+    links = [f'<a href="{MP_WEBSITE}/route/{i}/{n}">' for i, n in routes]
+    links += [f'<a href="{MP_WEBSITE}/area/{i}/{n}">' for i, n in areas]
+    return (
+        '<h1>\\nSome Crag\\n</h1> maps?q=40.5,-105.25 Show all routes'
+        + ''.join(links) + 'Show All Routes'
+    )
+
+
+def test_parse_area_page():
+    name, lat, lon, rts, ars = parse_area_page(
+        area_page(routes=[(200000001, 'a-route')]),
+    )
+    assert (name, lat, lon) == ('Some Crag', '40.5', '-105.25')
+    assert rts == [(200000001, 'a-route')] and ars == []
+    _, _, _, rts, ars = parse_area_page(area_page(areas=[(105, 'sub')]))
+    assert rts == [] and ars == [(105, 'sub')]
+
+
+def test_tree_builds_the_area_and_route_maps():
+    tree = AreaTree()
+    root = tree.add_task(('1', 'state', ['1']))
+    (crag,) = tree.set_page(root, ('State', '', '', [], [(2, 'crag')]))
+    assert tree.task(crag) == ('2', 'crag', ['1', '2'])
+    assert tree.set_page(
+        crag, ('Crag', '40.5', '-105.25', [(10, 'a'), (11, 'b')], []),
+    ) == []
+    areas = tree.areas()
+    assert areas['2'] == {
+        'area_id': '2', 'area_name': 'crag', 'display_name': 'Crag',
+        'latitude': '40.5', 'longitude': '-105.25',
+        'location_chain': ['1', '2'],
+    }
+    assert areas['1']['location_chain'] == ['1']
+    routes = tree.routes()
+    assert [(r['route_id'], r['route_name']) for r in routes] == [
+        ('10', 'a'), ('11', 'b'),
+    ]
+    # The routes of an area share one location chain.
+    assert routes[0]['location_chain'] is routes[1]['location_chain']
+
+
+def test_tree_reads_an_area_once():
+    tree = AreaTree()
+    a = tree.add_task(('5', 'crag', ['1', '5']))
+    b = tree.add_task(('5', 'crag', ['1', '5']))
+    assert tree.set_page(a, ('Crag', '', '', [(10, 'a')], [])) == []
+    assert tree.set_page(b, ('Crag', '', '', [(10, 'a')], [])) is None
+    assert 5 in tree.read
+    assert list(tree.areas()) == ['5']
+    assert len(tree.routes()) == 1
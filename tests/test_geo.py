@@ -0,0 +1,76 @@
+"""
+@author: yuan.shao
+"""
+import random
+
+from geo import GeoIndex, haversine_km, KDTree
+
+
+def random_points(n, seed=0):
+    rng = random.Random(seed)
+    return [(rng.uniform(25, 49), rng.uniform(-125, -67)) for _ in range(n)]
+
+
+def test_kdtree_in_bbox_matches_brute_force():
+    points = random_points(2000)
+    tree = KDTree(points)
+    rng = random.Random(1)
+    for _ in range(50):
+        south, north = sorted(rng.uniform(25, 49) for _ in range(2))
+        west, east = sorted(rng.uniform(-125, -67) for _ in range(2))
+        expected = {
+            i for i, (lat, lon) in enumerate(points)
+            if south <= lat <= north and west <= lon <= east
+        }
+        assert set(tree.in_bbox((south, west, north, east))) == expected
+
+
+def test_kdtree_handles_duplicates_and_tiny_inputs():
+    assert KDTree([]).in_bbox((0, 0, 1, 1)) == []
+    points = [(1.0, 1.0)] * 5 + [(2.0, 2.0)]
+    tree = KDTree(points)
+    assert sorted(tree.in_bbox((1, 1, 1, 1))) == [0, 1, 2, 3, 4]
+
+
+def test_areas_within_matches_brute_force():
+    points = random_points(1500, seed=2)
+    areas = [
+        {'area_id': str(i), 'latitude': lat, 'longitude': lon}
+        for i, (lat, lon) in enumerate(points)
+    ]
+    areas.append({'area_id': 'x', 'latitude': None, 'longitude': None})
+    index = GeoIndex(areas)
+    rng = random.Random(3)
+    for _ in range(30):
+        lat, lon = rng.uniform(25, 49), rng.uniform(-125, -67)
+        km = rng.choice([5, 50, 200, 800])
+        expected = {
+            str(i) for i, (a, b) in enumerate(points)
+            if haversine_km(lat, lon, a, b) <= km
+        }
+        found = dict(index.areas_within(lat, lon, km))
+        assert set(found) == expected
+        for a, d in found.items():
+            assert d <= km
+
+
+def test_areas_within_across_antimeridian():
+    rng = random.Random(4)
+    points = [
+        (rng.uniform(50, 56), rng.choice([-1, 1]) * rng.uniform(170, 180))
+        for _ in range(1000)
+    ]
+    index = GeoIndex([
+        {'area_id': str(i), 'latitude': lat, 'longitude': lon}
+        for i, (lat, lon) in enumerate(points)
+    ])
+    for lat, lon, km in [
+        (52, 179.5, 100), (52, -179.5, 100), (53, 180, 300), (51, -175, 800),
+    ]:
+        expected = {
+            str(i) for i, (a, b) in enumerate(points)
+            if haversine_km(lat, lon, a, b) <= km
+        }
+        found = dict(index.areas_within(lat, lon, km))
+        assert set(found) == expected
+        assert any(points[int(a)][1] * lon < 0 for a in found)
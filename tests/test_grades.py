@@ -0,0 +1,72 @@
+"""
+@author: yuan.shao
+"""
+import pytest
+
+from grades import (
+    AID, GRADE_COLUMNS, ICE, MISSING, MIXED, parse_grade, parse_grade_range,
+    grade_keys, STEPS, V_SCALE, YDS,
+)
+
+
+@pytest.mark.parametrize('grade, expected', [
+    ('5.9', (YDS, 36, 39)),
+    ('5.9-', (YDS, 36, 37)),
+    ('5.9+', (YDS, 38, 39)),
+    ('5.10a', (YDS, 40, 40)),
+    ('5.10b/c', (YDS, 41, 42)),
+    ('5.9+ PG13', (YDS, 38, 39)),
+    ('VB', (V_SCALE, 0, 3)),
+    ('V0', (V_SCALE, 4, 7)),
+    ('V4+', (V_SCALE, 22, 23)),
+    ('V4-5', (V_SCALE, 20, 27)),
+    ('WI4', (ICE, 16, 19)),
+    ('WI4+', (ICE, 18, 19)),
+    ('WI4-5', (ICE, 16, 23)),
+    ('AI2-3', (ICE, 8, 15)),
+    ('M5', (MIXED, 20, 23)),
+    ('M5-6', (MIXED, 20, 27)),
+    ('M10-11', (MIXED, 40, 47)),
+    ('A2', (AID, 8, 11)),
+    ('C1-2', (AID, 4, 11)),
+    ('Easy Snow', None),
+    ('', None),
+])
+def test_parse_grade(grade, expected):
+    assert parse_grade(grade) == expected
+
+
+def test_minus_sign_is_not_a_range():
+    assert parse_grade('WI4-') == (ICE, 16, 17)
+    assert parse_grade('M5-') == (MIXED, 20, 21)
+
+
+def test_grade_keys_merges_scales():
+    keys = dict(zip(GRADE_COLUMNS, grade_keys(['5.9 A1', 'WI4-5 M5'])))
+    assert (keys['yds_low'], keys['yds_high']) == (36, 39)
+    assert (keys['aid_low'], keys['aid_high']) == (4, 7)
+    assert (keys['ice_low'], keys['ice_high']) == (16, 23)
+    assert (keys['mixed_low'], keys['mixed_high']) == (20, 23)
+    assert (keys['v_low'], keys['v_high']) == (MISSING, MISSING)
+
+
+def test_grade_keys_widens_one_scale():
+    keys = dict(zip(GRADE_COLUMNS, grade_keys(['5.10a', '5.11c'])))
+    assert (keys['yds_low'], keys['yds_high']) == (40, 46)
+
+
+@pytest.mark.parametrize('s, expected', [
+    ('5.9..5.10c', (YDS, 36, 42)),
+    ('5.9-5.10c', (YDS, 36, 42)),
+    ('5.9–5.10c', (YDS, 36, 42)),
+    ('5.10..', (YDS, 40, 10 ** 6)),
+    ('..V3', (V_SCALE, -1, 4 * STEPS + STEPS - 1)),
+    ('WI3-4', (ICE, 12, 19)),
+    ('M5-6', (MIXED, 20, 27)),
+    ('WI3..WI5', (ICE, 12, 23)),
+    ('5.9..V3', None),
+    ('5.9-x', None),
+    ('nothing', None),
+])
+def test_parse_grade_range(s, expected):
+    assert parse_grade_range(s) == expected
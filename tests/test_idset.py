@@ -0,0 +1,50 @@
+"""
+@author: yuan.shao
+"""
+import pickle
+import random
+
+import idset
+from idset import IdSet
+
+
+def test_membership_across_flushes(monkeypatch):
+    monkeypatch.setattr(idset, 'MERGE_SIZE', 16)
+    rng = random.Random(0)
+    s = IdSet()
+    expected = set()
+    for _ in range(5000):
+        x = rng.randrange(10 ** 9)
+        s.add(str(x) if rng.random() < 0.5 else x)
+        expected.add(x)
+    # Some ids are still pending, the others merged.
+    assert s.pending
+    for x in expected:
+        assert x in s
+        assert str(x) in s
+    for _ in range(1000):
+        x = rng.randrange(10 ** 9)
+        assert (x in s) == (x in expected)
+    assert len(s) == len(expected)
+    assert list(s) == sorted(expected)
+
+
+def test_duplicates_are_kept_once():
+    s = IdSet(['3', 1, '2', 3, 1])
+    s.update([2, '4', '1'])
+    assert list(s) == [1, 2, 3, 4]
+
+
+def test_not_an_id():
+    s = IdSet([1])
+    assert 'x' not in s
+    assert None not in s
+    assert '' not in s
+
+
+def test_pickle():
+    s = IdSet(range(0, 100, 3))
+    s.add(1000)
+    copy = pickle.loads(pickle.dumps(s))
+    assert list(copy) == list(s)
+    assert 1000 in copy and 1 not in copy
@@ -0,0 +1,124 @@
+"""
+@author: yuan.shao
+"""
+import route
+from grades import GRADE_COLUMNS, parse_grade_range
+from route import (
+    INTERNED_TUPLES, LazyRoute, read_batch, Route, route_filter,
+)
+from utils import MP_WEBSITE
+
+
+def make_route(grade=('5.9',), scores=(0, 0, 1, 2, 0)):
+    return Route(
+        '100', 'a-route', 'A Route', ['1', '2'], ['Area', 'Crag'],
+        list(grade), ['Sport'], 30, 1, '', dict(enumerate(scores)), [], [],
+        ['crimps'], ['crimps', 2],
+    )
+
+
+def test_from_map_uses_stored_grade_keys():
+    m = make_route(['WI4-5']).to_map()
+    m['ice_low'], m['ice_high'] = 1, 2
+    assert Route.from_map(m).to_map()['ice_high'] == 2
+
+
+def test_from_map_parses_missing_grade_keys():
+    r = make_route(['WI4-5'])
+    m = r.to_map()
+    for c in GRADE_COLUMNS:
+        del m[c]
+    assert list(Route.from_map(m).grade_keys) == list(r.grade_keys)
+    m = r.to_map()
+    m['ice_low'] = float('nan')
+    assert list(Route.from_map(m).grade_keys) == list(r.grade_keys)
+
+
+def test_qualifies():
+    r = make_route(scores=(0, 0, 1, 2, 0))  # 3 votes, average 2.67
+    assert r.qualifies(2.5, 3)
+    assert not r.qualifies(2.7, 3)
+    assert not r.qualifies(2.5, 4)
+
+
+def test_qualifies_with_a_threshold_of_none():
+    r = make_route(scores=(0, 0, 1, 2, 0))
+    assert r.qualifies(2.5, None)
+    assert not r.qualifies(2.7, None)
+    assert r.qualifies(None, 3)
+    assert not r.qualifies(None, 4)
+    assert r.qualifies(None, None)
+    assert not make_route(scores=(0,) * 5).qualifies(0, None)
+
+
+def test_only_shared_values_are_interned():
+    a, b = make_route(), make_route()
+    assert a.location_chain is b.location_chain
+    assert a.grade is b.grade
+    size = len(INTERNED_TUPLES)
+    r = Route(
+        '101', 'b-route', 'B Route', ['1', '2'], ['Area', 'Crag'], ['5.9'],
+        ['Sport'], 30, 1, '', dict(enumerate((0,) * 5)), [], [],
+        ['slopers'], ['slopers', 1],
+    )
+    assert r.keywords == ('slopers',)
+    assert len(INTERNED_TUPLES) == size
+
+
+class FakeAnalyzer:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_keywords(self, texts, print_details=False):
+        self.calls += 1
+        return ['crimps'], {'crimps': len(texts)}
+
+
+def fake_web(monkeypatch, scores):
+    """
+    Serve every route with the star ratings in scores by route id, and record
+    the routes whose comments are read.
+    """
+    comments_read = []
+    monkeypatch.setattr(route, 'fetch', lambda url, kind: url)
+    monkeypatch.setattr(Route, 'parse_stats_page', staticmethod(
+        lambda url: dict(enumerate(scores[url.split('/')[-2]])),
+    ))
+    monkeypatch.setattr(Route, 'read_comments', classmethod(
+        lambda cls, route_id: comments_read.append(route_id) or ['Crimps.'],
+    ))
+    return comments_read
+
+
+def test_lazy_route_reads_text_on_first_access(monkeypatch):
+    comments_read = fake_web(monkeypatch, {'1': (0, 0, 0, 4, 4)})
+    analyzer = FakeAnalyzer()
+    r = LazyRoute.read_from_web('1', 'a-route', text_analyzer=analyzer)
+    assert r.votes() == 8 and comments_read == []
+    assert r.keywords == ('crimps',)
+    assert r.keyword_counts == ('crimps', 1)
+    assert r.comments == ['Crimps.']
+    assert r.to_map()['num_comments'] == 1
+    assert comments_read == ['1'] and analyzer.calls == 1
+
+
+def test_read_batch_reads_text_of_selected_routes_only(monkeypatch):
+    scores = {
+        '1': (0, 0, 0, 4, 4), '2': (5, 0, 0, 0, 0), '3': (0, 0, 1, 1, 1),
+    }
+    comments_read = fake_web(monkeypatch, scores)
+    links = [f'{MP_WEBSITE}/route/{i}/route-{i}' for i in scores]
+    select = route_filter(2.5, 3)
+    maps = list(read_batch(links, FakeAnalyzer(), 2, True, select))
+    assert [m['id'] for m in maps] == ['1', '3']
+    assert all(m['keywords'] == ['crimps'] for m in maps)
+    assert sorted(comments_read) == ['1', '3']
+    assert len(list(read_batch(links, FakeAnalyzer(), 2, True))) == 3
+
+
+def test_route_filter_by_grade():
+    assert route_filter() is None
+    select = route_filter(grade_range=parse_grade_range('5.9..5.10b'))
+    assert select(make_route(['5.10a']))
+    assert not select(make_route(['5.11a']))
+    assert not select(make_route(['V4']))
@@ -0,0 +1,150 @@
+"""
+@author: yuan.shao
+"""
+import csv
+import json
+import threading
+
+import pandas as pd
+
+from hierarchy import AreaHierarchy
+from loader import df_from_routes
+from output import build_outputs
+from sink import GEO_FIELDS, RouteSink
+from synthetic import make_areas_and_routes, make_routes
+
+SCORE = 2.0
+VOTES = 10
+
+
+def corpus(num_routes=120, seed=0):
+    areas, route_maps = make_areas_and_routes(
+        num_routes, fanout=3, routes_per_leaf=4, seed=seed,
+    )
+    # A route under an area without coordinates.
+    first = next(iter(areas.values()))
+    first['latitude'] = first['longitude'] = None
+    return areas, list(make_routes(route_maps, areas, seed=seed))
+
+
+def expected_outputs(areas, routes, path):
+    """
+    Write the outputs of the routes with output.build_outputs to path and
+    return the contents of the two CSV files.
+    """
+    path.mkdir()
+    build_outputs(
+        pd.DataFrame(list(areas.values())), df_from_routes(routes),
+        output_dir=str(path), score_threshold=SCORE, votes_threshold=VOTES,
+        hierarchy=AreaHierarchy.from_areas(areas.values()),
+    )
+    return read_csvs(path)
+
+
+def read_csvs(path):
+    return [
+        (path / f'{kind}_routes.csv').read_text()
+        for kind in ('boulder', 'rope')
+    ]
+
+
+def check_geojson(path):
+    """
+    Check that routes.geojson has one feature for every route of the CSV
+    files, with the same properties.
+    """
+    with open(path / 'routes.geojson') as f:
+        features = json.load(f)['features']
+    rows = dict()
+    for kind in ('boulder', 'rope'):
+        with open(path / f'{kind}_routes.csv', newline='') as f:
+            for row in csv.DictReader(f):
+                rows[row['link']] = row
+    assert len(features) == len(rows)
+    for feature in features:
+        properties = feature['properties']
+        row = rows[properties['link']]
+        for field in GEO_FIELDS:
+            assert str(properties[field]) == row[field]
+        if row['latitude']:
+            assert feature['geometry']['coordinates'] == [
+                float(row['longitude']), float(row['latitude']),
+            ]
+        else:
+            assert feature['geometry'] is None
+
+
+def new_sink(areas, path, run_size=2):
+    path.mkdir()
+    return RouteSink(
+        areas, AreaHierarchy.from_areas(areas.values()), str(path),
+        score_threshold=SCORE, votes_threshold=VOTES, run_size=run_size,
+    )
+
+
+def test_outputs_match_build_outputs(tmp_path):
+    areas, routes = corpus()
+    expected = expected_outputs(areas, routes, tmp_path / 'expected')
+    sink = new_sink(areas, tmp_path / 'sink')
+    sink.extend(routes)
+    num_boulders, num_ropes = sink.close()
+    assert num_boulders > 2 and num_ropes > 2
+    assert read_csvs(tmp_path / 'sink') == expected
+    check_geojson(tmp_path / 'sink')
+
+
+def test_routes_added_again_replace_their_rows(tmp_path):
+    areas, routes = corpus()
+    _, again = corpus()
+    sink = new_sink(areas, tmp_path / 'sink')
+    sink.extend(routes)
+    good = [r for r in again if sink.kinds(r)]
+    # Some routes drop below the thresholds and others change their score.
+    for r in good[:5]:
+        r.scores[0] += 100
+    for r in good[5:10]:
+        r.scores[4] += 3
+    changed = good[:10] + [r for r in again if not sink.kinds(r)][:5]
+    sink.extend(changed)
+    sink.close()
+    ids = {r.id for r in changed}
+    final = [r for r in routes if r.id not in ids] + changed
+    expected = expected_outputs(areas, final, tmp_path / 'expected')
+    assert read_csvs(tmp_path / 'sink') == expected
+    check_geojson(tmp_path / 'sink')
+    links = {r.link for r in good[:5]}
+    assert not any(link in expected[0] + expected[1] for link in links)
+
+
+def test_run_sizes_give_the_same_outputs(tmp_path):
+    areas, routes = corpus()
+    outputs = []
+    for run_size in (1, 2, 7, 1000):
+        path = tmp_path / str(run_size)
+        sink = new_sink(areas, path, run_size)
+        sink.extend(routes)
+        sink.close()
+        outputs.append(read_csvs(path))
+    assert all(o == outputs[0] for o in outputs)
+
+
+def test_snapshot_while_routes_are_added(tmp_path):
+    areas, routes = corpus(30)
+    prefixes = {
+        tuple(expected_outputs(areas, routes[:k], tmp_path / f'e{k}')): k
+        for k in range(len(routes) + 1)
+    }
+    sink = new_sink(areas, tmp_path / 'sink')
+    adder = threading.Thread(target=sink.extend, args=(routes,))
+    adder.start()
+    seen = []
+    while adder.is_alive() or not seen:
+        sink.snapshot()
+        # Every snapshot holds exactly the routes added before it started.
+        seen.append(prefixes[tuple(read_csvs(tmp_path / 'sink'))])
+        check_geojson(tmp_path / 'sink')
+    adder.join()
+    assert seen == sorted(seen)
+    sink.snapshot()
+    assert prefixes[tuple(read_csvs(tmp_path / 'sink'))] == len(routes)
+    sink.close()
@@ -0,0 +1,87 @@
+"""
+@author: yuan.shao
+"""
+import pickle
+import random
+from collections import Counter
+
+from hierarchy import AreaHierarchy
+from sketch import SpaceSaving
+
+
+def zipf_stream(n, num_items, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(num_items)]
+    items = [f'k{i}' for i in range(num_items)]
+    return [
+        (item, rng.randint(1, 5))
+        for item in rng.choices(items, weights, k=n)
+    ]
+
+
+def sketch_of(stream, size):
+    sketch = SpaceSaving(size)
+    truth = Counter()
+    for item, count in stream:
+        sketch.add(item, count)
+        truth[item] += count
+    return sketch, truth
+
+
+def test_error_bounds():
+    stream = zipf_stream(20000, 2000)
+    sketch, truth = sketch_of(stream, 32)
+    total = sum(truth.values())
+    assert sketch.floor > 0
+    assert len(sketch) <= 2 * 32
+    for item, true in truth.items():
+        if item in sketch.counts:
+            count, error = sketch.counts[item], sketch.errors[item]
+            assert count - error <= true <= count
+        else:
+            assert true <= sketch.floor
+        if true > total / 32:
+            assert item in sketch.counts
+
+
+def test_top_is_guaranteed():
+    sketch, truth = sketch_of(zipf_stream(20000, 2000, seed=1), 32)
+    top = sketch.top()
+    assert top
+    guaranteed = [count - error for _, count, error in top]
+    assert guaranteed == sorted(guaranteed, reverse=True)
+    for item, count, error in top:
+        assert count - error > sketch.floor
+        # Nothing left out of the sketch outranks a reported item.
+        assert all(
+            truth[x] <= count - error for x in truth if x not in sketch.counts
+        )
+
+
+def test_exact_without_pruning():
+    sketch, truth = sketch_of(zipf_stream(500, 20), 32)
+    assert sketch.floor == 0
+    assert {x: c for x, c, _ in sketch.top(20)} == dict(truth)
+    item = sketch.top(1)[0][0]
+    sketch.remove(item, truth[item])
+    assert item not in [x for x, _, _ in sketch.top(20)]
+
+
+def test_update_flattened_pairs_and_pickle():
+    sketch = SpaceSaving(4)
+    sketch.update(['crimps', 3, 'jugs', 2])
+    sketch.update(['crimps', 1], sign=-1)
+    copy = pickle.loads(pickle.dumps(sketch))
+    assert copy.top() == [('crimps', 2, 0), ('jugs', 2, 0)]
+
+
+def test_hierarchy_top_keywords():
+    h = AreaHierarchy()
+    h.add_area(['1'], 'state', 'State')
+    h.add_area(['1', '2'], 'crag', 'Crag')
+    h.add_route(['1', '2'], [0, 0, 1, 0, 0], ['Sport'], ['crimps', 3])
+    h.add_route(
+        ['1', '2'], [0, 0, 0, 1, 0], ['Trad'], ['crimps', 1, 'jugs', 2],
+    )
+    assert h.top_keywords('1') == [('crimps', 4), ('jugs', 2)]
+    assert h.rollup('2')['keywords'] == ['crimps', 'jugs']
@@ -0,0 +1,175 @@
+"""
+@author: yuan.shao
+"""
+import math
+import random
+
+import pytest
+
+from text_index import (
+    BM25_B, BM25_K1, decode_varints, encode_varint, GAP, parse_query,
+    TextIndex, TextIndexWriter, tokenize,
+)
+
+
+def encode(values):
+    out = bytearray()
+    for n in values:
+        encode_varint(n, out)
+    return bytes(out)
+
+
+def test_varint_round_trip():
+    rng = random.Random(0)
+    values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32, 2 ** 62]
+    values += [rng.getrandbits(rng.randint(1, 56)) for _ in range(5000)]
+    assert decode_varints(encode(values)).tolist() == values
+
+
+def test_varint_single_byte_values():
+    values = list(range(128))
+    data = encode(values)
+    assert len(data) == 128
+    assert decode_varints(data).tolist() == values
+
+
+def test_varint_lengths():
+    assert len(encode([127])) == 1
+    assert len(encode([128])) == 2
+    assert len(encode([2 ** 14])) == 3
+
+
+def test_varint_empty():
+    assert decode_varints(b'').tolist() == []
+
+
+def test_tokenize():
+    assert tokenize("Don't miss the 5.10a crux!") == [
+        "don't", 'miss', 'the', '5', '10a', 'crux',
+    ]
+
+
+DOCS = [
+    ('r1', ['1', '2'], ['Great crimps on the arete.', 'Bolted crux.'],
+     ['crimpy arete']),
+    ('r2', ['1', '2'], ['Crimps crimps crimps, then a big jug.'], []),
+    ('r3', ['1', '3'], ['A splitter hand crack.', 'Crack climbing at best.'],
+     ['hand crack']),
+    ('r4', ['1', '3'], ['Hand jams, then a thin crack.'], ['crack']),
+    ('r5', ['4'], ['Great crack'], []),
+]
+
+
+def build(path, docs=DOCS):
+    writer = TextIndexWriter()
+    for route_id, chain, texts, keywords in docs:
+        writer.add(route_id, chain, texts, keywords)
+    writer.write(str(path))
+    return TextIndex(str(path))
+
+
+def bm25(docs, units):
+    """
+    Reference BM25 of the docs over the word and phrase units of a query.
+    """
+    tokens = []
+    for _, _, texts, keywords in docs:
+        doc = []
+        for text in texts + keywords:
+            doc += tokenize(text) + [None] * GAP
+        tokens.append(doc)
+    avg = sum(map(len, tokens)) / len(tokens)
+
+    def count(doc, unit):
+        return sum(
+            doc[i:i + len(unit)] == unit for i in range(len(doc))
+        )
+
+    scores = [0.0] * len(docs)
+    for unit in units:
+        tfs = [count(doc, unit) for doc in tokens]
+        df = sum(tf > 0 for tf in tfs)
+        if df == 0:
+            continue
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for i, (tf, doc) in enumerate(zip(tfs, tokens)):
+            norm = 1 - BM25_B + BM25_B * len(doc) / avg
+            scores[i] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+    return scores
+
+
+def test_search_matches_reference_bm25(tmp_path):
+    index = build(tmp_path / 'index.bin')
+    for query in ['crimps', 'crack', 'great crack', '"hand crack" jug']:
+        scores = bm25(DOCS, parse_query(query))
+        expected = sorted(
+            ((DOCS[i][0], s) for i, s in enumerate(scores) if s > 0),
+            key=lambda x: -x[1],
+        )
+        found = index.search(query)
+        assert [r for r, _ in found] == [r for r, _ in expected]
+        for (_, a), (_, b) in zip(found, expected):
+            assert a == pytest.approx(b)
+    index.close()
+
+
+def test_search_ranks_by_term_frequency(tmp_path):
+    index = build(tmp_path / 'index.bin')
+    assert [r for r, _ in index.search('crimps')] == ['r2', 'r1']
+    assert index.search('crimps', top_k=1)[0][0] == 'r2'
+    assert index.search('offwidth') == []
+    index.close()
+
+
+def test_phrase_hits(tmp_path):
+    index = build(tmp_path / 'index.bin')
+    docs, counts = index.phrase_freqs(['hand', 'crack'])
+    assert [index.route_ids[d] for d in docs] == ['r3']
+    assert counts.tolist() == [2]
+    assert [r for r, _ in index.search('"hand crack"')] == ['r3']
+    # Words of separate paragraphs or keyword phrases never form a phrase.
+    assert index.search('"arete bolted"') == []
+    assert index.search('"crux crimpy"') == []
+    assert [r for r, _ in index.search('"great crack"')] == ['r5']
+    index.close()
+
+
+def test_search_within_areas(tmp_path):
+    index = build(tmp_path / 'index.bin')
+    assert {r for r, _ in index.search('crack', area_ids={'3'})} == {
+        'r3', 'r4',
+    }
+    assert {r for r, _ in index.search('crack', area_ids={'1'})} == {
+        'r3', 'r4',
+    }
+    assert {r for r, _ in index.search('great', area_ids={'2', '4'})} == {
+        'r1', 'r5',
+    }
+    assert index.search('crack', area_ids={'9'}) == []
+    index.close()
+
+
+def test_write_load_round_trip(tmp_path):
+    whole = build(tmp_path / 'whole.bin')
+    first = build(tmp_path / 'first.bin', DOCS[:2])
+    first.close()
+    writer = TextIndexWriter.load(str(tmp_path / 'first.bin'))
+    assert len(writer) == 2
+    for route_id, chain, texts, keywords in DOCS[2:]:
+        writer.add(route_id, chain, texts, keywords)
+    writer.write(str(tmp_path / 'resumed.bin'))
+    resumed = TextIndex(str(tmp_path / 'resumed.bin'))
+    assert resumed.route_ids == whole.route_ids
+    assert resumed.doc_lengths.tolist() == whole.doc_lengths.tolist()
+    for query in ['crack', '"hand crack"', 'great crimps']:
+        assert resumed.search(query) == whole.search(query)
+    resumed.close()
+    whole.close()
+
+
+def test_empty_index(tmp_path):
+    TextIndexWriter().write(str(tmp_path / 'empty.bin'))
+    index = TextIndex(str(tmp_path / 'empty.bin'))
+    assert index.num_docs == 0
+    assert index.search('crack') == []
+    index.close()
@@ -4,11 +4,10 @@
 from __future__ import annotations
 
 from copy import deepcopy
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, TYPE_CHECKING
 
-import spacy
-from spacy.lookups import load_lookups
-from spacy.tokens.token import Token
+if TYPE_CHECKING:
+    from spacy.tokens.token import Token
 
 SMALL = 'en_core_web_sm'
 MEDIUM = 'en_core_web_md'
@@ -24,6 +23,11 @@ PHRASE_ENDS_BAD_POS = {'CCONJ'}
 
 class TextAnalyzer:
     def __init__(self, model: str):
+        # spaCy takes seconds to import, so it is only imported once a text
+        # analyzer is needed.
+        import spacy
+        from spacy.lookups import load_lookups
+
         self.nlp = spacy.load(model)
         self.prob = (
             load_lookups('en', ['lexeme_prob']).get_table('lexeme_prob')
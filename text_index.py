@@ -0,0 +1,390 @@
+"""
+@author: yuan.shao
+"""
+from __future__ import annotations
+
+import getopt
+import math
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+from array import array
+from threading import Lock
+from time import time
+from typing import Any, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from hierarchy import AreaHierarchy
+from loader import records_from_df
+from utils import MP_WEBSITE
+
+TEXT_INDEX_FILE = 'text_index.bin'
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Position gap between paragraphs and keyword phrases, so that a phrase query
+# does not match across them.
+GAP = 2
+
+# Tokens never contain '@', so area terms cannot match query words.
+AREA_PREFIX = '@'
+POSITION_STRIDE = 1 << 32
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+HEADER = struct.Struct('<Q')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def encode_varint(n: int, out: bytearray) -> None:
+    """
+    Append a non-negative integer to out, 7 bits per byte, low bits first, with
+    the high bit set on every byte but the last.
+    """
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """
+    Decode a stream of varints written by encode_varint.
+    """
+    a = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(a < 0x80)
+    if len(ends) == len(a):
+        return a.astype(np.int64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(a)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((a & 0x7f).astype(np.int64) << shifts, starts)
+
+
+class Postings:
+    """
+    Compressed posting list of one term: a stream of (doc id gap, term
+    frequency) varint pairs, and a separate stream of position gaps within
+    each doc, so that positions are only decoded for phrase queries.
+    """
+    __slots__ = ('docs', 'positions', 'last_doc', 'df')
+
+    def __init__(self) -> None:
+        self.docs = bytearray()
+        self.positions = bytearray()
+        self.last_doc = -1
+        self.df = 0
+
+    def add(self, doc: int, positions: List[int]) -> None:
+        encode_varint(doc - self.last_doc, self.docs)
+        encode_varint(len(positions), self.docs)
+        prev = 0
+        for p in positions:
+            encode_varint(p - prev, self.positions)
+            prev = p
+        self.last_doc = doc
+        self.df += 1
+
+
+class TextIndexWriter:
+    """
+    Builds the inverted index as routes are read. Route texts are added from
+    several threads, so doc ids are assigned under a lock.
+    """
+    def __init__(self) -> None:
+        self.route_ids = []
+        self.doc_lengths = array('l')
+        self.postings = dict()  # term -> Postings
+        self.lock = Lock()
+
+    @classmethod
+    def load(cls, path: str) -> TextIndexWriter:
+        """
+        Load an index written by write() to keep adding routes to it.
+        """
+        writer = cls()
+        index = TextIndex(path)
+        writer.route_ids = index.route_ids
+        writer.doc_lengths = array('l', index.doc_lengths.tolist())
+        for term, (d_off, d_len, p_off, p_len, last_doc, df) in (
+            index.terms.items()
+        ):
+            p = Postings()
+            p.docs = bytearray(index.blob[d_off:d_off + d_len])
+            p.positions = bytearray(index.blob[p_off:p_off + p_len])
+            p.last_doc = last_doc
+            p.df = df
+            writer.postings[term] = p
+        index.close()
+        return writer
+
+    def __len__(self) -> int:
+        return len(self.route_ids)
+
+    def add(
+        self,
+        route_id: str,
+        location_chain: List[str],
+        texts: List[str],
+        keywords: List[str],
+    ) -> None:
+        """
+        Index the cleaned texts of a route followed by its keyword phrases.
+        Every area of the location chain is indexed as a term too, so routes
+        can be filtered by area subtree.
+        """
+        term_positions = dict()
+        pos = 0
+        for text in list(texts) + list(keywords):
+            for token in tokenize(text):
+                term_positions.setdefault(token, []).append(pos)
+                pos += 1
+            pos += GAP
+        for a in location_chain:
+            term_positions[AREA_PREFIX + a] = [0]
+        with self.lock:
+            doc = len(self.route_ids)
+            self.route_ids.append(route_id)
+            self.doc_lengths.append(pos)
+            for term, positions in term_positions.items():
+                if term not in self.postings:
+                    self.postings[term] = Postings()
+                self.postings[term].add(doc, positions)
+
+    def add_route(self, route: Any) -> None:
+        """
+        Index a Route object whose raw comments and descriptions have not been
+        released yet.
+        """
+        self.add(
+            route.id, route.location_chain,
+            list(route.comments) + list(route.descriptions),
+            [route.keyword_counts[2 * i] for i in range(
+                len(route.keyword_counts) // 2
+            )],
+        )
+
+    def write(self, path: str) -> None:
+        """
+        Write the index to path: a header with the length of the pickled
+        dictionary, the dictionary, then the concatenated posting lists.
+        """
+        with self.lock:
+            terms = dict()
+            blob = bytearray()
+            for term, p in self.postings.items():
+                d_off = len(blob)
+                blob += p.docs
+                p_off = len(blob)
+                blob += p.positions
+                terms[term] = (
+                    d_off, len(p.docs), p_off, len(p.positions), p.last_doc,
+                    p.df,
+                )
+            dictionary = pickle.dumps({
+                'route_ids': self.route_ids,
+                'doc_lengths': self.doc_lengths,
+                'terms': terms,
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(len(dictionary)))
+            f.write(dictionary)
+            f.write(blob)
+        os.replace(tmp, path)
+
+
+class TextIndex:
+    """
+    Read side of the inverted index. The dictionary is loaded into memory and
+    the posting lists are memory-mapped and decoded on demand.
+    """
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'rb')
+        (n,) = HEADER.unpack(self.file.read(HEADER.size))
+        dictionary = pickle.loads(self.file.read(n))
+        self.route_ids = dictionary['route_ids']
+        self.doc_lengths = np.array(dictionary['doc_lengths'])
+        self.terms = dictionary['terms']
+        self.num_docs = len(self.route_ids)
+        self.avg_length = self.doc_lengths.mean() if self.num_docs else 0
+        self.mmap = None
+        self.view = memoryview(b'')
+        self.blob = self.view
+        if os.path.getsize(path) > HEADER.size + n:
+            self.mmap = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ,
+            )
+            self.view = memoryview(self.mmap)
+            self.blob = self.view[HEADER.size + n:]
+
+    def close(self) -> None:
+        self.blob.release()
+        self.view.release()
+        if self.mmap is not None:
+            self.mmap.close()
+        self.file.close()
+
+    def doc_freqs(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the docs containing a term and the term frequency in each.
+        """
+        if term not in self.terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        d_off, d_len, _, _, _, _ = self.terms[term]
+        values = decode_varints(self.blob[d_off:d_off + d_len])
+        return np.cumsum(values[0::2]) - 1, values[1::2]
+
+    def doc_positions(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return every occurrence of a term as parallel arrays of docs and
+        positions within the doc.
+        """
+        docs, tfs = self.doc_freqs(term)
+        if len(docs) == 0:
+            return docs, docs
+        _, _, p_off, p_len, _, _ = self.terms[term]
+        gaps = decode_varints(self.blob[p_off:p_off + p_len])
+        sums = np.cumsum(gaps)
+        starts = np.cumsum(tfs) - tfs
+        # Positions restart from 0 in every doc.
+        before = sums[starts] - gaps[starts]
+        return np.repeat(docs, tfs), sums - np.repeat(before, tfs)
+
+    def phrase_freqs(self, words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the docs containing a phrase of several words and the number of
+        occurrences in each.
+        """
+        keys = None
+        for i, w in enumerate(words):
+            docs, positions = self.doc_positions(w)
+            # Key each occurrence by its doc and the position the phrase would
+            # start at, so that matches are the keys shared by all words.
+            k = docs * POSITION_STRIDE + (positions - i)
+            keys = k if keys is None else np.intersect1d(
+                keys, k, assume_unique=True,
+            )
+            if len(keys) == 0:
+                break
+        docs, counts = np.unique(keys // POSITION_STRIDE, return_counts=True)
+        return docs, counts
+
+    def area_docs(self, area_ids: Set[str]) -> np.ndarray:
+        """
+        Return the docs of the routes under any of the given areas.
+        """
+        return np.unique(np.concatenate(
+            [np.zeros(0, dtype=np.int64)]
+            + [self.doc_freqs(AREA_PREFIX + a)[0] for a in area_ids]
+        ))
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 20,
+        area_ids: Optional[Set[str]] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Rank the routes by BM25 over the words and "quoted phrases" of the
+        query. Each phrase is scored as one term. If area_ids is given, only
+        routes under one of those areas are returned. Return the top_k
+        (route id, score) pairs.
+        """
+        scores = np.zeros(self.num_docs)
+        for unit in parse_query(query):
+            docs, tfs = (
+                self.phrase_freqs(unit) if len(unit) > 1
+                else self.doc_freqs(unit[0])
+            )
+            df = len(docs)
+            if df == 0:
+                continue
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            norm = (
+                1 - BM25_B
+                + BM25_B * self.doc_lengths[docs] / self.avg_length
+            )
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + BM25_K1 * norm)
+        if area_ids is not None:
+            allowed = np.zeros(self.num_docs, dtype=bool)
+            allowed[self.area_docs(area_ids)] = True
+            scores[~allowed] = 0
+        hits = np.flatnonzero(scores > 0)
+        top = hits[np.argsort(-scores[hits], kind='stable')[:top_k]]
+        return [(self.route_ids[doc], float(scores[doc])) for doc in top]
+
+
+def parse_query(query: str) -> List[List[str]]:
+    """
+    Split a query into its "quoted phrases" and single words, each as a list
+    of tokens.
+    """
+    units = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        tokens = tokenize(phrase if phrase else word)
+        if phrase and tokens:
+            units.append(tokens)
+        else:
+            units.extend([[t] for t in tokens])
+    return units
+
+
+def main():
+    short_options = 'a:d:k:q:'
+    long_options = ['area=', 'output-dir=', 'top=', 'query=']
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], short_options, long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
+
+    output_dir = 'output'
+    top_k = 20
+    query = ''
+    areas = []
+    for a, v in args:
+        if a in ('-a', '--area'):
+            areas.append(v)
+        elif a in ('-d', '--output-dir'):
+            output_dir = v
+        elif a in ('-k', '--top'):
+            top_k = int(v)
+        elif a in ('-q', '--query'):
+            query = v
+
+    area_ids = None
+    if areas:
+        hierarchy = AreaHierarchy.from_areas(
+            records_from_df(pd.read_pickle(f'{output_dir}/areas.pkl'))
+        )
+        area_ids = {
+            i for area in areas
+            for i in ([area] if area in hierarchy else hierarchy.find(area))
+        }
+        if not area_ids:
+            print(f'No area found for {areas}')
+            sys.exit(1)
+
+    index = TextIndex(f'{output_dir}/{TEXT_INDEX_FILE}')
+    start_time = time()
+    results = index.search(query, top_k=top_k, area_ids=area_ids)
+    search_time = time() - start_time
+    for route_id, score in results:
+        print(f'{score:.3f}  {MP_WEBSITE}/route/{route_id}')
+    print(
+        f'{len(results)} of {index.num_docs} routes in '
+        f'{1000 * search_time:.1f}ms'
+    )
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
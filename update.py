@@ -1,233 +1,152 @@
 """
 @author: yuan.shao
 """
+import getopt
 import os
 import sys
-from queue import Queue
-from threading import Thread
-from time import time
 
-import pandas as pd
-from requests.exceptions import RequestException
-
-from area import read_an_area
-from route import Route
-from text_analyzer import SMALL, TextAnalyzer
-from utils import elapsed, remaining, STATES
+from metrics import Exporter, REGISTRY
+from output import OUTPUT_DIR
+from pipeline import (
+    build_outputs, crawl_areas, crawl_route_details, load_areas_and_routes,
+    open_dead_letters, STAGES,
+)
+from profiling import enable, MODES
+from scheduler import CrawlBudget
+from sink import RouteSink
 
-MAX_RETRY = 3
-NUM_OF_THREADS = 100
-CHUNK = 1000
+# Whether to build the full-text index of route comments, descriptions and
+# keywords while reading route details.
+BUILD_TEXT_INDEX = False
+# Whether to check the star ratings of a route first and skip reading its
+# comments and generating its keywords if it cannot be a good route. Such
+# routes are saved as lite records, so lowering SCORE_THRESHOLD or
+# VOTES_THRESHOLD later requires reading them again.
+PRUNE_BY_STATS = True
+# Whether to read again the stored routes that are due by the recrawl
+# schedule, generating keywords again only for routes whose texts changed,
+# and at most how many of them. Routes read again are not updated in the
+# text index.
+RECRAWL = False
+RECRAWL_BUDGET = None
+# File the metrics of fetches, parsing, NLP and crawl tasks are written to
+# every METRICS_INTERVAL seconds, as JSON lines, or in the Prometheus text
+# format if it ends with .prom.
+METRICS_FILE = f'{OUTPUT_DIR}/metrics.jsonl'
+METRICS_INTERVAL = 60
+# Whether to stream the good routes to the outputs as their details are read,
+# so partial outputs are usable during the crawl, and sort them at the end in
+# bounded memory instead of building the outputs from all route details.
+STREAM_OUTPUTS = True
+# Seconds between snapshots of the streamed outputs written during the crawl.
+SNAPSHOT_INTERVAL = 600
+# Whether to read first the areas and routes expected to yield the most good
+# routes by the route details stored before, so a crawl cut short by its
+# budget, TIME_BUDGET seconds or REQUEST_BUDGET pages, or stopped, has the
+# most useful routes. The pages left are read by the next run.
+PRIORITIZE = True
+TIME_BUDGET = None
+REQUEST_BUDGET = None
 
-TEXT_ANALYZER = TextAnalyzer(SMALL)
+# --profile cprofile or --profile sample writes a profile of every stage to
+# PROFILE_DIR. Pages that fail every try are kept in the dead letters store of
+# OUTPUT_DIR and read again at the end of their stage, and --replay reads
+# again only them, with the routes under the areas among them, before writing
+# the outputs. --stage, given once for each stage, runs only those stages of
+# STAGES, loading what the others stored before. --time-budget and
+# --request-budget override TIME_BUDGET and REQUEST_BUDGET.
+PROFILE_DIR = f'{OUTPUT_DIR}/profiles'
 
-SCORE_THRESHOLD = 3.0
-VOTES_THRESHOLD = 10
 
-OUTPUT_DIR = 'output'
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+def main():
+    long_options = [
+        'profile=', 'replay', 'request-budget=', 'stage=', 'time-budget=',
+    ]
+    try:
+        args, _ = getopt.getopt(sys.argv[1:], '', long_options)
+    except getopt.error as err:
+        print(str(err))
+        sys.exit(2)
 
-kill_thread = False
+    profiler = None
+    replay = False
+    stages = []
+    time_budget = TIME_BUDGET
+    request_budget = REQUEST_BUDGET
+    for a, v in args:
+        if a == '--replay':
+            replay = True
+        elif a == '--time-budget':
+            time_budget = float(v)
+        elif a == '--request-budget':
+            request_budget = int(v)
+        elif a == '--stage':
+            if v not in STAGES:
+                print(f'Unknown stage {v}, choose from {STAGES}')
+                sys.exit(2)
+            stages.append(v)
+        elif a == '--profile':
+            if v not in MODES:
+                print(f'Unknown profile mode {v}, choose from {MODES}')
+                sys.exit(2)
+            profiler = enable(v, PROFILE_DIR)
+    if not stages:
+        stages = STAGES
 
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+    exporter = Exporter(REGISTRY, METRICS_FILE, METRICS_INTERVAL)
+    exporter.start()
+    dead_letters = open_dead_letters(OUTPUT_DIR)
+    crawl_budget = None
+    if time_budget is not None or request_budget is not None:
+        crawl_budget = CrawlBudget(time_budget, request_budget)
 
-# === Read all areas and routes ===============================================
-start_time = time()
-areas = dict()
-routes = []
-areas_file = f'{OUTPUT_DIR}/areas.pkl'
-routes_file = f'{OUTPUT_DIR}/routes.pkl'
-if os.path.exists(areas_file) and os.path.exists(routes_file):
-    areas_df = pd.read_pickle(areas_file)
-    areas = {row['area_id']: row.to_dict() for _, row in areas_df.iterrows()}
-    routes_df = pd.read_pickle(routes_file)
-    routes = [row.to_dict() for _, row in routes_df.iterrows()]
-    print(f'Areas and routes loaded from {areas_file} and {routes_file}')
-else:
-    def fetch_areas_and_routes():
-        while not kill_thread:
-            area_id, area_name, location_chain = q.get()
-            retry = 1
-            success = False
-            while retry <= MAX_RETRY:
-                try:
-                    this_area, next_areas, rts = read_an_area(
-                        area_id=area_id,
-                        area_name=area_name,
-                        location_chain=location_chain,
-                    )
-                    areas[area_id] = this_area
-                    new_to_read.extend(next_areas)
-                    routes.extend(rts)
-                    success = True
-                    break
-                except RequestException:
-                    retry += 1
-                    continue
-            if not success:
-                print(f'Fail to read area {area_id}/{area_name}')
-            q.task_done()
-    to_read = []
-    for state in STATES:
-        s = state.split('/')
-        to_read.append((s[0], s[1], [s[0]]))
-    q = Queue()
-    for _ in range(NUM_OF_THREADS):
-        th = Thread(target=fetch_areas_and_routes)
-        th.daemon = True
-        th.start()
-    while to_read:
-        print(
-            f'Length of area queue = {len(to_read)}. Reading '
-            f'{min(CHUNK, len(to_read))} areas'
-        )
-        read_start_time = time()
-        new_to_read = []
-        try:
-            for r in to_read[:CHUNK]:
-                if r[0] in areas:
-                    print(f'!!! REPEATED AREA: {areas[r[0]]}')
-                    continue
-                q.put(r)
-            q.join()
-        except KeyboardInterrupt:
-            kill_thread = True
-            sys.exit(1)
-        to_read = to_read[CHUNK:] + new_to_read
-        print(
-            f'Done in {elapsed(read_start_time)}. {len(new_to_read)} new '
-            f'areas added to area queue. Elapsed {elapsed(start_time)}'
+    areas, routes, hierarchy, new_routes = None, None, None, []
+    if 'areas' in stages or replay:
+        areas, routes, hierarchy, new_routes = crawl_areas(
+            OUTPUT_DIR, dead_letters, crawl_budget, PRIORITIZE,
         )
-    areas_df = pd.DataFrame(list(areas.values())).reset_index(drop=True)
-    areas_df.to_pickle(areas_file)
-    print(f'Areas written to {areas_file}')
-    routes_df = pd.DataFrame(routes).reset_index(drop=True)
-    routes_df.to_pickle(routes_file)
-    print(f'Routes written to {routes_file}')
-print(
-    f'Total number of areas = {len(areas)}, number of routes = {len(routes)}'
-)
-
-
-# === Read route details ======================================================
-start_time = time()
-route_details = []
-route_details_file = f'{OUTPUT_DIR}/route_details.pkl'
-df = pd.DataFrame()
-start_idx = 0
-if os.path.exists(route_details_file):
-    df = pd.read_pickle(route_details_file)
-    route_details = [row.to_dict() for _, row in df.iterrows()]
-    start_idx = len(route_details)
-    print(f'Load {len(route_details)} route details from {route_details_file}')
-if start_idx < len(routes):
-    def fetch_route_details():
-        while not kill_thread:
-            task = q.get()
-            retry = 1
-            success = False
-            while retry <= MAX_RETRY:
-                try:
-                    route = Route.read_from_web(
-                        route_id=task['route_id'],
-                        route_name=task['route_name'],
-                        location_chain=task['location_chain'],
-                        location_name_chain=[
-                            areas.get(a, dict()).get('area_name', '')
-                            for a in task['location_chain']
-                        ],
-                        text_analyzer=TEXT_ANALYZER,
-                    )
-                    route_details.append(route.to_map())
-                    success = True
-                    break
-                except RequestException:
-                    retry += 1
-                    continue
-            if not success:
-                print(
-                    f"Fail to read details of route "
-                    f"{task['route_id']}/{task['route_name']}"
-                )
-            q.task_done()
-    q = Queue()
-    for _ in range(NUM_OF_THREADS):
-        th = Thread(target=fetch_route_details)
-        th.daemon = True
-        th.start()
-    for j in range(start_idx, len(routes), CHUNK):
-        print(
-            f'Reading details of routes {j + 1} to '
-            f'{min(j + CHUNK, len(routes))}'
+    route_details = None
+    sink = None
+    if 'details' in stages:
+        if areas is None:
+            loaded = load_areas_and_routes(OUTPUT_DIR)
+            if loaded is None:
+                print('No areas stored yet, run the areas stage first')
+                sys.exit(1)
+            areas, routes, hierarchy = loaded
+        if STREAM_OUTPUTS:
+            sink = RouteSink(areas, hierarchy, OUTPUT_DIR)
+        route_details = crawl_route_details(
+            routes, hierarchy, OUTPUT_DIR,
+            dead_letters=dead_letters,
+            new_routes=new_routes,
+            replay=replay,
+            build_text_index=BUILD_TEXT_INDEX,
+            prune_by_stats=PRUNE_BY_STATS,
+            recrawl=RECRAWL,
+            recrawl_budget=RECRAWL_BUDGET,
+            sink=sink,
+            crawl_budget=crawl_budget,
+            prioritize=PRIORITIZE,
+            snapshot_interval=SNAPSHOT_INTERVAL,
         )
-        read_start_time = time()
-        try:
-            for r in routes[j:(j + CHUNK)]:
-                q.put(r)
-            q.join()
-        except KeyboardInterrupt:
-            kill_thread = True
-            sys.exit(1)
-        dur = elapsed(read_start_time)
-        ela = elapsed(start_time)
-        rem = remaining(
-            start_time=start_time,
-            done_tasks=min(j + CHUNK, len(routes)) - start_idx,
-            total_tasks=len(routes) - start_idx,
+    if crawl_budget is not None and crawl_budget.exhausted():
+        print('Crawl budget spent, run again to read the pages left')
+    if 'output' in stages:
+        build_outputs(
+            areas, route_details,
+            hierarchy if route_details is not None else None,
+            OUTPUT_DIR,
+            sink=sink,
         )
-        print(f'Done in {dur}. Elapsed {ela}. Remaining {rem}')
-        df = pd.DataFrame(route_details).reset_index(drop=True)
-        df.to_pickle(route_details_file)
+    elif sink is not None:
+        sink.flush()
+    exporter.stop()
+    if profiler is not None:
+        profiler.close()
 
 
-# === Output good routes ======================================================
-df = df[
-    df.apply(
-        lambda row: (
-            row['avg_score'] >= SCORE_THRESHOLD
-            and row['votes'] >= VOTES_THRESHOLD
-            and set(row['types']).issubset(
-                {'Sport', 'Trad', 'Boulder', 'Aid', 'Alpine', 'TR'}
-            )
-            and len(row['location_chain']) > 0
-        ),
-        axis=1,
-    )
-]
-print(f'Total {len(df)} good routes found')
-
-output_df = pd.DataFrame()
-output_df['name'] = df['display_name']
-output_df['location'] = df['location_chain'].map(
-    lambda c: ' > '.join(
-        [areas.get(a, dict()).get('display_name', '') for a in c]
-    )
-)
-output_df['latitude'] = df['location_chain'].map(
-    lambda c: areas.get(c[-1], dict()).get('latitude', '')
-)
-output_df['longitude'] = df['location_chain'].map(
-    lambda c: areas.get(c[-1], dict()).get('longitude', '')
-)
-output_df['score'] = df['avg_score']
-output_df['votes'] = df['votes']
-output_df['types'] = df['types'].map(lambda t: ' / '.join(t))
-output_df['grade'] = df['grade'].map(lambda g: ' / '.join(g))
-output_df['height'] = df['height'].map(lambda h: str(h) if h > 0 else '')
-output_df['pitches'] = df['pitches'].map(lambda p: str(p) if p > 1 else '')
-output_df['keywords'] = df['keywords'].map(lambda k: ' | '.join(k))
-output_df['link'] = df['link']
-output_df = output_df.sort_values(
-    by=['score', 'votes', 'name'], ascending=[False, False, True],
-)
-
-boulder_df = output_df[
-    output_df.apply(
-        lambda row: 'Boulder' in row['types'] and row['pitches'] == '',
-        axis=1,
-    )
-].reset_index(drop=True)
-boulder_df.to_csv(f'{OUTPUT_DIR}/boulder_routes.csv')
-rope_df = output_df[output_df['types'] != 'Boulder'].reset_index(drop=True)
-rope_df.to_csv(f'{OUTPUT_DIR}/rope_routes.csv')
-print(f'Output {len(boulder_df)} boulder routes, {len(rope_df)} rope routes')
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,15 @@
 @author: yuan.shao
 """
 import html
+import os
 import re
 from time import time
 from typing import Any, List
 
 
-MP_WEBSITE = 'https://www.mountainproject.com'
+# Can be pointed at another server, e.g. the stub server of the benchmarks,
+# with the MP_WEBSITE environment variable.
+MP_WEBSITE = os.environ.get('MP_WEBSITE', 'https://www.mountainproject.com')
 
 STATES = [
     '105905173/alabama', '105909311/alaska', '105708962/arizona',
@@ -0,0 +1,61 @@
+"""
+@author: yuan.shao
+"""
+from threading import local
+from typing import TYPE_CHECKING
+
+from metrics import REGISTRY
+
+if TYPE_CHECKING:
+    import requests
+
+# Connections kept open per host by the session of every thread.
+POOL_SIZE = 4
+
+SESSIONS = local()
+# Pages fetched, of any kind, read by crawl budgets.
+REQUESTS = REGISTRY.counter('fetch_requests_total')
+
+
+def session() -> 'requests.Session':
+    """
+    Return the session of the calling thread, so every thread reuses its own
+    pooled keep-alive connections instead of opening one per page. requests
+    is only imported once a page is fetched, so modules using fetch() load
+    fast when they do not.
+    """
+    s = getattr(SESSIONS, 'session', None)
+    if s is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        s = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+        )
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        SESSIONS.session = s
+    return s
+
+
+def fetch(url: str, kind: str) -> str:
+    """
+    Get a page and return the str of its content bytes, which is what the
+    parsers expect. A response with an error status, e.g. 404, 429 or 503,
+    raises requests.HTTPError, so the page is tried again and dead-lettered
+    instead of parsed as an empty page. The latency, bytes and errors of the
+    fetches are recorded by kind of page: area, route, stats or comments.
+    """
+    from requests.exceptions import RequestException
+
+    REQUESTS.inc()
+    try:
+        with REGISTRY.histogram('fetch_seconds', kind=kind).time():
+            response = session().get(url)
+        response.raise_for_status()
+    except RequestException:
+        REGISTRY.counter('fetch_errors_total', kind=kind).inc()
+        raise
+    REGISTRY.counter('fetch_bytes_total', kind=kind).inc(len(response.content))
+    return str(response.content)